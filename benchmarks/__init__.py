@@ -0,0 +1,254 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import sys
+import time
+import types
+
+
+def _oracle_stub():
+    # Stand-in for cx_Oracle: benchmarks write rows to DiscardConnection,
+    # so they run without the Oracle client
+    def connect(*args, **kwargs):
+        raise RuntimeError("cx_Oracle is not installed")
+
+    module = types.ModuleType("cx_Oracle")
+    module.CLOB = "CLOB"
+    module.NATIVE_FLOAT = "NATIVE_FLOAT"
+    module.DatabaseError = Exception
+    module.connect = connect
+    return module
+
+
+try:
+    import cx_Oracle
+except ImportError:
+    sys.modules["cx_Oracle"] = _oracle_stub()
+
+
+class DiscardConnection(object):
+    # Accepts and drops rows: the insert loop is timed without Oracle
+    def commit(self):
+        pass
+
+    def cursor(self):
+        return _DiscardCursor(self)
+
+
+def cli():
+    import argparse
+    import json
+    import platform
+    import tempfile
+    from datetime import datetime
+
+    parser = argparse.ArgumentParser(
+        description="Benchmarks for interpro-sets"
+    )
+    parser.add_argument("-o", "--output",
+                        help="JSON output file (default: standard output)")
+
+    subparsers = parser.add_subparsers(dest="suite")
+    subparsers.required = True
+
+    _parser = subparsers.add_parser(
+        "parsers", help="parsers and insert loop, on synthetic data"
+    )
+    _parser.add_argument("--scale",
+                         help="data size multiplier (default: 1)",
+                         type=float,
+                         default=1)
+    _parser.add_argument("--repeat",
+                         help="timings per benchmark (default: 3)",
+                         type=int,
+                         default=3)
+    _parser.add_argument("--dir",
+                         help="directory for synthetic files",
+                         default=tempfile.gettempdir())
+
+    _parser = subparsers.add_parser(
+        "pipeline", help="end-to-end run, with stand-ins for HMMER/COMPASS"
+    )
+    _parser.add_argument("database", choices=("cdd", "pfam"))
+    _parser.add_argument("--scale",
+                         help="data size multiplier (default: 1)",
+                         type=float,
+                         default=1)
+    _parser.add_argument("--repeat",
+                         help="timings per benchmark (default: 1)",
+                         type=int,
+                         default=1)
+    _parser.add_argument("--dir",
+                         help="directory for synthetic files",
+                         default=tempfile.gettempdir())
+    _parser.add_argument("-t", "--threads",
+                         help="number of threads (default: 1)",
+                         type=int,
+                         default=1)
+    _parser.add_argument("--chunk-size",
+                         help="CDD domains per COMPASS process (default: 1)",
+                         type=int,
+                         default=1)
+    _parser.add_argument("--startup",
+                         help="seconds per tool process (default: 0.02)",
+                         type=float)
+    _parser.add_argument("--latency",
+                         help="seconds per search of a 300-residue query "
+                              "against 1000 models/profiles (default: 0.05)",
+                         type=float)
+    _parser.add_argument("--hits",
+                         help="hits per query (default: 50)",
+                         type=int)
+    _parser.add_argument("--failures",
+                         help="probability that a tool run fails "
+                              "(default: 0)",
+                         type=float)
+    _parser.add_argument("--long",
+                         help="pfam: number of models ten times longer "
+                              "than others (default: 0)",
+                         type=int,
+                         default=0,
+                         dest="n_long",
+                         metavar="NUM_MODELS")
+    _parser.add_argument("--shards",
+                         help="pfam: HMM database shards for the longest "
+                              "queries (default: 1)",
+                         type=int,
+                         default=1)
+    _parser.add_argument("--buffer-size",
+                         help="memory for rows waiting to be inserted, "
+                              "in MB (default: 64)",
+                         type=int,
+                         metavar="MB")
+    _parser.add_argument("--timings",
+                         help="durations of searches (read, then updated)",
+                         metavar="FILE")
+    _parser.add_argument("--metrics",
+                         help="write the pipeline metrics "
+                              "of the last run to this file (JSON lines)",
+                         metavar="FILE")
+
+    _parser = subparsers.add_parser(
+        "api", help="load test of the web application"
+    )
+    _parser.add_argument("--url",
+                         help="URL of the running application "
+                              "(default: http://127.0.0.1:5000)",
+                         default="http://127.0.0.1:5000")
+    _parser.add_argument("--sets",
+                         help="sets sampled per database (default: 10)",
+                         type=int,
+                         default=10)
+    _parser.add_argument("-c", "--concurrency",
+                         help="concurrent requests (default: 4)",
+                         type=int,
+                         default=4)
+    _parser.add_argument("--repeat",
+                         help="requests per URL (default: 1)",
+                         type=int,
+                         default=1)
+    _parser.add_argument("--no-compression",
+                         help="do not accept compressed responses",
+                         action="store_false",
+                         dest="compressed")
+
+    args = parser.parse_args()
+
+    report = {
+        "suite": args.suite,
+        "date": datetime.now().isoformat(),
+        "host": platform.node(),
+        "python": platform.python_version(),
+        "parameters": {
+            k: v for k, v in vars(args).items()
+            if k not in ("suite", "output")
+        }
+    }
+
+    if args.suite == "parsers":
+        from . import parsers
+
+        with tempfile.TemporaryDirectory(dir=args.dir) as workdir:
+            report["results"] = parsers.run(workdir,
+                                            scale=args.scale,
+                                            repeat=args.repeat)
+    elif args.suite == "pipeline":
+        from . import pipeline
+
+        with tempfile.TemporaryDirectory(dir=args.dir) as workdir:
+            report["results"] = pipeline.run(workdir,
+                                             database=args.database,
+                                             scale=args.scale,
+                                             processes=args.threads,
+                                             chunk_size=args.chunk_size,
+                                             repeat=args.repeat,
+                                             startup=args.startup,
+                                             latency=args.latency,
+                                             hits=args.hits,
+                                             failures=args.failures,
+                                             metrics_file=args.metrics,
+                                             n_long=args.n_long,
+                                             shards=args.shards,
+                                             buffer_size=args.buffer_size,
+                                             timings_file=args.timings)
+    else:
+        from . import api
+
+        report["results"] = api.run(args.url,
+                                    n_sets=args.sets,
+                                    concurrency=args.concurrency,
+                                    repeat=args.repeat,
+                                    compressed=args.compressed)
+
+    if args.output:
+        with open(args.output, "wt") as fh:
+            json.dump(report, fh, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+
+
+def measure(name, func, items, unit, repeat=3):
+    timings = []
+    for _ in range(repeat):
+        t = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - t)
+
+    timings.sort()
+    return {
+        "name": name,
+        "items": items,
+        "unit": unit,
+        "repeat": repeat,
+        "min": timings[0],
+        "median": percentile(timings, 50),
+        "items_per_second": items / timings[0] if timings[0] else None
+    }
+
+
+def percentile(values, p):
+    # `values` must be sorted
+    if not values:
+        return None
+    k = (len(values) - 1) * p / 100
+    i = int(k)
+    j = min(i + 1, len(values) - 1)
+    return values[i] + (values[j] - values[i]) * (k - i)
+
+
+class _DiscardCursor(object):
+    def __init__(self, connection):
+        self.connection = connection
+
+    def close(self):
+        pass
+
+    def execute(self, *args, **kwargs):
+        pass
+
+    def executemany(self, *args, **kwargs):
+        pass
+
+    def setinputsizes(self, *args, **kwargs):
+        pass
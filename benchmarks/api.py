@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import gzip
+import json
+import random
+import re
+import time
+from multiprocessing.dummy import Pool
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+from . import percentile
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def accept_encoding():
+    return "br, gzip" if brotli is not None else "gzip"
+
+
+def fetch(url, headers=None):
+    # (status, decoded body, seconds, bytes received)
+    req = Request(url, headers=headers or {})
+    t = time.perf_counter()
+    try:
+        with urlopen(req) as res:
+            body = res.read()
+            status = res.status
+            encoding = res.headers.get("Content-Encoding")
+    except HTTPError as exc:
+        body = exc.read()
+        status = exc.code
+        encoding = exc.headers.get("Content-Encoding")
+
+    elapsed = time.perf_counter() - t
+    wire = len(body)
+    if encoding == "gzip":
+        body = gzip.decompress(body)
+    elif encoding == "br":
+        body = brotli.decompress(body)
+
+    return status, body, elapsed, wire
+
+
+def discover(url, n_sets, seed=0):
+    # Pick sets and entries to query, from the API itself
+    rng = random.Random(seed)
+    urls = {
+        "databases": [url + "/api/databases/"],
+        "database": [],
+        "set": [],
+        "targets": [],
+        "relationships": [],
+        "similarity": [],
+        "static": []
+    }
+
+    _, body, _, _ = fetch(urls["databases"][0])
+    for db in json.loads(body.decode("utf-8")):
+        db_url = "{}/api/database/{}/".format(url, db["id"])
+        urls["database"].append(db_url)
+
+        _, body, _, _ = fetch(db_url)
+        sets = json.loads(body.decode("utf-8"))
+        for s in rng.sample(sets, min(n_sets, len(sets))):
+            set_url = "{}/api/set/{}/".format(url, s["accession"])
+            urls["set"].append(set_url)
+            urls["relationships"].append(set_url + "relationships/")
+            urls["similarity"].append(set_url + "similarity/")
+
+            _, body, _, _ = fetch(set_url)
+            for m in json.loads(body.decode("utf-8"))[:3]:
+                urls["targets"].append(
+                    "{}/api/entry/{}/targets/".format(url, m["accession"])
+                )
+
+    if urls["set"]:
+        # Scripts and stylesheets of the set page
+        _, body, _, _ = fetch(urls["set"][0].replace("/api/set/", "/set/"))
+        for path in re.findall(r'(?:src|href)="(/(?:static|assets)/[^"]+)"',
+                               body.decode("utf-8")):
+            urls["static"].append(url + path)
+
+    return urls
+
+
+def run(url, n_sets=10, concurrency=4, repeat=1, compressed=True):
+    url = url.rstrip("/")
+    headers = {"Accept-Encoding": accept_encoding() if compressed
+               else "identity"}
+    results = []
+    for name, urls in discover(url, n_sets).items():
+        urls = urls * repeat
+        if not urls:
+            continue
+
+        t = time.perf_counter()
+        with Pool(concurrency) as pool:
+            responses = pool.map(lambda u: fetch(u, headers), urls)
+        wall = time.perf_counter() - t
+
+        latencies = sorted(r[2] for r in responses)
+        sizes = [len(r[1]) for r in responses]
+        wire = [r[3] for r in responses]
+        results.append({
+            "name": name,
+            "requests": len(responses),
+            "errors": sum(1 for r in responses if r[0] >= 500),
+            "not_found": sum(1 for r in responses if r[0] == 404),
+            "concurrency": concurrency,
+            "seconds": wall,
+            "requests_per_second": len(responses) / wall,
+            "latency": {
+                "mean": sum(latencies) / len(latencies),
+                "p50": percentile(latencies, 50),
+                "p95": percentile(latencies, 95),
+                "max": latencies[-1]
+            },
+            "bytes": {
+                "total": sum(sizes),
+                "mean": sum(sizes) / len(sizes),
+                "wire_total": sum(wire),
+                "wire_mean": sum(wire) / len(wire),
+                "ratio": sum(wire) / sum(sizes) if sum(sizes) else None
+            }
+        })
+
+    return results
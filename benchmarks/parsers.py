@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import random
+import re
+
+from interprosets import utils
+
+from . import DiscardConnection, measure, synthetic
+
+
+def run(workdir, scale=1, repeat=3):
+    rng = random.Random(0)
+    results = []
+
+    # HMMER3 library (Pfam-like)
+    n = max(1, int(1000 * scale))
+    hmm_file = os.path.join(workdir, "library.hmm")
+    synthetic.write_hmm_library(hmm_file, n)
+    results.append(measure(
+        "parse_hmm", lambda: utils.parse_hmm(hmm_file), n, "models", repeat
+    ))
+
+    # hmmscan output of one query against the library
+    n = max(1, int(2000 * scale))
+    sequence = synthetic.random_sequence(rng, 400)
+    out_file = os.path.join(workdir, "query.out")
+    tab_file = os.path.join(workdir, "query.tab")
+    synthetic.write_hmmscan_output(
+        out_file, tab_file, "PF99999", sequence,
+        [("PF{:05d}".format(i), rng.randint(50, 500), 1 + i % 3)
+         for i in range(n)]
+    )
+    results.append(measure(
+        "parse_hmmscan_results",
+        lambda: utils.parse_hmmscan_results(out_file, tab_file),
+        n, "targets", repeat
+    ))
+
+    # COMPASS output of one CDD domain against the profile database
+    n = max(1, int(5000 * scale))
+    out_file = os.path.join(workdir, "domain.out")
+    synthetic.write_compass_output(out_file, n)
+    results.append(measure(
+        "parse_compass_results",
+        lambda: utils.parse_compass_results(out_file),
+        n, "targets", repeat
+    ))
+    results.append(measure(
+        "parse_compass_results[top_k=100]",
+        lambda: utils.parse_compass_results(out_file, 100),
+        min(n, 100), "targets", repeat
+    ))
+
+    # CDD masters: index, split, then read back each sequence
+    n = max(1, int(5000 * scale))
+    masters = os.path.join(workdir, "cddmasters.fa")
+    synthetic.write_cdd_masters(masters, n)
+    reo = re.compile(br">(gnl\|CDD\|\d+)\s+(cd\d+),")
+    records = []
+
+    def _index():
+        records[:] = [
+            (os.path.join(workdir, "cdd", m.group(2).decode() + ".fa"),
+             offset, length)
+            for m, offset, length in utils.index_fasta(masters, reo)
+        ]
+
+    results.append(measure("index_fasta", _index, n, "records", repeat))
+    results.append(measure(
+        "split_fasta",
+        lambda: utils.split_fasta(masters, records, processes=4),
+        n, "records", repeat
+    ))
+    results.append(measure(
+        "read_fasta",
+        lambda: [utils.read_fasta(dst) for dst, _, _ in records],
+        n, "files", repeat
+    ))
+
+    # Insert loop (row building and encoding, without database)
+    n = max(1, int(1000 * scale))
+    hits = utils.parse_hmmscan_results(
+        os.path.join(workdir, "query.out"), os.path.join(workdir, "query.tab")
+    )
+    targets = [
+        {
+            "accession": t["accession"],
+            "evalue": t["evalue"],
+            "evaluestr": t["evaluestr"],
+            "domains": [
+                {
+                    "query": dom["sequences"]["query"],
+                    "target": dom["sequences"]["target"],
+                    "ievalue": dom["ievalue"],
+                    "start": dom["coordinates"]["ali"]["start"],
+                    "end": dom["coordinates"]["ali"]["end"],
+                }
+                for dom in t["domains"]
+            ]
+        }
+        for t in hits[:50]
+    ]
+    records = [
+        ("PF{:05d}".format(i), None, sequence, targets) for i in range(n)
+    ]
+    results.append(measure(
+        "insert_results",
+        lambda: utils.insert_results(DiscardConnection(), "H", records, n),
+        n * len(targets), "rows", repeat
+    ))
+
+    return results
+
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+from contextlib import contextmanager
+
+from interprosets import cdd, metrics, pfam, utils
+
+from . import DiscardConnection, measure, synthetic, tools
+
+
+def run(workdir, database="pfam", scale=1, processes=1, chunk_size=1,
+        repeat=1, startup=None, latency=None, hits=None, failures=None,
+        metrics_file=None, n_long=0, shards=1, buffer_size=None,
+        timings_file=None):
+    # End-to-end run, with stand-ins for external tools and database
+    config = {
+        "STARTUP": startup,
+        "LATENCY": latency,
+        "HITS": hits,
+        "FAILURES": failures
+    }
+    for key, value in config.items():
+        if value is not None:
+            os.environ["INTERPROSETS_FAKE_" + key] = str(value)
+
+    utils.set_tools(tools.install(os.path.join(workdir, "bin")))
+
+    if buffer_size is None:
+        buffer_size = utils.BUFFER_SIZE
+    else:
+        buffer_size *= 1024 ** 2
+
+    n = max(2, int(200 * scale))
+    if database == "cdd":
+        masters = os.path.join(workdir, "cddmasters.fa")
+        links = os.path.join(workdir, "family_superfamily_links")
+        accessions = synthetic.write_cdd_masters(masters, n)
+        with open(links, "wt") as fh:
+            for i, acc in enumerate(accessions):
+                fh.write("{}\t{}\tcl{:05d}\tsuperfamily\n".format(
+                    acc, i, i // 10
+                ))
+
+        def _run(tmpdir):
+            cdd.run(None, masters, links,
+                    processes=processes,
+                    tmpdir=tmpdir,
+                    chunk_size=chunk_size,
+                    timings=timings_file,
+                    buffer_size=buffer_size)
+    else:
+        hmm_db = os.path.join(workdir, "Pfam-A.hmm")
+        clans = os.path.join(workdir, "Pfam-A.clans.tsv")
+        accessions = synthetic.write_hmm_library(hmm_db, n, n_long=n_long)
+        with open(clans, "wt") as fh:
+            for i, acc in enumerate(accessions):
+                fh.write("{}\tCL{:04d}\n".format(acc, i // 10))
+
+        def _run(tmpdir):
+            pfam.run(None, hmm_db, clans,
+                     processes=processes,
+                     tmpdir=tmpdir,
+                     shards=shards,
+                     timings=timings_file,
+                     buffer_size=buffer_size)
+
+    runs = []
+
+    def _next_run():
+        tmpdir = os.path.join(workdir, "run{}".format(len(runs)))
+        os.mkdir(tmpdir)
+        runs.append(tmpdir)
+        metrics.start(metrics_file, tmpdir, interval=1)
+        _run(tmpdir)
+        metrics.finish()
+
+    with _discard_results():
+        return [measure("pipeline[{}]".format(database), _next_run, n,
+                        "entries", repeat)]
+
+
+@contextmanager
+def _discard_results():
+    load = utils.load
+
+    def _load(uri, dbcode, results, total, **kwargs):
+        utils.insert_results(DiscardConnection(), dbcode, results, total,
+                             **kwargs)
+
+    utils.load = _load
+    try:
+        yield
+    finally:
+        utils.load = load
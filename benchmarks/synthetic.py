@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import random
+
+AMINO_ACIDS = "ACDEFGHIKLMNPQRSTVWY"
+
+
+def random_sequence(rng, length):
+    return "".join(rng.choice(AMINO_ACIDS) for _ in range(length))
+
+
+def write_cdd_masters(filepath, n_domains, seed=0):
+    # cddmasters.fa: one representative sequence per domain
+    rng = random.Random(seed)
+    with open(filepath, "wt") as fh:
+        for i in range(n_domains):
+            fh.write(">gnl|CDD|{} cd{:05d}, dom{}, synthetic domain\n".format(
+                270000 + i, i, i
+            ))
+            seq = random_sequence(rng, rng.randint(50, 500))
+            for j in range(0, len(seq), 60):
+                fh.write(seq[j:j+60] + "\n")
+
+    return ["cd{:05d}".format(i) for i in range(n_domains)]
+
+
+def write_compass_output(filepath, n_hits, seed=0, query_id="gnl|CDD|270000",
+                         width=60, target_ids=None):
+    rng = random.Random(seed)
+    if target_ids is None:
+        target_ids = ["gnl|CDD|{}".format(280000 + i) for i in range(n_hits)]
+
+    with open(filepath, "wt") as fh:
+        fh.write("COMPASS 3.1\n\n")
+        fh.write("Ali1:  {}\n\n".format(query_id))
+        write_compass_hits(fh, query_id, target_ids, rng, width)
+        fh.write("Parameters:\n")
+
+
+def write_compass_hits(fh, query_id, target_ids, rng, width=60):
+    # One "Subject=" section per target, by increasing E-value
+    n_hits = len(target_ids)
+    for i, target_id in enumerate(target_ids):
+        length = rng.randint(50, 400)
+        query = _gapped(rng, length, "=")
+        target = _gapped(rng, length, "=")
+        fh.write("Subject= cd{0:03d}/cd{0:05d}.fa\n".format(i))
+        fh.write("length={0}\tfiltered_length={0}\t"
+                 "Neff=1.000\n".format(length))
+        fh.write("Smith-Waterman score = {}\tEvalue = {:.2e}\n\n".format(
+            rng.randint(50, 500), 1e-50 * 10 ** (i * 50 / max(n_hits, 1))
+        ))
+
+        for j in range(0, length, width):
+            q = query[j:j+width]
+            t = target[j:j+width]
+            if j:
+                fh.write("{:<23} {}\n".format(query_id, q))
+                fh.write("{:<23} {}\n".format("CONSENSUS_1", q))
+                fh.write("{:<23} {}\n".format("", " " * len(q)))
+                fh.write("{:<23} {}\n".format("CONSENSUS_2", t))
+                fh.write("{:<23} {}\n\n".format(target_id, t))
+            else:
+                fh.write("{:<16} {:<6} {}\n".format(query_id, 1, q))
+                fh.write("{:<16} {:<6} {}\n".format("CONSENSUS_1", 1, q))
+                fh.write("{:<23} {}\n".format("", " " * len(q)))
+                fh.write("{:<16} {:<6} {}\n".format("CONSENSUS_2", 1, t))
+                fh.write("{:<16} {:<6} {}\n\n".format(target_id, 1, t))
+
+
+def write_fasta(filepath, name, sequence):
+    with open(filepath, "wt") as fh:
+        fh.write(">{}\n".format(name))
+        for i in range(0, len(sequence), 60):
+            fh.write(sequence[i:i+60] + "\n")
+
+
+def write_hmm_library(filepath, n_models, seed=0, min_length=50,
+                      max_length=500, prefix="PF", n_long=0):
+    # HMMER3 text format, with full emission/transition lines.
+    # The last `n_long` models are ten times longer than `max_length`.
+    rng = random.Random(seed)
+    accessions = []
+    with open(filepath, "wt") as fh:
+        for i in range(n_models):
+            acc = "{}{:05d}".format(prefix, i)
+            accessions.append(acc)
+            if i >= n_models - n_long:
+                length = max_length * 10
+            else:
+                length = rng.randint(min_length, max_length)
+            write_hmm(fh, acc, length, rng)
+
+    return accessions
+
+
+def write_hmm(fh, acc, length, rng):
+    fh.write("HMMER3/f [3.1b2 | February 2015]\n")
+    fh.write("NAME  fam{}\n".format(acc))
+    fh.write("ACC   {}.1\n".format(acc))
+    fh.write("DESC  Synthetic family {}\n".format(acc))
+    fh.write("LENG  {}\n".format(length))
+    fh.write("ALPH  amino\n")
+    fh.write("GA    25.00 25.00;\n")
+    fh.write("HMM          " + "        ".join(AMINO_ACIDS) + "\n")
+    fh.write("            m->m     m->i     m->d     i->m     i->i     "
+             "d->m     d->d\n")
+    fh.write("  COMPO   " + _floats(rng, 20) + "\n")
+    fh.write("          " + _floats(rng, 20) + "\n")
+    fh.write("          " + _floats(rng, 7) + "\n")
+    for k in range(1, length + 1):
+        fh.write("{:>7} {} {:>6} {} - - -\n".format(
+            k, _floats(rng, 20), k, rng.choice(AMINO_ACIDS).lower()
+        ))
+        fh.write("        " + _floats(rng, 20) + "\n")
+        fh.write("        " + _floats(rng, 7) + "\n")
+    fh.write("//\n")
+
+
+def write_hmmscan_output(out_file, tab_file, query, sequence, targets,
+                         seed=0, width=60, accessions=True):
+    """
+    Write hmmscan outputs (plain text and --domtblout) for `query`.
+    `targets` is a list of (accession, length, number of domains).
+    If `accessions` is False, targets are reported by name only,
+    like PANTHER models.
+    """
+    rng = random.Random(seed)
+    qlen = len(sequence)
+    hits = []
+    for i, (acc, tlen, n_domains) in enumerate(targets):
+        evalue = 1e-50 * 10 ** (i * 50 / max(len(targets), 1))
+        domains = []
+        for j in range(n_domains):
+            ali_start = rng.randint(1, max(1, qlen // 2))
+            ali_end = rng.randint(ali_start, qlen)
+            hmm_start = rng.randint(1, max(1, tlen // 2))
+            hmm_end = min(tlen, hmm_start + ali_end - ali_start)
+            query_row, target_row = _hmmscan_rows(
+                rng, sequence[ali_start-1:ali_end]
+            )
+            domains.append((
+                evalue * (j + 1), evalue * (j + 2), hmm_start, hmm_end,
+                ali_start, ali_end, query_row, target_row
+            ))
+        hits.append((acc, tlen, evalue, domains))
+
+    with open(tab_file, "wt") as fh:
+        fh.write("#                                                                            --- full sequence --- -------------- this domain -------------   hmm coord   ali coord   env coord\n")
+        fh.write("# target name        accession   tlen query name           accession   qlen   E-value  score  bias   #  of  c-Evalue  i-Evalue  score  bias  from    to  from    to  from    to  acc description of target\n")
+        fh.write("#------------------- ---------- ----- -------------------- ---------- ----- --------- ------ ----- --- --- --------- --------- ------ ----- ----- ----- ----- ----- ----- ----- ---- ---------------------\n")
+        for acc, tlen, evalue, domains in hits:
+            for j, dom in enumerate(domains):
+                cevalue, ievalue, hmm_from, hmm_to, ali_from, ali_to = dom[:6]
+                fh.write(
+                    "{:<20} {:<10} {:>5} {:<20} {:<10} {:>5} {:>9.2g} {:>6.1f} "
+                    "{:>5.1f} {:>3} {:>3} {:>9.2g} {:>9.2g} {:>6.1f} {:>5.1f} "
+                    "{:>5} {:>5} {:>5} {:>5} {:>5} {:>5} {:>4.2f} "
+                    "Synthetic family {}\n".format(
+                        "fam" + acc if accessions else acc,
+                        acc + ".1" if accessions else "-",
+                        tlen, query, "-", qlen,
+                        evalue, 100.0, 0.1, j + 1, len(domains), cevalue,
+                        ievalue, 50.0, 0.1, hmm_from, hmm_to, ali_from,
+                        ali_to, ali_from, ali_to, 0.9, acc
+                    )
+                )
+        fh.write("#\n# [ok]\n")
+
+    with open(out_file, "wt") as fh:
+        fh.write("# hmmscan :: search sequence(s) against a profile database\n")
+        fh.write("# HMMER 3.1b2 (February 2015); http://hmmer.org/\n\n")
+        fh.write("Query:       {}  [L={}]\n".format(query, qlen))
+        fh.write("Scores for complete sequence "
+                 "(score includes all domains):\n\n")
+        fh.write("Domain annotation for each model (and alignments):\n")
+        for acc, tlen, evalue, domains in hits:
+            fh.write(">> fam{}  Synthetic family {}\n".format(acc, acc))
+            fh.write("   #    score  bias  c-Evalue  i-Evalue hmmfrom  "
+                     "hmm to    alifrom  ali to    envfrom  env to     acc\n")
+            fh.write(" ---   ------ ----- --------- --------- ------- "
+                     "-------    ------- -------    ------- -------    ----\n")
+            for j, dom in enumerate(domains):
+                cevalue, ievalue, hmm_from, hmm_to, ali_from, ali_to = dom[:6]
+                fh.write("{:>4} !   50.0   0.1 {:>9.2g} {:>9.2g} {:>7} {:>7} "
+                         "..  {:>7} {:>7} ..  {:>7} {:>7} .. 0.90\n".format(
+                            j + 1, cevalue, ievalue, hmm_from, hmm_to,
+                            ali_from, ali_to, ali_from, ali_to
+                         ))
+            fh.write("\n  Alignments for each domain:\n")
+            for j, dom in enumerate(domains):
+                cevalue, ievalue, hmm_from, hmm_to, ali_from, ali_to = dom[:6]
+                query_row, target_row = dom[6:]
+                fh.write("  == domain {}  score: 50.0 bits;  "
+                         "conditional E-value: {:.2g}\n".format(j + 1, cevalue))
+                for k in range(0, len(query_row), width):
+                    q = query_row[k:k+width]
+                    t = target_row[k:k+width]
+                    fh.write("{:>20} {:>5} {} {:<5}\n".format(
+                        "fam" + acc, hmm_from, t, hmm_to
+                    ))
+                    fh.write("{:>20} {:>5} {}\n".format(
+                        "", "", "".join("+" if c != "." else " " for c in t)
+                    ))
+                    fh.write("{:>20} {:>5} {} {:<5}\n".format(
+                        query, ali_from, q, ali_to
+                    ))
+                    fh.write("{:>20} {:>5} {} PP\n\n".format(
+                        "", "", "8" * len(q)
+                    ))
+            fh.write("\n")
+
+        fh.write("\n\nInternal pipeline statistics summary:\n")
+        fh.write("-------------------------------------\n")
+        fh.write("Query sequence(s):                         1  "
+                 "({} residues searched)\n".format(qlen))
+        fh.write("Domain search space  (domZ):             {}  "
+                 "[number of targets reported over threshold]\n".format(
+                    len(hits)
+                 ))
+        fh.write("//\n[ok]\n")
+
+
+def _floats(rng, n):
+    return " ".join("{:>8.5f}".format(rng.random() * 5) for _ in range(n))
+
+
+def _gapped(rng, length, gap):
+    return "".join(
+        gap if rng.random() < 0.05 else rng.choice(AMINO_ACIDS)
+        for _ in range(length)
+    )
+
+
+def _hmmscan_rows(rng, residues):
+    # Query row: sequence residues (upper case: match, lower case: insert,
+    # '-': deletion); target row: model consensus ('.' for inserts)
+    query = []
+    target = []
+    for c in residues:
+        r = rng.random()
+        if r < 0.02:
+            query.append("-")
+            target.append(rng.choice(AMINO_ACIDS).lower())
+        elif r < 0.04:
+            query.append(c.lower())
+            target.append(".")
+        else:
+            query.append(c)
+            target.append(rng.choice(AMINO_ACIDS).lower())
+
+    return "".join(query), "".join(target)
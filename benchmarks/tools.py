@@ -0,0 +1,306 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Stand-ins for the HMMER and COMPASS executables, writing synthetic
+outputs in the format of the real tools.
+
+Install them in a directory with `install()`, then either prepend this
+directory to PATH, or call `interprosets.utils.set_tools()`.
+
+Behaviour is set with environment variables (inherited by the tools):
+    INTERPROSETS_FAKE_STARTUP   seconds per process (default: 0.02)
+    INTERPROSETS_FAKE_LATENCY   seconds per search of a 300-residue query
+                                against 1000 models/profiles (default:
+                                0.05), proportional to the length of the
+                                query and to the size of the database
+    INTERPROSETS_FAKE_HITS      hits per query (default: 50; on average
+                                for hmmscan)
+    INTERPROSETS_FAKE_FAILURES  probability that a run fails (default: 0)
+"""
+
+import os
+import random
+import shutil
+import stat
+import sys
+import time
+import zlib
+
+from . import synthetic
+
+TOOLS = (
+    "compass_db1Xdb2",
+    "compass_vs_db",
+    "hmmconvert",
+    "hmmemit",
+    "hmmpress",
+    "hmmscan",
+    "mk_compass_db"
+)
+
+# Options followed by a value
+_WITH_VALUE = {
+    "-d", "-E", "-i", "-j", "-o", "-T", "-Z",
+    "--cpu", "--domE", "--domT", "--domtblout", "--domZ", "--tblout"
+}
+
+
+def install(directory):
+    os.makedirs(directory, exist_ok=True)
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+    for name in TOOLS:
+        filepath = os.path.join(directory, name)
+        with open(filepath, "wt") as fh:
+            fh.write("#!{}\n".format(sys.executable))
+            fh.write("import sys\n")
+            fh.write("sys.path.insert(0, {!r})\n".format(root))
+            fh.write("from benchmarks.tools import main\n")
+            fh.write("sys.exit(main({!r}, sys.argv[1:]))\n".format(name))
+
+        mode = os.stat(filepath).st_mode
+        os.chmod(filepath, mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+
+    return directory
+
+
+def main(name, argv):
+    options, args = _parse_args(argv)
+    time.sleep(_config("STARTUP", 0.02))
+
+    if random.random() < _config("FAILURES", 0):
+        sys.stderr.write("{}: simulated failure\n".format(name))
+        return 1
+
+    try:
+        return _TOOLS[name](options, args)
+    except (IndexError, KeyError):
+        sys.stderr.write("{}: invalid arguments: {}\n".format(
+            name, " ".join(argv)
+        ))
+        return 1
+    except FileNotFoundError as exc:
+        sys.stderr.write("{}: {}\n".format(name, exc))
+        return 1
+
+
+def _compass_db1Xdb2(options, args):
+    queries = _read_compass_db(options["-i"])
+    targets = _read_compass_db(options["-j"])
+
+    with open(options["-o"], "wt") as fh:
+        fh.write("COMPASS 3.1\n\n")
+        for query_id, length in queries:
+            _search(length, len(targets))
+            rng = _rng(query_id)
+            synthetic.write_compass_hits(
+                fh, query_id, _compass_targets(rng, query_id, targets), rng
+            )
+
+        fh.write("Parameters:\n")
+
+    return 0
+
+
+def _compass_vs_db(options, args):
+    query_id, sequence = _read_fasta(options["-i"])
+    targets = _read_compass_db(options["-d"])
+    _search(len(sequence), len(targets))
+
+    rng = _rng(query_id)
+    target_ids = _compass_targets(rng, query_id, targets)
+    synthetic.write_compass_output(options["-o"], len(target_ids),
+                                   seed=rng.random(),
+                                   query_id=query_id,
+                                   target_ids=target_ids)
+    return 0
+
+
+def _compass_targets(rng, query_id, targets):
+    # COMPASS reports the query first, if it is in the database
+    n_hits = int(_config("HITS", 50))
+    others = [seq_id for seq_id, _ in targets if seq_id != query_id]
+    hits = rng.sample(others, min(n_hits, len(others)))
+    if len(others) < len(targets):
+        hits = [query_id] + hits[:n_hits-1]
+
+    return hits
+
+
+def _config(key, default):
+    return float(os.environ.get("INTERPROSETS_FAKE_" + key, default))
+
+
+def _hmmconvert(options, args):
+    with open(args[0], "rt") as fh:
+        shutil.copyfileobj(fh, sys.stdout)
+
+    return 0
+
+
+def _hmmemit(options, args):
+    name, acc, length = _read_hmms(args[0])[0]
+    rng = _rng(name)
+    synthetic.write_fasta(options["-o"], name + "-consensus",
+                          synthetic.random_sequence(rng, length))
+    return 0
+
+
+def _hmmpress(options, args):
+    hmm_db = args[0]
+    for ext in (".h3m", ".h3i", ".h3f", ".h3p"):
+        if os.path.exists(hmm_db + ext):
+            sys.stderr.write("Error: {} already exists\n".format(hmm_db + ext))
+            return 1
+
+    models = _read_hmms(hmm_db)
+    with open(hmm_db + ".h3i", "wt") as fh:
+        for name, acc, length in models:
+            fh.write("{}\t{}\t{}\n".format(name, acc or "-", length))
+
+    for ext in (".h3m", ".h3f", ".h3p"):
+        open(hmm_db + ext, "wb").close()
+
+    return 0
+
+
+def _hmmscan(options, args):
+    hmm_db, fasta_file = args[-2:]
+    models = []
+    with open(hmm_db + ".h3i", "rt") as fh:
+        for line in fh:
+            name, acc, length = line.rstrip("\n").split("\t")
+            models.append((name, acc if acc != "-" else None, int(length)))
+
+    query, sequence = _read_fasta(fasta_file)
+    _search(len(sequence), len(models))
+
+    # Each model is hit with the same probability, whatever the database
+    # it is part of (-Z: size of the full database), so that searches
+    # against shards report the hits of a search against the full database.
+    # hmmscan reports the query's own model, if it is in the database.
+    z = int(options.get("-Z", len(models)))
+    threshold = min(1, _config("HITS", 50) / z) * 0xFFFFFFFF
+    self_name = query[:-len("-consensus")]
+    hits = [
+        m for m in models
+        if m[0] == self_name
+        or zlib.crc32((query + m[0]).encode("utf-8")) <= threshold
+    ]
+    rng = _rng(query)
+
+    accessions = all(acc for _, acc, _ in models)
+    targets = [
+        (acc if accessions else name, length, rng.randint(1, 3))
+        for name, acc, length in hits
+    ]
+
+    tab_file = options["--domtblout"]
+    out_file = tab_file + ".stdout"
+    try:
+        synthetic.write_hmmscan_output(out_file, tab_file, query,
+                                       sequence, targets,
+                                       seed=rng.random(),
+                                       accessions=accessions)
+        with open(out_file, "rt") as fh:
+            shutil.copyfileobj(fh, sys.stdout)
+    finally:
+        os.remove(out_file)
+
+    return 0
+
+
+def _mk_compass_db(options, args):
+    with open(options["-i"], "rt") as fh:
+        files = [line.strip() for line in fh if line.strip()]
+
+    with open(options["-o"], "wt") as fh:
+        for fasta_file in files:
+            seq_id, sequence = _read_fasta(fasta_file)
+            fh.write("{}\t{}\n".format(seq_id, len(sequence)))
+
+    return 0
+
+
+def _parse_args(argv):
+    options = {}
+    args = []
+    i = 0
+    while i < len(argv):
+        arg = argv[i]
+        if arg in _WITH_VALUE:
+            options[arg] = argv[i+1]
+            i += 2
+        elif arg.startswith("-"):
+            options[arg] = True
+            i += 1
+        else:
+            args.append(arg)
+            i += 1
+
+    return options, args
+
+
+def _read_compass_db(filepath):
+    records = []
+    with open(filepath, "rt") as fh:
+        for line in fh:
+            seq_id, length = line.rstrip("\n").split("\t")
+            records.append((seq_id, int(length)))
+
+    return records
+
+
+def _read_fasta(filepath):
+    seq_id = None
+    sequence = []
+    with open(filepath, "rt") as fh:
+        for line in fh:
+            if line[0] == ">":
+                if seq_id is not None:
+                    break
+                seq_id = line[1:].split()[0]
+            else:
+                sequence.append(line.strip())
+
+    return seq_id, "".join(sequence)
+
+
+def _read_hmms(filepath):
+    # (name, accession, length) of each model
+    models = []
+    name = acc = length = None
+    with open(filepath, "rt") as fh:
+        for line in fh:
+            if line.startswith("NAME "):
+                name = line.split()[1]
+            elif line.startswith("ACC "):
+                acc = line.split()[1].split(".")[0]
+            elif line.startswith("LENG "):
+                length = int(line.split()[1])
+            elif line.startswith("//"):
+                models.append((name, acc, length))
+                name = acc = length = None
+
+    return models
+
+
+def _rng(key):
+    # Same query, same hits
+    return random.Random(zlib.crc32(key.encode("utf-8")))
+
+
+def _search(length, n_targets):
+    time.sleep(_config("LATENCY", 0.05) * length / 300 * n_targets / 1000)
+
+
+_TOOLS = {
+    "compass_db1Xdb2": _compass_db1Xdb2,
+    "compass_vs_db": _compass_vs_db,
+    "hmmconvert": _hmmconvert,
+    "hmmemit": _hmmemit,
+    "hmmpress": _hmmpress,
+    "hmmscan": _hmmscan,
+    "mk_compass_db": _mk_compass_db
+}
@@ -7,17 +7,12 @@ def cli():
     import os
     import tempfile
 
-    from . import cdd, panther, pfam, pirsf, utils
+    from . import cdd, metrics, panther, pfam, pirsf, utils
 
     parser = argparse.ArgumentParser(
         description="Sets/Collections in InterPro"
     )
 
-    try:
-        uri = os.environ["INTERPRO_URI"]
-    except KeyError:
-        parser.error("Please define the INTERPRO_URI environment variable")
-
     dir_arg = {
         "help": "temporary directory",
         "default": tempfile.gettempdir()
@@ -28,82 +23,275 @@ def cli():
         "default": 1,
         "dest": "processes"
     }
+    pairs_arg = {
+        "help": "store one row per pair of signatures "
+                "instead of one row per direction",
+        "action": "store_true"
+    }
 
     subparsers = parser.add_subparsers(dest="command")
     subparsers.required = True
     subparsers.add_parser("init", help="(re)create tables")
+    subparsers.add_parser("assets",
+                          help="build hashed and compressed static files "
+                               "for the web application")
+
+    cluster_parser = subparsers.add_parser(
+        "cluster", help="infer sets by clustering hits (NumPy and SciPy)"
+    )
+    cluster_parser.add_argument("database",
+                                choices=("cdd", "panther", "pfam", "pirsf"))
+    cluster_parser.add_argument("--evalue",
+                                help="E-value cutoffs: hits are clustered "
+                                     "for each (default: 1e-10)",
+                                nargs="+",
+                                type=float,
+                                default=[1e-10],
+                                dest="cutoffs",
+                                metavar="EVALUE")
+    cluster_parser.add_argument("--mcl",
+                                help="Markov clustering "
+                                     "instead of connected components",
+                                action="store_true")
+    cluster_parser.add_argument("--inflation",
+                                help="MCL inflation (default: 2)",
+                                type=float,
+                                default=2)
+    cluster_parser.add_argument("-o", "--output",
+                                help="also write clusters to this file "
+                                     "(tab-separated)")
+    cluster_parser.add_argument("--metrics",
+                                help="write timings and resource usage "
+                                     "of each stage to this file "
+                                     "(JSON lines)",
+                                metavar="FILE")
 
-    _parser = subparsers.add_parser(
+    report_parser = subparsers.add_parser(
+        "report", help="rank methods whose hits disagree with sets (NumPy)"
+    )
+    report_parser.add_argument("database",
+                               choices=("cdd", "panther", "pfam", "pirsf"))
+    report_parser.add_argument("--metrics",
+                               help="write timings and resource usage "
+                                    "of each stage to this file "
+                                    "(JSON lines)",
+                               metavar="FILE")
+
+    export_parser = subparsers.add_parser(
+        "export-api", help="write the API documents of databases and sets "
+                           "to files served by the web application"
+    )
+    export_parser.add_argument("dest", help="output directory")
+    export_parser.add_argument("-t", "--threads",
+                               help="number of concurrent queries "
+                                    "(default: 4)",
+                               type=int,
+                               default=4,
+                               dest="processes")
+
+    cdd_parser = subparsers.add_parser(
         "cdd", help="CDD profile-profile alignments with COMPASS"
     )
-    _parser.add_argument("--dir", **dir_arg)
-    _parser.add_argument("-t", **threads_arg)
-    _parser.add_argument("--sequences",
-                         help="FASTA file of representative sequences")
-    _parser.add_argument("--links",
-                         help="list of superfamilies and their domain models")
-
-    _parser = subparsers.add_parser(
+    cdd_parser.add_argument("--sequences",
+                            help="FASTA file of representative sequences")
+    cdd_parser.add_argument("--links",
+                            help="list of superfamilies "
+                                 "and their domain models")
+    cdd_parser.add_argument("--chunk-size",
+                            help="number of domains searched "
+                                 "per COMPASS process (default: 1)",
+                            type=int,
+                            default=1)
+
+    panther_parser = subparsers.add_parser(
         "panther", help="PANTHER profile-profile alignments with HMMSCAN"
     )
-    _parser.add_argument("--dir", **dir_arg)
-    _parser.add_argument("-t", **threads_arg)
-    _parser.add_argument("--books",
-                         help="directory of 'books' (protein families)",
-                         required=True)
+    panther_parser.add_argument("--books",
+                                help="directory of 'books' "
+                                     "(protein families)",
+                                required=True)
 
-    _parser = subparsers.add_parser(
+    pfam_parser = subparsers.add_parser(
         "pfam", help="Pfam profile-profile alignments with HMMSCAN"
     )
-    _parser.add_argument("--dir", **dir_arg)
-    _parser.add_argument("-t", **threads_arg)
-    _parser.add_argument("--hmm", help="Pfam-A HMM file")
-    _parser.add_argument("--clans", help="Pfam clans TSV file")
+    pfam_parser.add_argument("--hmm", help="Pfam-A HMM file")
+    pfam_parser.add_argument("--clans", help="Pfam clans TSV file")
 
-    _parser = subparsers.add_parser(
+    pirsf_parser = subparsers.add_parser(
         "pirsf", help="PIRFS profile-profile alignments with HMMSCAN"
     )
-    _parser.add_argument("--dir", **dir_arg)
-    _parser.add_argument("-t", **threads_arg)
-    _parser.add_argument("--hmm", help="PIRSF HMM file", required=True)
-    _parser.add_argument("--info", help="pirsfinfo.dat file")
+    pirsf_parser.add_argument("--hmm", help="PIRSF HMM file", required=True)
+    pirsf_parser.add_argument("--info", help="pirsfinfo.dat file")
+
+    for _parser in (cdd_parser, panther_parser, pfam_parser, pirsf_parser):
+        _parser.add_argument("--dir", **dir_arg)
+        _parser.add_argument("-t", **threads_arg)
+        _parser.add_argument("--pairs", **pairs_arg)
+        _parser.add_argument("--max-evalue",
+                             help="do not store hits with an E-value "
+                                  "above this threshold",
+                             type=float,
+                             metavar="EVALUE")
+        _parser.add_argument("--top",
+                             help="store at most this number of hits "
+                                  "per query (best E-values)",
+                             type=int,
+                             dest="top_k",
+                             metavar="NUM_HITS")
+        _parser.add_argument("--timings",
+                             help="durations of searches: read to schedule "
+                                  "the longest first, then updated",
+                             metavar="FILE")
+        _parser.add_argument("--metrics",
+                             help="write timings and resource usage "
+                                  "of each stage to this file (JSON lines)",
+                             metavar="FILE")
+        _parser.add_argument("--buffer-size",
+                             help="memory for rows waiting to be inserted, "
+                                  "in MB (default: {})".format(
+                                    utils.BUFFER_SIZE // 1024 ** 2
+                                 ),
+                             type=int,
+                             default=utils.BUFFER_SIZE // 1024 ** 2,
+                             metavar="MB")
+
+    for _parser in (panther_parser, pfam_parser, pirsf_parser):
+        _parser.add_argument("-E",
+                             help="hmmscan: report models with an E-value "
+                                  "below this threshold",
+                             type=float,
+                             dest="hmmscan_evalue",
+                             metavar="EVALUE")
+        _parser.add_argument("--domE",
+                             help="hmmscan: report domains with a "
+                                  "conditional E-value below this threshold",
+                             type=float,
+                             dest="hmmscan_dom_evalue",
+                             metavar="EVALUE")
+        _parser.add_argument("--cut_ga",
+                             help="hmmscan: use the gathering thresholds "
+                                  "of the models",
+                             action="store_true")
+        _parser.add_argument("--shards",
+                             help="search the longest queries against "
+                                  "this number of parts of the HMM database "
+                                  "in parallel (default: 1)",
+                             type=int,
+                             default=1)
 
     args = parser.parse_args()
 
+    if args.command == "assets":
+        from . import assets
+
+        for filename, size, gz_size, br_size in assets.build():
+            print("{:<40}{:>10}{:>10}{:>10}".format(
+                filename, size, gz_size or "-", br_size or "-"
+            ))
+        return
+
+    try:
+        uri = os.environ["INTERPRO_URI"]
+    except KeyError:
+        parser.error("Please define the INTERPRO_URI environment variable")
+
     if args.command == "init":
-        utils.init_tables(uri)
+        utils.init_tables(uri, [cdd.DBCODE, panther.DBCODE, pfam.DBCODE,
+                                pirsf.DBCODE])
+    elif args.command in ("cluster", "report"):
+        dbcode = {
+            "cdd": cdd.DBCODE,
+            "panther": panther.DBCODE,
+            "pfam": pfam.DBCODE,
+            "pirsf": pirsf.DBCODE
+        }[args.database]
+        metrics.start(args.metrics)
+
+        if args.command == "cluster":
+            from . import cluster
+
+            cluster.run(uri, dbcode, args.cutoffs,
+                        algorithm="mcl" if args.mcl else "components",
+                        inflation=args.inflation,
+                        output=args.output)
+        else:
+            from . import report
+
+            report.run(uri, dbcode)
+
+        metrics.finish()
+    elif args.command == "export-api":
+        from . import export
+
+        export.export(uri, args.dest, processes=args.processes)
     else:
+        if args.command == "cdd":
+            hmmscan_options = None
+        elif args.cut_ga and (args.hmmscan_evalue is not None or
+                              args.hmmscan_dom_evalue is not None):
+            parser.error("--cut_ga cannot be combined with -E or --domE")
+        else:
+            hmmscan_options = utils.hmmscan_options(
+                evalue=args.hmmscan_evalue,
+                dom_evalue=args.hmmscan_dom_evalue,
+                cut_ga=args.cut_ga
+            )
+
         os.makedirs(args.dir, exist_ok=True)
 
         with tempfile.TemporaryDirectory(dir=args.dir) as tmpdir:
+            metrics.start(args.metrics, tmpdir)
+
             if args.command == "cdd":
                 cdd.run(uri,
                         cdd_masters=args.sequences,
                         links=args.links,
                         processes=args.processes,
-                        tmpdir=tmpdir)
+                        tmpdir=tmpdir,
+                        chunk_size=args.chunk_size,
+                        pairs=args.pairs,
+                        max_evalue=args.max_evalue,
+                        top_k=args.top_k,
+                        timings=args.timings,
+                        buffer_size=args.buffer_size * 1024 ** 2)
 
             elif args.command == "panther":
                 panther.run(uri, args.books,
                             tmpdir=tmpdir,
-                            processes=args.processes)
+                            processes=args.processes,
+                            pairs=args.pairs,
+                            max_evalue=args.max_evalue,
+                            top_k=args.top_k,
+                            hmmscan_options=hmmscan_options,
+                            shards=args.shards,
+                            timings=args.timings,
+                            buffer_size=args.buffer_size * 1024 ** 2)
 
             elif args.command == "pfam":
                 pfam.run(uri,
                          hmm_db=args.hmm,
                          clans_tsv=args.clans,
                          processes=args.processes,
-                         tmpdir=tmpdir)
+                         tmpdir=tmpdir,
+                         pairs=args.pairs,
+                         max_evalue=args.max_evalue,
+                         top_k=args.top_k,
+                         hmmscan_options=hmmscan_options,
+                         shards=args.shards,
+                         timings=args.timings,
+                         buffer_size=args.buffer_size * 1024 ** 2)
 
             elif args.command == "pirsf":
                 pirsf.run(uri, args.hmm,
                           pirsfinfo=args.info,
                           tmpdir=tmpdir,
-                          processes=args.processes)
-
-            size = 0
-            for root, dirs, files in os.walk(tmpdir):
-                for f in files:
-                    size += os.path.getsize(os.path.join(root, f))
+                          processes=args.processes,
+                          pairs=args.pairs,
+                          max_evalue=args.max_evalue,
+                          top_k=args.top_k,
+                          hmmscan_options=hmmscan_options,
+                          shards=args.shards,
+                          timings=args.timings,
+                          buffer_size=args.buffer_size * 1024 ** 2)
 
-            utils.logger("temporary files: {} bytes".format(size))
+            metrics.finish()
@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Compact encoding of domain alignments (METHOD_SCAN.DOMAINS).
+
+Values are JSON arrays, with one array per domain:
+  [start, end, i-Evalue (null for COMPASS), query ops, target ops]
+
+Aligned rows are run-length encoded. A run is either:
+  <count>>  residues copied from the reference (METHOD_SET.SEQUENCE)
+  <count><  residues copied from the reference, in lower case
+  residues  literal residues, e.g. substitutions
+  <count>c  a run of the gap character `c` ('-', '.', '=', ...)
+The count is omitted when equal to 1.
+
+The query row is encoded against the sequence of the query, from `start`.
+The target row has no reference, so its residues are stored as literals.
+
+The web application returns domains with aligned rows (`decode_domains()`),
+or, if requested, as they are stored (`read_domains()`): the set page then
+rebuilds rows only for the targets it renders (see `decodeRow()` in
+`static/app.js`).
+"""
+
+import json
+import re
+
+_RESIDUES = re.compile(r"[A-Za-z]+|([^A-Za-z])\1*")
+_TOKENS = re.compile(r"(\d*)([^A-Za-z0-9])|([A-Za-z]+)")
+_GAPS = re.compile(r"(\d+)([^A-Za-z0-9])")
+
+
+def decode_domains(value, sequence):
+    # Domains with their aligned rows (`query`, `target`)
+    domains = json.loads(value)
+    if domains and isinstance(domains[0], dict):
+        # Verbose JSON, from previous versions of the pipeline
+        return domains
+
+    return [{
+        "query": decode_row(query, sequence, start),
+        "target": decode_row(target),
+        "ievalue": ievalue,
+        "start": start,
+        "end": end
+    } for start, end, ievalue, query, target in domains]
+
+
+def decode_row(ops, reference=None, start=1):
+    if not reference:
+        # Only literals and gaps
+        return _GAPS.sub(_expand_gaps, ops)
+
+    row = []
+    pos = start - 1
+    for count, op, residues in _TOKENS.findall(ops):
+        if residues:
+            row.append(residues)
+            pos += len(residues)
+            continue
+
+        count = int(count) if count else 1
+        if op == ">":
+            row.append(reference[pos:pos+count])
+            pos += count
+        elif op == "<":
+            row.append(reference[pos:pos+count].lower())
+            pos += count
+        else:
+            row.append(op * count)
+
+    return "".join(row)
+
+
+def encode_domains(domains, sequence):
+    # i-Evalues are written with `repr()`, so they are read back exactly
+    return json.dumps([
+        [
+            dom["start"],
+            dom["end"],
+            dom["ievalue"],
+            encode_row(dom["query"], sequence, dom["start"]),
+            encode_row(dom["target"])
+        ] for dom in domains
+    ], separators=(",", ":"))
+
+
+def encode_row(row, reference="", start=1):
+    ops = []
+    pos = start - 1
+    for m in _RESIDUES.finditer(row):
+        run = m.group(0)
+        count = len(run)
+
+        if m.group(1):
+            # Gaps
+            ops.append(_run(count, run[0]))
+            continue
+
+        ref = reference[pos:pos+count]
+        pos += count
+        if run == ref:
+            ops.append(_run(count, ">"))
+        elif run == ref.lower():
+            ops.append(_run(count, "<"))
+        elif len(ref) < count:
+            # Reference exhausted (or no reference)
+            ops.append(run)
+        else:
+            _encode_residues(run, ref, ops)
+
+    return "".join(ops)
+
+
+def read_domains(value, sequence):
+    # Domains as stored: [start, end, i-Evalue, query ops, target ops]
+    domains = json.loads(value)
+    if domains and isinstance(domains[0], dict):
+        # Verbose JSON, from previous versions of the pipeline
+        return [[
+            dom["start"],
+            dom["end"],
+            dom["ievalue"],
+            encode_row(dom["query"], sequence, dom["start"]),
+            encode_row(dom["target"])
+        ] for dom in domains]
+
+    return domains
+
+
+def _encode_residues(run, ref, ops):
+    # Mixed run: split it into copied/lower-cased/literal segments
+    segments = []
+    for c, r in zip(run, ref):
+        if c == r:
+            op = ">"
+        elif c == r.lower():
+            op = "<"
+        else:
+            op = None
+
+        if segments and segments[-1][0] == op:
+            segments[-1][1].append(c)
+        else:
+            segments.append((op, [c]))
+
+    for op, residues in segments:
+        if op:
+            ops.append(_run(len(residues), op))
+        else:
+            ops.append("".join(residues))
+
+
+def _expand_gaps(m):
+    return m.group(2) * int(m.group(1))
+
+
+def _run(count, op):
+    return op if count == 1 else "{}{}".format(count, op)
@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Compressed responses and built static files of the web application.
+
+`build()` copies static files under names including a hash of their
+content (e.g. `app.3f2a9c81d0e4.js`), with gzip (and, with the `brotli`
+module, Brotli) compressed copies, and a manifest of the names. A name
+changes whenever the content does, so built files can be cached forever.
+
+The encoding of a response is the one preferred by the client among
+those available (see `negotiate()`).
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+STATIC_DIR = os.path.join(os.path.dirname(__file__), "static")
+BUILD_DIR = os.path.join(os.path.dirname(__file__), "build")
+MANIFEST = "manifest.json"
+
+# Hexadecimal characters of the hash in file names
+HASH_LENGTH = 12
+
+# Files compressed by `build()`
+COMPRESSED_EXTENSIONS = (".css", ".js", ".json", ".svg", ".txt")
+
+# Smallest response compressed, in bytes
+MIN_SIZE = 1024
+
+# Levels for responses (compressed on each request) and static files
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+STATIC_GZIP_LEVEL = 9
+STATIC_BROTLI_QUALITY = 11
+
+
+def available_encodings():
+    return ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+def negotiate(accept_encoding, encodings=None):
+    # Encoding accepted with the highest q-value (ties: order of `encodings`)
+    if encodings is None:
+        encodings = available_encodings()
+
+    accepted = {}
+    for item in (accept_encoding or "").split(","):
+        name, _, params = item.strip().partition(";")
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key.lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0
+        accepted[name.strip().lower()] = q
+
+    best = None
+    best_q = 0
+    for encoding in encodings:
+        q = accepted.get(encoding, accepted.get("*", 0))
+        if q > best_q:
+            best = encoding
+            best_q = q
+
+    return best
+
+
+def compress(data, encoding, static=False):
+    if encoding == "br":
+        quality = STATIC_BROTLI_QUALITY if static else BROTLI_QUALITY
+        return brotli.compress(data, quality=quality)
+    else:
+        level = STATIC_GZIP_LEVEL if static else GZIP_LEVEL
+        return gzip.compress(data, compresslevel=level, mtime=0)
+
+
+def compress_stream(chunks, encoding):
+    # Compressed chunks, for responses of unknown length
+    if encoding == "br":
+        compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        process = compressor.process
+        finish = compressor.finish
+    else:
+        compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+        process = compressor.compress
+        finish = compressor.flush
+
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode("utf-8")
+
+        data = process(chunk)
+        if data:
+            yield data
+
+    yield finish()
+
+
+def build(src=STATIC_DIR, dest=BUILD_DIR):
+    # Returns (file, size, gzip size, Brotli size) of built files
+    # (None: compressed copy not written)
+    if os.path.isdir(dest):
+        shutil.rmtree(dest)
+
+    manifest = {}
+    files = []
+    for root, dirs, filenames in os.walk(src):
+        dirs.sort()
+        for filename in sorted(filenames):
+            if filename.startswith("."):
+                continue
+
+            path = os.path.join(root, filename)
+            relpath = os.path.relpath(path, src).replace(os.sep, "/")
+            with open(path, "rb") as fh:
+                data = fh.read()
+
+            digest = hashlib.sha256(data).hexdigest()[:HASH_LENGTH]
+            base, ext = os.path.splitext(relpath)
+            hashed = "{}.{}{}".format(base, digest, ext)
+            manifest[relpath] = hashed
+
+            dst = os.path.join(dest, hashed)
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            with open(dst, "wb") as fh:
+                fh.write(data)
+
+            if ext.lower() in COMPRESSED_EXTENSIONS:
+                gz_size, br_size = write_compressed(dst, data)
+            else:
+                gz_size = br_size = None
+
+            files.append((relpath, len(data), gz_size, br_size))
+
+    with open(os.path.join(dest, MANIFEST), "wt") as fh:
+        json.dump(manifest, fh, indent=2, sort_keys=True)
+
+    return files
+
+
+def write_compressed(path, data):
+    # Compressed copies of `data` next to `path`, if smaller than `data`.
+    # Returns their size (None: not written)
+    sizes = []
+    for encoding in ("gzip", "br"):
+        size = None
+        if encoding in available_encodings():
+            compressed = compress(data, encoding, static=True)
+            if len(compressed) < len(data):
+                with open(path + _suffix(encoding), "wb") as fh:
+                    fh.write(compressed)
+                size = len(compressed)
+        sizes.append(size)
+
+    return tuple(sizes)
+
+
+def load_manifest(dest=BUILD_DIR):
+    # Built name of static files (empty if not built)
+    try:
+        with open(os.path.join(dest, MANIFEST), "rt") as fh:
+            return json.load(fh)
+    except FileNotFoundError:
+        return {}
+
+
+def find_built(filename, accept_encoding, dest=BUILD_DIR):
+    # (name, encoding or None) of a built file, compressed if possible
+    path = os.path.join(dest, filename)
+    encodings = [e for e in ("br", "gzip")
+                 if os.path.isfile(path + _suffix(e))]
+    encoding = negotiate(accept_encoding, encodings) if encodings else None
+    if encoding is not None:
+        return filename + _suffix(encoding), encoding
+    return filename, None
+
+
+def _suffix(encoding):
+    return ".br" if encoding == "br" else ".gz"
@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Sets inferred by clustering the graph of hits of a database (requires
+NumPy and SciPy).
+
+Hits are read once, at the largest E-value cutoff, into arrays of node
+indices and scores (-log10 E-value, see `hits`). For each cutoff,
+the graph is a sparse (CSR) matrix of the hits within the cutoff, split
+in connected components, or clustered with MCL (Markov clustering).
+
+Clusters of at least two methods are stored in METHOD_SET_CLUSTER,
+replacing those of previous runs with the same database, algorithm, and
+cutoff.
+"""
+
+import cx_Oracle
+import numpy as np
+from scipy import sparse
+from scipy.sparse.csgraph import connected_components
+
+from . import hits, metrics, utils
+
+ALGORITHMS = ("components", "mcl")
+
+# MCL: inflation, iterations, and pruning (entries below `MCL_PRUNE`,
+# then all but the `MCL_MAX_PER_COLUMN` largest entries of each column)
+MCL_INFLATION = 2.0
+MCL_ITERATIONS = 100
+MCL_PRUNE = 1e-4
+MCL_MAX_PER_COLUMN = 100
+
+
+def run(uri, dbcode, cutoffs, algorithm="components",
+        inflation=MCL_INFLATION, output=None):
+    cutoffs = sorted(set(cutoffs))
+    con = cx_Oracle.connect(uri)
+
+    metrics.stage("load hits")
+    accessions, sets, src, dst, evalues = hits.load(con, dbcode,
+                                                    max(cutoffs))
+    scores = hits.score(evalues).astype(np.float32)
+    del evalues
+    utils.logger("{} methods, {} hits".format(len(accessions), len(src)))
+
+    results = []
+    for cutoff in cutoffs:
+        metrics.stage("cluster (E <= {:g})".format(cutoff))
+        matrix = to_matrix(len(accessions), src, dst, scores,
+                           hits.score(cutoff))
+        if algorithm == "mcl":
+            labels = mcl(matrix, inflation=inflation)
+        else:
+            _, labels = connected_components(matrix, directed=False)
+
+        clusters = to_clusters(labels)
+        _log_clusters(algorithm, cutoff, clusters, sets)
+        results.append((cutoff, clusters))
+
+    metrics.stage("store clusters")
+    store(con, dbcode, algorithm, results, accessions)
+    con.close()
+
+    if output:
+        with open(output, "wt") as fh:
+            for cutoff, clusters in results:
+                for cluster_id, members in enumerate(clusters, 1):
+                    for i in members:
+                        fh.write("{}\t{:g}\t{}\t{}\t{}\n".format(
+                            algorithm, cutoff, cluster_id, accessions[i],
+                            sets[i] or ""
+                        ))
+
+
+def to_matrix(n, src, dst, scores, min_score):
+    # Symmetric matrix of hits with a score of at least `min_score`
+    # (best score of both directions), without self-hits
+    mask = (scores >= np.float32(min_score)) & (src != dst)
+    matrix = sparse.csr_matrix((scores[mask], (src[mask], dst[mask])),
+                               shape=(n, n))
+    return matrix.maximum(matrix.T).tocsr()
+
+
+def mcl(matrix, inflation=MCL_INFLATION, iterations=MCL_ITERATIONS,
+        prune=MCL_PRUNE, max_per_column=MCL_MAX_PER_COLUMN):
+    # Returns the cluster label of each node
+
+    # Self-loops, with the largest weight of the node
+    loops = matrix.max(axis=1).toarray().ravel()
+    loops[loops == 0] = 1
+    m = (matrix + sparse.diags(loops)).tocsc()
+    m = _normalize(m)
+
+    for _ in range(iterations):
+        previous = m
+        m = m @ m
+        m.data **= inflation
+        m = _normalize(_prune(m, prune, max_per_column))
+
+        delta = abs(m - previous)
+        if delta.nnz == 0 or delta.max() < 1e-6:
+            break
+
+    # Nodes attracted to the same nodes are in the same cluster
+    _, labels = connected_components(m, directed=False)
+    return labels
+
+
+def to_clusters(labels):
+    # Node indices of clusters of at least two nodes, largest first
+    order = np.argsort(labels, kind="stable")
+    sorted_labels = labels[order]
+    bounds = np.flatnonzero(np.diff(sorted_labels)) + 1
+    clusters = [c for c in np.split(order, bounds) if len(c) > 1]
+    clusters.sort(key=lambda c: (-len(c), c[0]))
+    return clusters
+
+
+def store(con, dbcode, algorithm, results, accessions):
+    cur = con.cursor()
+    for cutoff, clusters in results:
+        cur.setinputsizes(None, None, cx_Oracle.NATIVE_FLOAT)
+        cur.execute(
+            """
+            DELETE FROM INTERPRO.METHOD_SET_CLUSTER
+            WHERE DBCODE = :1 AND ALGORITHM = :2 AND EVALUE = :3
+            """,
+            (dbcode, algorithm, cutoff)
+        )
+
+        data = []
+        for cluster_id, members in enumerate(clusters, 1):
+            for i in members:
+                data.append((accessions[i], dbcode, algorithm, cutoff,
+                             cluster_id))
+
+                if len(data) == utils.INSERT_SIZE:
+                    _insert_clusters(cur, data)
+                    data = []
+
+        if data:
+            _insert_clusters(cur, data)
+
+    con.commit()
+    cur.close()
+
+
+def _insert_clusters(cur, data):
+    cur.setinputsizes(None, None, None, cx_Oracle.NATIVE_FLOAT, None)
+    cur.executemany(
+        """
+        INSERT INTO INTERPRO.METHOD_SET_CLUSTER
+        VALUES (:1, :2, :3, :4, :5)
+        """,
+        data
+    )
+    metrics.count("rows", len(data))
+
+
+def _log_clusters(algorithm, cutoff, clusters, sets):
+    mixed = 0
+    new = 0
+    for members in clusters:
+        member_sets = {sets[i] for i in members}
+        if None in member_sets:
+            new += 1
+            member_sets.discard(None)
+        if len(member_sets) > 1:
+            mixed += 1
+
+    utils.logger(
+        "{} (E <= {:g}): {} clusters, {} methods, largest: {}, "
+        "{} across sets, {} with methods without set".format(
+            algorithm, cutoff, len(clusters),
+            sum(len(c) for c in clusters),
+            len(clusters[0]) if clusters else 0, mixed, new
+        )
+    )
+
+
+def _normalize(m):
+    # Columns sum to 1 (CSC matrix)
+    sums = np.asarray(m.sum(axis=0)).ravel()
+    sums[sums == 0] = 1
+    m = m.tocsc()
+    m.data /= np.repeat(sums, np.diff(m.indptr))
+    return m
+
+
+def _prune(m, threshold, max_per_column):
+    # Entries below `threshold`, then all but the largest of each column
+    m = m.tocsc()
+    m.data[m.data < threshold] = 0
+    m.eliminate_zeros()
+
+    counts = np.diff(m.indptr)
+    if counts.max(initial=0) > max_per_column:
+        columns = np.repeat(np.arange(m.shape[1]), counts)
+        order = np.lexsort((-m.data, columns))
+        rank = np.empty_like(order)
+        rank[order] = np.arange(len(order)) - np.repeat(m.indptr[:-1],
+                                                        counts)
+        m.data[rank >= max_per_column] = 0
+        m.eliminate_zeros()
+
+    return m
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Data access for the web application.
+
+CLOBs are fetched as strings, within the rows that hold them, instead of
+as locators that each need a round trip to be read. Each query sets the
+number of rows fetched per round trip for the number of rows it expects
+(`fetchone()`: a single trip).
+
+Round trips are estimated from the number of rows fetched, not measured,
+and counted per connection (see `Connection.estimated_round_trips`).
+Given a `timings` dict, a connection adds the seconds spent connecting,
+executing queries, and fetching rows to it (see `profiling`).
+"""
+
+import time
+from math import ceil
+
+import cx_Oracle
+
+# Rows fetched per round trip by `fetchall()`
+ARRAYSIZE = 500
+
+
+class Connection(object):
+    def __init__(self, uri, timings=None):
+        self.timings = timings
+        t = time.perf_counter()
+        self.con = cx_Oracle.connect(uri)
+        self.con.outputtypehandler = _output_type_handler
+        self._add_time("connect", t)
+        self.queries = 0
+        self.estimated_round_trips = 0
+
+    def close(self):
+        self.con.close()
+
+    def fetchall(self, sql, params=(), arraysize=ARRAYSIZE):
+        return self._fetch(sql, params, arraysize, arraysize + 1)
+
+    def fetchone(self, sql, params=()):
+        # Two rows prefetched: the end of the results is known at once
+        rows = self._fetch(sql, params, 1, 2)
+        return rows[0] if rows else None
+
+    def _fetch(self, sql, params, arraysize, prefetchrows):
+        cur = self.con.cursor()
+        try:
+            cur.arraysize = arraysize
+            try:
+                cur.prefetchrows = prefetchrows
+            except AttributeError:
+                # cx_Oracle < 8: rows are fetched after the execution
+                prefetchrows = 0
+
+            t = time.perf_counter()
+            cur.execute(sql, params)
+            t = self._add_time("execute", t)
+            rows = cur.fetchall()
+        finally:
+            cur.close()
+        self._add_time("fetch", t)
+
+        # Estimate, from the rows fetched: a query returning LOBs as
+        # locators, or a driver fetching differently, takes more trips
+        self.queries += 1
+        self.estimated_round_trips += 1
+        if len(rows) >= prefetchrows:
+            # Remaining rows, and the end of the results
+            self.estimated_round_trips += ceil((len(rows) - prefetchrows + 1)
+                                               / arraysize)
+        return rows
+
+    def _add_time(self, name, start):
+        # Returns the current time, start of the next phase
+        now = time.perf_counter()
+        if self.timings is not None:
+            self.timings[name] = self.timings.get(name, 0) + now - start
+        return now
+
+
+def _output_type_handler(cursor, name, default_type, size, precision,
+                         scale):
+    if default_type == cx_Oracle.CLOB:
+        return cursor.var(cx_Oracle.LONG_STRING, arraysize=cursor.arraysize)
+    elif default_type == cx_Oracle.BLOB:
+        return cursor.var(cx_Oracle.LONG_BINARY, arraysize=cursor.arraysize)
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Snapshot of the API, served by the web application instead of querying
+the database (see `server.serve_snapshot()`).
+
+Documents of databases and sets are those returned by the application
+itself, for requests without parameters. They are written as
+`<directory>/<URL path>/<status>.json` (e.g. `api/set/CL0001/200.json`),
+with compressed copies (see `assets`). Data only change when a database
+is loaded, so a snapshot is exported after each load.
+"""
+
+import json
+import os
+import shutil
+import threading
+import time
+from multiprocessing.dummy import Pool
+
+from . import assets, db, utils
+
+# Statuses of exported responses (others are errors)
+STATUSES = (200, 404)
+
+
+def filename(path, status):
+    # File of the document of a URL path, or None if not exported
+    parts = [p for p in path.split("/") if p]
+    if not parts or parts[0] != "api" or ".." in parts:
+        return None
+    return "/".join(parts + ["{}.json".format(status)])
+
+
+def export(uri, dest, processes=1):
+    # Written in a new directory, which then replaces `dest`
+    from flask import g
+
+    from .server import app
+
+    # Documents are always read from the database
+    app.config["SNAPSHOT"] = None
+
+    tmpdir = dest.rstrip(os.sep) + ".tmp"
+    if os.path.isdir(tmpdir):
+        shutil.rmtree(tmpdir)
+    os.makedirs(tmpdir)
+
+    # One connection per thread, kept between requests
+    local = threading.local()
+    connections = []
+    lock = threading.Lock()
+
+    def get(path):
+        if not hasattr(local, "con"):
+            local.con = db.Connection(uri)
+            with lock:
+                connections.append(local.con)
+
+        with app.test_request_context(path):
+            g.con = local.con
+            try:
+                response = app.full_dispatch_request()
+            finally:
+                del g.con
+
+            data = response.get_data()
+
+        if response.status_code not in STATUSES:
+            raise RuntimeError("{}: status {}".format(path,
+                                                      response.status_code))
+
+        dst = os.path.join(tmpdir, filename(path, response.status_code))
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        with open(dst, "wb") as fh:
+            fh.write(data)
+
+        if len(data) >= assets.MIN_SIZE:
+            assets.write_compressed(dst, data)
+
+        return json.loads(data.decode("utf-8")), len(data)
+
+    start = time.time()
+    n_bytes = 0
+    try:
+        databases, size = get("/api/databases/")
+        n_bytes += size
+
+        with Pool(processes) as pool:
+            paths = ["/api/database/{}/".format(d["id"]) for d in databases]
+            sets = []
+            for sets_of_db, size in pool.imap(get, paths):
+                sets += [s["accession"] for s in sets_of_db]
+                n_bytes += size
+
+            paths = []
+            for accession in sets:
+                path = "/api/set/{}/".format(accession)
+                paths += [path, path + "relationships/", path + "similarity/"]
+
+            for i, (_, size) in enumerate(pool.imap_unordered(get, paths)):
+                n_bytes += size
+                if not (i + 1) % 1000:
+                    utils.logger("export: {:>10} / {}".format(i + 1,
+                                                              len(paths)))
+    finally:
+        for con in connections:
+            con.close()
+
+    if os.path.isdir(dest):
+        olddir = dest.rstrip(os.sep) + ".old"
+        if os.path.isdir(olddir):
+            shutil.rmtree(olddir)
+        os.rename(dest, olddir)
+        os.rename(tmpdir, dest)
+        shutil.rmtree(olddir)
+    else:
+        os.rename(tmpdir, dest)
+
+    utils.logger("export: {} databases, {} sets, {:.0f} MB "
+                 "in {:.0f}s".format(len(databases), len(sets),
+                                     n_bytes / 1024 ** 2,
+                                     time.time() - start))
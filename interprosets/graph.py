@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Relationships graph and similarity matrix of a set (METHOD_SET_GRAPH).
+
+Both are built by the pipeline, once per set, from hits between members
+of the set: (query accession, query name, target accession, target name,
+E-value). They are stored as the JSON documents returned by the API.
+
+With NumPy, nodes of the graph have positions (`x`, `y`, from 0 to 1),
+from a force-directed layout, so the browser only renders the graph.
+"""
+
+import json
+import math
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Iterations of the layout, and largest graph laid out
+LAYOUT_ITERATIONS = 300
+LAYOUT_MAX_NODES = 2000
+
+
+def dumps(obj):
+    return json.dumps(obj, separators=(",", ":"))
+
+
+def layout(nodes, links, iterations=LAYOUT_ITERATIONS):
+    """
+    Fruchterman-Reingold layout: nodes repel each other, and links pull
+    their nodes at a distance increasing with the E-value (log scale),
+    as the simulation of the browser does. Positions are scaled to fit
+    in [0, 1]. Returns None without NumPy, or for large graphs.
+    """
+    n = len(nodes)
+    if np is None or not n or n > LAYOUT_MAX_NODES:
+        return None
+    elif n == 1:
+        return [(0.5, 0.5)]
+
+    index = {node['accession']: i for i, node in enumerate(nodes)}
+    links = [l for l in links if l['source'] != l['target']]
+    src = np.array([index[l['source']] for l in links], dtype=int)
+    dst = np.array([index[l['target']] for l in links], dtype=int)
+    evalues = np.log10(np.maximum([l['value'] for l in links],
+                                  np.finfo(float).tiny))
+    if links and evalues.max() > evalues.min():
+        lengths = (0.1 + 0.4 * (evalues - evalues.min())
+                   / (evalues.max() - evalues.min()))
+    else:
+        lengths = np.full(len(links), 0.1)
+
+    # Deterministic start: nodes on a circle
+    angles = np.arange(n) * 2 * math.pi / n
+    pos = 0.5 + 0.4 * np.column_stack((np.cos(angles), np.sin(angles)))
+
+    k2 = 0.25 / n
+    temperature = 0.1
+    cooling = (0.001 / temperature) ** (1 / iterations)
+    x, y = pos[:, 0].copy(), pos[:, 1].copy()
+    for _ in range(iterations):
+        dx = x[:, np.newaxis] - x
+        dy = y[:, np.newaxis] - y
+        inv = dx * dx
+        inv += dy * dy
+        np.maximum(inv, 1e-6, out=inv)
+        np.divide(k2, inv, out=inv)
+        np.fill_diagonal(inv, 0)
+        disp_x = (dx * inv).sum(axis=1)
+        disp_y = (dy * inv).sum(axis=1)
+
+        if links:
+            lx = x[src] - x[dst]
+            ly = y[src] - y[dst]
+            dist = np.maximum(np.sqrt(lx * lx + ly * ly), 1e-3)
+            f = (dist - lengths) / dist / 2
+            fx = lx * f
+            fy = ly * f
+            disp_x -= np.bincount(src, fx, n) - np.bincount(dst, fx, n)
+            disp_y -= np.bincount(src, fy, n) - np.bincount(dst, fy, n)
+
+        # Weak gravity: disconnected components stay close
+        disp_x -= (x - 0.5) * 0.01
+        disp_y -= (y - 0.5) * 0.01
+
+        length = np.maximum(np.sqrt(disp_x ** 2 + disp_y ** 2), 1e-9)
+        step = np.minimum(length, temperature) / length
+        x += disp_x * step
+        y += disp_y * step
+        temperature *= cooling
+
+    pos = np.column_stack((x, y))
+    pos -= pos.min(axis=0)
+    pos /= max(pos.max(), 1e-9)
+    return [(round(float(x), 4), round(float(y), 4)) for x, y in pos]
+
+
+def relationships(accession, hits, positions=None):
+    # None if no member of the set has a hit within the set.
+    # `positions`: (x, y) by accession, used instead of a new layout
+    nodes = {}
+    edges = {}
+
+    for method_ac, method_name, target_ac, target_name, evalue in hits:
+        if method_ac not in nodes:
+            nodes[method_ac] = {
+                'accession': method_ac,
+                'name': method_name
+            }
+
+        if target_ac not in nodes:
+            nodes[target_ac] = {
+                'accession': target_ac,
+                'name': target_name
+            }
+
+        if method_ac > target_ac:
+            method_ac, target_ac = target_ac, method_ac
+
+        if method_ac not in edges:
+            edges[method_ac] = {target_ac: evalue}
+        elif target_ac not in edges[method_ac] or evalue < edges[method_ac][target_ac]:
+            edges[method_ac][target_ac] = evalue
+
+    if not nodes:
+        return None
+
+    nodes = list(nodes.values())
+    links = [
+        {
+            'source': acc1,
+            'target': acc2,
+            'value': edges[acc1][acc2]
+        }
+        for acc1 in edges
+        for acc2 in edges[acc1]
+    ]
+
+    if positions is None:
+        positions = layout(nodes, links)
+        if positions is not None:
+            positions = {node['accession']: xy
+                         for node, xy in zip(nodes, positions)}
+
+    if positions is not None:
+        for node in nodes:
+            try:
+                node['x'], node['y'] = positions[node['accession']]
+            except KeyError:
+                pass
+
+    return {
+        'accession': accession,
+        'data': {
+            'nodes': nodes,
+            'links': links
+        }
+    }
+
+
+def similarity(accession, methods, hits):
+    # `methods`: (accession, name) of members of the set
+    methods = sorted(
+        ({'accession': acc, 'name': name} for acc, name in methods),
+        key=lambda x: x['accession']
+    )
+    index = {m['accession']: i for i, m in enumerate(methods)}
+
+    m = [[None] * len(methods) for _ in methods]
+    for query_ac, _, target_ac, _, evalue in hits:
+        i = index[query_ac]
+        j = index[target_ac]
+        if m[i][j] is None or evalue < m[i][j]:
+            m[i][j] = m[j][i] = evalue
+
+    return {
+        'accession': accession,
+        'methods': methods,
+        'data': m
+    }
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Hits of a database as NumPy arrays, for analyses of all methods at once
+(see `cluster` and `report`).
+
+Methods are nodes, indexed from 0 in the order of their ID (methods of
+a database have consecutive IDs, see `utils.prepare_tables()`). Hits are
+read once, in chunks converted to arrays as they arrive.
+"""
+
+import numpy as np
+
+from . import metrics, utils
+
+# Rows fetched per round trip when reading hits
+FETCH_SIZE = 50000
+
+# Score of hits with an E-value of 0
+MAX_SCORE = 300
+
+
+def load(con, dbcode, max_evalue=None):
+    """
+    Returns accessions and sets of methods (by node index), and source
+    nodes, target nodes, and E-values of hits (with an E-value of at most
+    `max_evalue`). Hits are stored per direction or per pair (see
+    `utils._fold_pairs()`): a pair is one hit, from its first method.
+    """
+    cur = con.cursor()
+    cur.arraysize = FETCH_SIZE
+    cur.execute(
+        """
+        SELECT METHOD_ID, METHOD_AC, SET_AC
+        FROM INTERPRO.METHOD_SET
+        WHERE DBCODE = :1
+        ORDER BY METHOD_ID
+        """,
+        (dbcode,)
+    )
+    ids = []
+    accessions = []
+    sets = []
+    for method_id, method_ac, set_ac in cur:
+        ids.append(method_id)
+        accessions.append(method_ac)
+        sets.append(set_ac)
+
+    src = dst = np.empty(0, dtype=np.int32)
+    evalues = np.empty(0, dtype=np.float64)
+    if not ids:
+        cur.close()
+        return accessions, sets, src, dst, evalues
+
+    # Node index of each method ID, from the smallest to the largest
+    # (-1: not a method of this database)
+    first_id = ids[0]
+    index = np.full(ids[-1] - first_id + 1, -1, dtype=np.int32)
+    index[np.array(ids) - first_id] = np.arange(len(ids), dtype=np.int32)
+
+    params = {"dbcode": dbcode}
+    if max_evalue is not None:
+        params["max_evalue"] = max_evalue
+        where = "DBCODE = :dbcode AND EVALUE <= :max_evalue"
+    else:
+        where = "DBCODE = :dbcode"
+
+    cur.execute(
+        """
+        SELECT QUERY_ID, TARGET_ID, EVALUE
+        FROM INTERPRO.METHOD_SCAN
+        WHERE {0}
+        UNION ALL
+        SELECT METHOD_ID1, METHOD_ID2, EVALUE
+        FROM INTERPRO.METHOD_SCAN_PAIR
+        WHERE {0}
+        """.format(where),
+        params
+    )
+
+    chunks = []
+    unknown = 0
+    while True:
+        rows = cur.fetchmany()
+        if not rows:
+            break
+
+        chunk = np.array(rows, dtype=np.float64)
+        _src = _nodes(index, first_id, chunk[:, 0])
+        _dst = _nodes(index, first_id, chunk[:, 1])
+        valid = (_src >= 0) & (_dst >= 0)
+        chunks.append((_src[valid], _dst[valid], chunk[valid, 2]))
+        metrics.count("hits", len(rows))
+        unknown += len(rows) - int(valid.sum())
+
+    cur.close()
+
+    if unknown:
+        # Hits of IDs not in METHOD_SET (e.g. from another load)
+        utils.logger("{}: {} hits skipped: method IDs not in METHOD_SET "
+                     "({} to {})".format(dbcode, unknown, first_id, ids[-1]))
+
+    if chunks:
+        src, dst, evalues = (np.concatenate(a) for a in zip(*chunks))
+
+    return accessions, sets, src, dst, evalues
+
+
+def pairs(src, dst, evalues):
+    # Unordered pairs of distinct nodes (i < j), with their best E-value
+    lo = np.minimum(src, dst).astype(np.int64)
+    hi = np.maximum(src, dst).astype(np.int64)
+    mask = lo != hi
+    lo, hi, evalues = lo[mask], hi[mask], evalues[mask]
+
+    keys = lo * (int(hi.max(initial=0)) + 1) + hi
+    order = np.lexsort((evalues, keys))
+    keys = keys[order]
+    first = np.ones(len(keys), dtype=bool)
+    first[1:] = keys[1:] != keys[:-1]
+    best = order[first]
+    return (lo[best].astype(np.int32), hi[best].astype(np.int32),
+            evalues[best])
+
+
+def score(evalue):
+    # -log10(E-value), at most `MAX_SCORE`
+    with np.errstate(divide="ignore"):
+        return np.minimum(-np.log10(evalue), MAX_SCORE)
+
+
+def _nodes(index, first_id, ids):
+    # Node indices of method IDs (-1: not a method of the database,
+    # including IDs out of the range of `index`)
+    offsets = ids.astype(np.int64) - first_id
+    known = (offsets >= 0) & (offsets < len(index))
+    nodes = np.full(len(ids), -1, dtype=np.int32)
+    nodes[known] = index[offsets[known]]
+    return nodes
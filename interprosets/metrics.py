@@ -0,0 +1,288 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Pipeline instrumentation.
+
+A run is divided in sequential stages (`stage()`). Each stage records its
+wall time, the CPU time of this process and of its subprocesses, and the
+peak RSS of both. Within a stage, `timer()` accumulates time spent in
+an operation (e.g. parsing, inserting), `count()` counts items (e.g. rows),
+and `gauge()` samples a value (e.g. the number of results waiting).
+
+Events are written as JSON lines if `start()` is given a file. A sampler
+thread records the size of the temporary directory. `finish()` logs a
+summary of the run, also written as the last event.
+"""
+
+import json
+import os
+import resource
+import threading
+import time
+from datetime import datetime
+
+from . import utils
+
+_lock = threading.RLock()
+_state = {
+    "file": None,
+    "started": None,
+    "stage": None,
+    "stages": [],
+    "disk": None
+}
+
+
+def count(name, n=1):
+    with _lock:
+        counters = _current()["counters"]
+        counters[name] = counters.get(name, 0) + n
+
+
+def finish():
+    _end_stage()
+
+    disk = _state["disk"]
+    if disk is not None:
+        disk.stop()
+
+    summary = {
+        "wall": time.perf_counter() - _state["started"]
+        if _state["started"] else None,
+        "max_rss": _max_rss(resource.RUSAGE_SELF),
+        "max_rss_children": _max_rss(resource.RUSAGE_CHILDREN),
+        "disk_peak": disk.peak if disk is not None else None,
+        "stages": [
+            {
+                k: s[k] for k in ("name", "wall", "cpu", "cpu_children",
+                                  "timers", "counters", "gauges")
+            }
+            for s in _state["stages"]
+        ]
+    }
+    record("summary", **summary)
+
+    utils.logger("summary:")
+    for s in summary["stages"]:
+        utils.logger("  {:<24} {:>10.1f}s  cpu {:>10.1f}s  "
+                     "subprocesses {:>10.1f}s".format(
+                        s["name"], s["wall"], s["cpu"], s["cpu_children"]
+                     ))
+        for name, seconds in sorted(s["timers"].items()):
+            utils.logger("    {:<22} {:>10.1f}s".format(name, seconds))
+        for name, n in sorted(s["counters"].items()):
+            utils.logger("    {:<22} {:>10}  ({:.0f}/s)".format(
+                name, n, n / s["wall"] if s["wall"] else 0
+            ))
+        for name, g in sorted(s["gauges"].items()):
+            utils.logger("    {:<22} max {:>6}  mean {:.1f}".format(
+                name, g["max"], g["mean"]
+            ))
+
+    if summary["wall"] is not None:
+        utils.logger("  {:<24} {:>10.1f}s".format("total", summary["wall"]))
+    utils.logger("  peak memory: {} MB (subprocesses: {} MB)".format(
+        summary["max_rss"] // 1024, summary["max_rss_children"] // 1024
+    ))
+    if summary["disk_peak"] is not None:
+        utils.logger("  peak disk usage: {} MB".format(
+            summary["disk_peak"] // 1024 ** 2
+        ))
+
+    if _state["file"] is not None:
+        _state["file"].close()
+        _state["file"] = None
+
+    _state["disk"] = None
+    _state["started"] = None
+    _state["stages"] = []
+    return summary
+
+
+def gauge(name, value):
+    with _lock:
+        gauges = _current()["gauges"]
+        try:
+            g = gauges[name]
+        except KeyError:
+            g = gauges[name] = {"max": value, "sum": 0, "n": 0}
+
+        g["max"] = max(g["max"], value)
+        g["sum"] += value
+        g["n"] += 1
+
+
+def progress(done, total, **fields):
+    # Snapshot of the current stage, while other threads update it
+    with _lock:
+        s = _current()
+        wall = time.perf_counter() - s["start"]
+        counters = dict(s["counters"])
+        timers = dict(s["timers"])
+        gauges = {
+            k: {"max": g["max"], "mean": g["sum"] / g["n"]}
+            for k, g in s["gauges"].items()
+        }
+
+    record("progress",
+           stage=s["name"],
+           done=done,
+           total=total,
+           wall=wall,
+           counters=counters,
+           rates={k: v / wall for k, v in counters.items()} if wall else {},
+           timers=timers,
+           gauges=gauges,
+           **fields)
+
+
+def record(event, **fields):
+    fh = _state["file"]
+    if fh is not None:
+        fields["event"] = event
+        fields["time"] = datetime.now().isoformat()
+        with _lock:
+            fh.write(json.dumps(fields) + "\n")
+            fh.flush()
+
+
+def stage(name):
+    # Ends the current stage, if any, and starts a new one. Under the
+    # lock: a concurrent `count()` never sees no stage (and starts "run")
+    with _lock:
+        _end_stage()
+        utils.logger(name)
+        _state["stage"] = {
+            "name": name,
+            "start": time.perf_counter(),
+            "rusage": resource.getrusage(resource.RUSAGE_SELF),
+            "rusage_children": resource.getrusage(resource.RUSAGE_CHILDREN),
+            "timers": {},
+            "counters": {},
+            "gauges": {}
+        }
+        record("stage_start", stage=name)
+
+
+def start(filepath=None, tmpdir=None, interval=30):
+    if filepath:
+        _state["file"] = open(filepath, "wt")
+
+    _state["started"] = time.perf_counter()
+
+    if tmpdir:
+        _state["disk"] = _DiskSampler(tmpdir, interval)
+        _state["disk"].start()
+
+
+def timed(iterable, name):
+    # Time spent waiting for each item of `iterable`
+    it = iter(iterable)
+    while True:
+        with timer(name):
+            try:
+                item = next(it)
+            except StopIteration:
+                return
+
+        yield item
+
+
+def timer(name):
+    return _Timer(name)
+
+
+def _current():
+    if _state["stage"] is None:
+        stage("run")
+    return _state["stage"]
+
+
+def _end_stage():
+    with _lock:
+        s = _state["stage"]
+        if s is None:
+            return
+
+        ru1 = s["rusage"]
+        ru2 = resource.getrusage(resource.RUSAGE_SELF)
+        cru1 = s["rusage_children"]
+        cru2 = resource.getrusage(resource.RUSAGE_CHILDREN)
+        result = {
+            "name": s["name"],
+            "wall": time.perf_counter() - s["start"],
+            "cpu": ((ru2.ru_utime - ru1.ru_utime)
+                    + (ru2.ru_stime - ru1.ru_stime)),
+            "cpu_children": ((cru2.ru_utime - cru1.ru_utime)
+                             + (cru2.ru_stime - cru1.ru_stime)),
+            "max_rss": _max_rss(resource.RUSAGE_SELF),
+            "max_rss_children": _max_rss(resource.RUSAGE_CHILDREN),
+            "timers": s["timers"],
+            "counters": s["counters"],
+            "gauges": {
+                k: {"max": g["max"], "mean": g["sum"] / g["n"]}
+                for k, g in s["gauges"].items()
+            }
+        }
+        _state["stages"].append(result)
+        _state["stage"] = None
+        record("stage_end", stage=s["name"],
+               **{k: v for k, v in result.items() if k != "name"})
+
+
+def _max_rss(who):
+    # kilobytes on Linux
+    return resource.getrusage(who).ru_maxrss
+
+
+class _DiskSampler(threading.Thread):
+    def __init__(self, path, interval):
+        super().__init__(daemon=True)
+        self.path = path
+        self.interval = interval
+        self.peak = 0
+        self._stopped = threading.Event()
+
+    def run(self):
+        while True:
+            self.sample()
+            if self._stopped.wait(self.interval):
+                break
+
+    def sample(self):
+        size = 0
+        for root, dirs, files in os.walk(self.path):
+            for f in files:
+                try:
+                    size += os.path.getsize(os.path.join(root, f))
+                except FileNotFoundError:
+                    # Removed since listed
+                    pass
+
+        self.peak = max(self.peak, size)
+        record("disk", path=self.path, bytes=size)
+        return size
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+        self.sample()
+
+
+class _Timer(object):
+    __slots__ = ("name", "start")
+
+    def __init__(self, name):
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        seconds = time.perf_counter() - self.start
+        with _lock:
+            timers = _current()["timers"]
+            timers[self.name] = timers.get(self.name, 0) + seconds
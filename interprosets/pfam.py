@@ -1,13 +1,10 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-import json
 import os
 from tempfile import mkstemp
 
-import cx_Oracle
-
-from . import utils
+from . import metrics, utils
 
 HMM = "ftp://ftp.ebi.ac.uk/pub/databases/Pfam/current_release/Pfam-A.hmm.gz"
 CLANS = "ftp://ftp.ebi.ac.uk/pub/databases/Pfam/current_release/Pfam-A.clans.tsv.gz"
@@ -23,7 +20,10 @@ def parse_clans(filepath, entries):
             entries[fam_id]["parent"] = clan_id
 
 
-def run(uri, hmm_db=None, clans_tsv=None, processes=1, tmpdir=None):
+def run(uri, hmm_db=None, clans_tsv=None, processes=1, tmpdir=None,
+        pairs=False, max_evalue=None, top_k=None,
+        hmmscan_options=None, shards=1, timings=None,
+        buffer_size=utils.BUFFER_SIZE):
     if hmm_db is None:
         fd, hmm_db = mkstemp(suffix=os.path.basename(HMM), dir=tmpdir)
         os.close(fd)
@@ -37,21 +37,29 @@ def run(uri, hmm_db=None, clans_tsv=None, processes=1, tmpdir=None):
         utils.extract(hmm_db, _hmm_db)
         hmm_db = _hmm_db
 
-    utils.logger("parse HMMs")
-    entries = utils.parse_hmm(hmm_db, keep_hmm=True)
+    metrics.stage("parse HMMs")
+    entries = utils.parse_hmm(hmm_db, keep_hmm=False)
 
     if clans_tsv is None:
         fd, clans_tsv = mkstemp(suffix=os.path.basename(CLANS), dir=tmpdir)
         os.close(fd)
         utils.download(CLANS, clans_tsv)
 
-    utils.logger("parse clans")
+    metrics.stage("parse clans")
     parse_clans(clans_tsv, entries)
+    sets = {acc: e.get("parent") for acc, e in entries.items()}
+    del entries
 
-    utils.logger("run hmmemit")
+    metrics.stage("run hmmemit")
     jobs = []
     dirs = []
-    for acc, e in entries.items():
+    seen = set()
+    for e in utils.iter_hmm(hmm_db):
+        acc = e["accession"]
+        if acc in seen:
+            continue
+        seen.add(acc)
+
         fd, hmm_file = mkstemp(dir=tmpdir)
         os.close(fd)
 
@@ -70,101 +78,17 @@ def run(uri, hmm_db=None, clans_tsv=None, processes=1, tmpdir=None):
         utils.hmmemit(hmm_file, fa_file)
         jobs.append((acc, fa_file, hmm_db))
 
-    utils.logger("compress HMM database")
+    metrics.stage("compress HMM database")
     utils.hmmpress(hmm_db)
 
-    con = cx_Oracle.connect(uri)
-    utils.prepare_tables(con, DBCODE)
-    cur1 = con.cursor()
-    cur2 = con.cursor()
-    cur2.setinputsizes(evalue=cx_Oracle.NATIVE_FLOAT)
-    cnt = 0
-    data1 = []
-    data2 = []
-    utils.logger("run hmmscan: {:>10} / {}".format(cnt, len(jobs)))
-    for acc, fa_file, out_file, tab_file in utils.batch_hmmscan(jobs, processes):
-        sequence, _ = utils.read_fasta(fa_file)
-        targets = utils.parse_hmmscan_results(out_file, tab_file)
-
-        e = entries[acc]
-        data1.append((
-            acc,
-            DBCODE,
-            e.get("parent"),
-            sequence
-        ))
-
-        if len(data1) == utils.INSERT_SIZE:
-            cur1.executemany(
-                """
-                INSERT INTO INTERPRO.METHOD_SET
-                VALUES (:1, :2, :3, :4)
-                """,
-                data1
-            )
-            data1 = []
-
-        for t in targets:
-            if acc == t["accession"]:
-                continue
-
-            domains = []
-            for dom in t["domains"]:
-                domains.append({
-                    "query": dom["sequences"]["query"],
-                    "target": dom["sequences"]["target"],
-                    "ievalue": dom["ievalue"],
-                    "start": dom["coordinates"]["ali"]["start"],
-                    "end": dom["coordinates"]["ali"]["end"],
-                })
-
-            data2.append({
-                "query_ac": acc,
-                "target_ac": t["accession"],
-                "evalue": t["evalue"],
-                "evaluestr": t["evaluestr"],
-                "domains": json.dumps(domains)
-            })
-
-            if len(data2) == utils.INSERT_SIZE:
-                cur2.executemany(
-                    """
-                    INSERT INTO INTERPRO.METHOD_SCAN
-                    VALUES (
-                      :query_ac, :target_ac, :evalue, :evaluestr, :domains
-                    )
-                    """,
-                    data2
-                )
-                data2 = []
-
-        cnt += 1
-        if not cnt % 1000:
-            utils.logger("run hmmscan: {:>10} / {}".format(cnt, len(jobs)))
-
-    utils.logger("run hmmscan: {:>10} / {}".format(cnt, len(jobs)))
-
-    if data1:
-        cur1.executemany(
-            """
-            INSERT INTO INTERPRO.METHOD_SET
-            VALUES (:1, :2, :3, :4)
-            """,
-            data1
-        )
-
-    if data2:
-        cur2.executemany(
-            """
-            INSERT INTO INTERPRO.METHOD_SCAN
-            VALUES (
-              :query_ac, :target_ac, :evalue, :evaluestr, :domains
-            )
-            """,
-            data2
-        )
-
-    con.commit()
-    cur1.close()
-    cur2.close()
-    con.close()
+    results = (
+        (acc, sets[acc], sequence, targets)
+        for acc, sequence, targets in utils.run_hmmscan(jobs, processes,
+                                                        hmmscan_options,
+                                                        shards, timings)
+    )
+    utils.load(uri, DBCODE, results, len(jobs),
+               pairs=pairs,
+               max_evalue=max_evalue,
+               top_k=top_k,
+               buffer_size=buffer_size)
@@ -1,14 +1,11 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-import json
 import os
 import re
 from tempfile import mkstemp
 
-import cx_Oracle
-
-from . import utils
+from . import metrics, utils
 
 INFO = "ftp://ftp.pir.georgetown.edu/databases/pirsf/pirsfinfo.dat"
 DBCODE = "U"
@@ -37,14 +34,17 @@ def parse_dat(filepath):
     return families
 
 
-def run(uri, sf_hmm_all, pirsfinfo=None, processes=1, tmpdir=None):
+def run(uri, sf_hmm_all, pirsfinfo=None, processes=1, tmpdir=None,
+        pairs=False, max_evalue=None, top_k=None,
+        hmmscan_options=None, shards=1, timings=None,
+        buffer_size=utils.BUFFER_SIZE):
     if pirsfinfo is None:
         fd, pirsfinfo = mkstemp(suffix=os.path.basename(INFO), dir=tmpdir)
         os.close(fd)
 
         utils.download(INFO, pirsfinfo)
 
-    utils.logger("parse sets")
+    metrics.stage("parse sets")
     families = parse_dat(pirsfinfo)
 
     fd, hmm_db = mkstemp(dir=tmpdir)
@@ -52,9 +52,15 @@ def run(uri, sf_hmm_all, pirsfinfo=None, processes=1, tmpdir=None):
 
     jobs = []
     dirs = []
-    utils.logger("run hmmemit")
+    seen = set()
+    metrics.stage("run hmmemit")
     with open(hmm_db, "wt") as fh:
-        for acc, e in utils.parse_hmm(sf_hmm_all).items():
+        for e in utils.iter_hmm(sf_hmm_all):
+            acc = e["accession"]
+            if acc in seen:
+                continue
+            seen.add(acc)
+
             fh.write(e["hmm"])
 
             fd, hmm_file = mkstemp(dir=tmpdir)
@@ -75,100 +81,17 @@ def run(uri, sf_hmm_all, pirsfinfo=None, processes=1, tmpdir=None):
             utils.hmmemit(hmm_file, fa_file)
             jobs.append((acc, fa_file, hmm_db))
 
-    utils.logger("compress HMM database")
+    metrics.stage("compress HMM database")
     utils.hmmpress(hmm_db)
 
-    con = cx_Oracle.connect(uri)
-    utils.prepare_tables(con, DBCODE)
-
-    cur1 = con.cursor()
-    cur2 = con.cursor()
-    cur2.setinputsizes(evalue=cx_Oracle.NATIVE_FLOAT)
-    cnt = 0
-    data1 = []
-    data2 = []
-    utils.logger("run hmmscan: {:>10} / {}".format(cnt, len(jobs)))
-    for acc, fa_file, out_file, tab_file in utils.batch_hmmscan(jobs, processes):
-        sequence, _ = utils.read_fasta(fa_file)
-        targets = utils.parse_hmmscan_results(out_file, tab_file)
-
-        data1.append((
-            acc,
-            DBCODE,
-            families.get(acc),
-            sequence
-        ))
-
-        if len(data1) == utils.INSERT_SIZE:
-            cur1.executemany(
-                """
-                INSERT INTO INTERPRO.METHOD_SET
-                VALUES (:1, :2, :3, :4)
-                """,
-                data1
-            )
-            data1 = []
-
-        for t in targets:
-            if acc == t["accession"]:
-                continue
-
-            domains = []
-            for dom in t["domains"]:
-                domains.append({
-                    "query": dom["sequences"]["query"],
-                    "target": dom["sequences"]["target"],
-                    "ievalue": dom["ievalue"],
-                    "start": dom["coordinates"]["ali"]["start"],
-                    "end": dom["coordinates"]["ali"]["end"],
-                })
-
-            data2.append({
-                "query_ac": acc,
-                "target_ac": t["accession"],
-                "evalue": t["evalue"],
-                "evaluestr": t["evaluestr"],
-                "domains": json.dumps(domains)
-            })
-
-            if len(data2) == utils.INSERT_SIZE:
-                cur2.executemany(
-                    """
-                    INSERT INTO INTERPRO.METHOD_SCAN
-                    VALUES (
-                      :query_ac, :target_ac, :evalue, :evaluestr, :domains
-                    )
-                    """,
-                    data2
-                )
-                data2 = []
-
-        cnt += 1
-        if not cnt % 1000:
-            utils.logger("run hmmscan: {:>10} / {}".format(cnt, len(jobs)))
-
-    utils.logger("run hmmscan: {:>10} / {}".format(cnt, len(jobs)))
-
-    if data1:
-        cur1.executemany(
-            """
-            INSERT INTO INTERPRO.METHOD_SET
-            VALUES (:1, :2, :3, :4)
-            """,
-            data1
-        )
-
-    if data2:
-        cur2.executemany(
-            """
-            INSERT INTO INTERPRO.METHOD_SCAN
-            VALUES (:query_ac, :target_ac, :evalue, :evaluestr, :domains)
-            """,
-            data2
-        )
-
-    con.commit()
-    cur1.close()
-    cur2.close()
-    con.close()
-
+    results = (
+        (acc, families.get(acc), sequence, targets)
+        for acc, sequence, targets in utils.run_hmmscan(jobs, processes,
+                                                        hmmscan_options,
+                                                        shards, timings)
+    )
+    utils.load(uri, DBCODE, results, len(jobs),
+               pairs=pairs,
+               max_evalue=max_evalue,
+               top_k=top_k,
+               buffer_size=buffer_size)
@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Request profiling for the web application (opt-in, see `enable()`).
+
+Each request records the time spent in phases: connecting to the database,
+executing queries, fetching rows (CLOBs included, as they are fetched
+within rows), decoding documents, building graphs, serialising and
+compressing responses. Phases are sent in a `Server-Timing` header, and
+added to histograms per route. If a token is set, histograms are returned
+by `/admin/profile/` to requests with an `Authorization: Bearer <token>`
+header.
+
+A fraction of requests runs under cProfile (one at a time per process).
+Their profile is written to a directory if they took longer than a
+threshold, for `python -m pstats` or snakeviz.
+"""
+
+import cProfile
+import hmac
+import os
+import random
+import re
+import threading
+import time
+from datetime import datetime
+
+from flask import g, json, request
+
+# Upper bounds of histogram buckets, in milliseconds
+BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+
+_lock = threading.Lock()
+_profiler_lock = threading.Lock()
+_histograms = {}
+_config = {
+    "enabled": False,
+    "sample_rate": 0,
+    "threshold": 1000,
+    "dump_dir": None,
+    "token": None
+}
+
+
+def enable(app, sample_rate=0, threshold=1000, dump_dir=None, token=None):
+    # Called before other hooks are registered: the timing of a request
+    # then starts first and ends last
+    _config.update(enabled=True, sample_rate=sample_rate,
+                   threshold=threshold, dump_dir=dump_dir, token=token)
+    if dump_dir:
+        os.makedirs(dump_dir, exist_ok=True)
+
+    app.before_request(_start)
+    app.after_request(_finish)
+    app.teardown_request(_stop_profiler)
+
+    if token:
+        # Timings and routes are not public: no endpoint without a token
+        app.add_url_rule("/admin/profile/", "admin_profile", _summary)
+
+
+def phase(name):
+    return _Phase(name)
+
+
+def timings():
+    # Timings of the current request, None if not profiled
+    return g.get("timings") if _config["enabled"] else None
+
+
+def summary():
+    with _lock:
+        routes = {
+            rule: {name: dict(h, buckets=list(h["buckets"]))
+                   for name, h in phases.items()}
+            for rule, phases in _histograms.items()
+        }
+
+    for phases in routes.values():
+        for h in phases.values():
+            h["mean"] = h["sum"] / h["count"]
+            h["p50"] = _percentile(h["buckets"], h["count"], 50)
+            h["p95"] = _percentile(h["buckets"], h["count"], 95)
+            h["p99"] = _percentile(h["buckets"], h["count"], 99)
+            # [upper bound in ms, requests]
+            h["buckets"] = [
+                [b if b is not None else "+Inf", n]
+                for b, n in zip(BUCKETS + (None,), h["buckets"])
+            ]
+
+    return routes
+
+
+def _start():
+    g.timings = {}
+    g.started = time.perf_counter()
+
+    rate = _config["sample_rate"]
+    if rate and random.random() < rate and _profiler_lock.acquire(False):
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+
+
+def _finish(response):
+    if not hasattr(g, "started"):
+        return response
+
+    total = (time.perf_counter() - g.started) * 1000
+    phases = {k: v * 1000 for k, v in g.timings.items()}
+    phases["total"] = total
+
+    profiler = _stop_profiler()
+    if (profiler is not None and _config["dump_dir"]
+            and total >= _config["threshold"]):
+        _dump(profiler, total)
+
+    response.headers["Server-Timing"] = ", ".join(
+        "{};dur={:.1f}".format(name, ms) for name, ms in phases.items()
+    )
+
+    rule = request.url_rule.rule if request.url_rule else "<unmatched>"
+    with _lock:
+        histograms = _histograms.setdefault(rule, {})
+        for name, ms in phases.items():
+            h = histograms.get(name)
+            if h is None:
+                h = histograms[name] = {
+                    "count": 0,
+                    "sum": 0,
+                    "max": 0,
+                    "buckets": [0] * (len(BUCKETS) + 1)
+                }
+
+            h["count"] += 1
+            h["sum"] += ms
+            h["max"] = max(h["max"], ms)
+            h["buckets"][_bucket(ms)] += 1
+
+    return response
+
+
+def _stop_profiler(error=None):
+    # Also called on teardown, if the request failed
+    profiler = g.pop("profiler", None)
+    if profiler is not None:
+        profiler.disable()
+        _profiler_lock.release()
+    return profiler
+
+
+def _summary():
+    scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not hmac.compare_digest(
+            token.encode("utf-8"), _config["token"].encode("utf-8")):
+        return json.jsonify({"error": "Forbidden"}), 403
+
+    return json.jsonify(summary()), 200
+
+
+def _bucket(ms):
+    for i, bound in enumerate(BUCKETS):
+        if ms <= bound:
+            return i
+    return len(BUCKETS)
+
+
+def _dump(profiler, total):
+    rule = request.url_rule.rule if request.url_rule else request.path
+    filename = "{:%Y%m%d-%H%M%S}-{}-{:.0f}ms-{}.prof".format(
+        datetime.now(), re.sub(r"\W+", "_", rule).strip("_") or "root",
+        total, os.getpid()
+    )
+    profiler.dump_stats(os.path.join(_config["dump_dir"], filename))
+
+
+def _percentile(buckets, count, p):
+    # Upper bound of the bucket holding the percentile (None: above all)
+    rank = count * p / 100
+    n = 0
+    for bound, k in zip(BUCKETS + (None,), buckets):
+        n += k
+        if n >= rank:
+            return bound
+    return None
+
+
+class _Phase(object):
+    __slots__ = ("name", "start", "timings")
+
+    def __init__(self, name):
+        self.name = name
+        self.start = None
+        self.timings = None
+
+    def __enter__(self):
+        self.timings = timings()
+        if self.timings is not None:
+            self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        if self.timings is not None:
+            seconds = time.perf_counter() - self.start
+            self.timings[self.name] = (self.timings.get(self.name, 0)
+                                       + seconds)
@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Consistency of sets with hits, for all methods of a database at once
+(requires NumPy).
+
+Hits are read once (see `hits`), and each pair of methods counts once,
+for both methods, with its best E-value. For each method, grouped
+reductions count hits, hits to methods of other sets, and hits to methods
+without set, and find the best hit within its set, and to another set.
+
+Two kinds of methods are stored in METHOD_SET_REPORT, and ranked by score
+(-log10 E-value):
+  - `other_set`: methods of a set with a better hit to another set than
+    within their set. Score: difference between the best hit to another
+    set and the best hit within the set (0 if none).
+  - `no_set`: methods without set, with a hit to a set. Score: best hit
+    to a set.
+"""
+
+import cx_Oracle
+import numpy as np
+
+from . import hits, metrics, utils
+
+KINDS = ("other_set", "no_set")
+
+
+def run(uri, dbcode):
+    con = cx_Oracle.connect(uri)
+
+    metrics.stage("load hits")
+    accessions, sets, src, dst, evalues = hits.load(con, dbcode)
+    utils.logger("{} methods, {} hits".format(len(accessions), len(src)))
+
+    metrics.stage("compute report")
+    rows = compute(accessions, sets, src, dst, evalues)
+    for kind in KINDS:
+        utils.logger("{}: {} methods".format(
+            kind, sum(1 for row in rows if row[1] == kind)
+        ))
+
+    metrics.stage("store report")
+    store(con, dbcode, rows)
+    con.close()
+
+
+def compute(accessions, sets, src, dst, evalues):
+    """
+    Returns (accession, kind, rank, score, set, hits, hits to other sets,
+    hits to methods without set, best E-value within the set, best other
+    set, best E-value to that set) of reported methods.
+    """
+    n = len(accessions)
+    set_names = sorted({s for s in sets if s})
+    set_ids = {s: i for i, s in enumerate(set_names)}
+    set_of = np.array([set_ids[s] if s else -1 for s in sets],
+                      dtype=np.int32)
+
+    # Hits of each method: both methods of each pair
+    a, b, e = hits.pairs(src, dst, evalues)
+    query = np.concatenate((a, b))
+    target = np.concatenate((b, a))
+    e = np.concatenate((e, e))
+
+    query_set = set_of[query]
+    target_set = set_of[target]
+    same = (query_set >= 0) & (target_set == query_set)
+    other = (target_set >= 0) & (target_set != query_set)
+    without = target_set < 0
+
+    n_hits = np.bincount(query, minlength=n)
+    n_other = np.bincount(query[other], minlength=n)
+    n_without = np.bincount(query[without], minlength=n)
+    best_own, _ = _group_min(query[same], e[same], n)
+    best_other, i_other = _group_min(query[other], e[other], n)
+    other_set = np.full(n, -1, dtype=np.int32)
+    found = i_other >= 0
+    other_set[found] = target_set[other][i_other[found]]
+
+    own_score = np.where(np.isfinite(best_own),
+                         np.maximum(hits.score(best_own), 0), 0)
+    other_score = np.maximum(hits.score(best_other), 0)
+
+    has_other = np.isfinite(best_other)
+    kinds = (
+        ("other_set", (set_of >= 0) & has_other & (best_other < best_own),
+         other_score - own_score),
+        ("no_set", (set_of < 0) & has_other, other_score)
+    )
+
+    rows = []
+    for kind, mask, scores in kinds:
+        nodes = np.flatnonzero(mask)
+        nodes = nodes[np.argsort(-scores[nodes], kind="stable")]
+        for rank, i in enumerate(nodes.tolist(), 1):
+            rows.append((
+                accessions[i],
+                kind,
+                rank,
+                float(scores[i]),
+                sets[i],
+                int(n_hits[i]),
+                int(n_other[i]),
+                int(n_without[i]),
+                float(best_own[i]) if np.isfinite(best_own[i]) else None,
+                set_names[other_set[i]],
+                float(best_other[i])
+            ))
+
+    return rows
+
+
+def store(con, dbcode, rows):
+    cur = con.cursor()
+    cur.execute(
+        """
+        DELETE FROM INTERPRO.METHOD_SET_REPORT
+        WHERE DBCODE = :1
+        """,
+        (dbcode,)
+    )
+
+    data = []
+    for row in rows:
+        data.append((row[0], dbcode) + row[1:])
+
+        if len(data) == utils.INSERT_SIZE:
+            _insert_rows(cur, data)
+            data = []
+
+    if data:
+        _insert_rows(cur, data)
+
+    con.commit()
+    cur.close()
+
+
+def _group_min(keys, values, n):
+    # Smallest value of each key (inf if none), and its index in `values`
+    order = np.lexsort((values, keys))
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = keys[order][1:] != keys[order][:-1]
+    best = order[first]
+
+    minimum = np.full(n, np.inf)
+    minimum[keys[best]] = values[best]
+    index = np.full(n, -1, dtype=np.int64)
+    index[keys[best]] = best
+    return minimum, index
+
+
+def _insert_rows(cur, data):
+    cur.setinputsizes(None, None, None, None, cx_Oracle.NATIVE_FLOAT,
+                      None, None, None, None, cx_Oracle.NATIVE_FLOAT,
+                      None, cx_Oracle.NATIVE_FLOAT)
+    cur.executemany(
+        """
+        INSERT INTO INTERPRO.METHOD_SET_REPORT
+        VALUES (:1, :2, :3, :4, :5, :6, :7, :8, :9, :10, :11, :12)
+        """,
+        data
+    )
+    metrics.count("rows", len(data))
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Prefix index of set accessions, member accessions, and member names.
+
+Keys are in lower case, in a sorted list: keys starting with a prefix are
+a contiguous range, found by bisection. The index is built when first
+needed, and built again when the version of the data changes (checked at
+most every `REFRESH_INTERVAL` seconds).
+"""
+
+import threading
+import time
+from bisect import bisect_left
+
+# Seconds between checks of the version of the data
+REFRESH_INTERVAL = 60
+
+# Results returned by `Index.search()`
+MAX_RESULTS = 20
+
+
+class Index(object):
+    def __init__(self, members):
+        # `members`: (accession, name, set accession, database) of methods
+        self.documents = []
+        keys = []
+        sets = set()
+        for acc, name, set_ac, database in members:
+            i = len(self.documents)
+            self.documents.append({
+                "accession": acc,
+                "name": name,
+                "type": "entry",
+                "set": set_ac,
+                "database": database
+            })
+            keys.append((acc.lower(), i))
+            if name:
+                keys.append((name.lower(), i))
+
+            if set_ac and set_ac not in sets:
+                sets.add(set_ac)
+                keys.append((set_ac.lower(), len(self.documents)))
+                self.documents.append({
+                    "accession": set_ac,
+                    "name": None,
+                    "type": "set",
+                    "set": set_ac,
+                    "database": database
+                })
+
+        keys.sort()
+        self.keys = [k for k, i in keys]
+        self.ids = [i for k, i in keys]
+
+    def __len__(self):
+        return len(self.documents)
+
+    def search(self, query, limit=MAX_RESULTS):
+        query = query.strip().lower()
+        if not query:
+            return []
+
+        results = []
+        seen = set()
+        k = bisect_left(self.keys, query)
+        while (k < len(self.keys) and len(results) < limit
+               and self.keys[k].startswith(query)):
+            i = self.ids[k]
+            if i not in seen:
+                seen.add(i)
+                results.append(self.documents[i])
+            k += 1
+
+        return results
+
+
+class LazyIndex(object):
+    def __init__(self, get_version, get_members,
+                 interval=REFRESH_INTERVAL):
+        self.get_version = get_version
+        self.get_members = get_members
+        self.interval = interval
+        self.index = None
+        self.version = None
+        self.checked = 0
+        self.lock = threading.Lock()
+
+    def get(self):
+        if self.index is not None and not self._expired():
+            return self.index
+
+        if not self.lock.acquire(blocking=self.index is None):
+            # Being checked/built by another request: use the current index
+            return self.index
+
+        try:
+            if self.index is None or self._expired():
+                version = self.get_version()
+                if self.index is None or version != self.version:
+                    self.index = Index(self.get_members())
+                    self.version = version
+
+                self.checked = time.time()
+        finally:
+            self.lock.release()
+
+        return self.index
+
+    def _expired(self):
+        return time.time() >= self.checked + self.interval
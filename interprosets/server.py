@@ -1,12 +1,15 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import functools
+import mimetypes
 import os
 
-import cx_Oracle
 from flask import json
-from flask import Flask, g, render_template
+from flask import (Flask, g, render_template, request,
+                   send_from_directory, stream_with_context, url_for)
 
+from . import alignment, assets, db, export, graph, profiling, search
 
 try:
     URI = os.environ["INTERPRO_URI"]
@@ -15,13 +18,377 @@ except KeyError:
 
 app = Flask(__name__)
 
+# Directory of an API snapshot (see `export`), served instead of the database
+app.config["SNAPSHOT"] = os.environ.get("INTERPRO_SNAPSHOT")
+
+# Opt-in profiling of requests, enabled before other hooks are registered
+if os.environ.get("INTERPRO_PROFILE"):
+    profiling.enable(
+        app,
+        sample_rate=float(os.environ.get("INTERPRO_PROFILE_SAMPLE", 0)),
+        threshold=float(os.environ.get("INTERPRO_PROFILE_THRESHOLD", 1000)),
+        dump_dir=os.environ.get("INTERPRO_PROFILE_DIR"),
+        token=os.environ.get("INTERPRO_PROFILE_TOKEN")
+    )
+
+# Accessions accepted by /api/entries/targets/
+MAX_ACCESSIONS = 100
+
+# Rows per kind returned by /api/database/<dbshort>/report/
+REPORT_ROWS = 100
+MAX_REPORT_ROWS = 1000
+
+# Seconds after which clients may retry while a database is loaded
+LOADING_RETRY_AFTER = 5
+
+# Seconds built static files (/assets/) may be cached for
+ASSETS_MAX_AGE = 365 * 24 * 3600
+
+# Built names of static files (see `assets.build()`)
+manifest = assets.load_manifest()
+
+# Hits stored per direction (METHOD_SCAN) or per pair (METHOD_SCAN_PAIR),
+# between methods identified by METHOD_SET.METHOD_ID
+SCAN_HITS = """
+    SELECT QUERY_ID, TARGET_ID, EVALUE, DOMAINS
+    FROM INTERPRO.METHOD_SCAN
+    UNION ALL
+    SELECT METHOD_ID1, METHOD_ID2, EVALUE1, DOMAINS1
+    FROM INTERPRO.METHOD_SCAN_PAIR
+    WHERE DOMAINS1 IS NOT NULL
+    UNION ALL
+    SELECT METHOD_ID2, METHOD_ID1, EVALUE2, DOMAINS2
+    FROM INTERPRO.METHOD_SCAN_PAIR
+    WHERE DOMAINS2 IS NOT NULL
+"""
+
+# Hits between members of a set (:acc), both directions, with an E-value
+# of at most :max_evalue: ranges of the (query, E-value, target) indexes
+SET_HITS = """
+    SELECT QUERY_ID, TARGET_ID, EVALUE
+    FROM INTERPRO.METHOD_SCAN
+    WHERE QUERY_ID IN ({0})
+    AND TARGET_ID IN ({0}){1}
+    UNION ALL
+    SELECT METHOD_ID1, METHOD_ID2, EVALUE
+    FROM INTERPRO.METHOD_SCAN_PAIR
+    WHERE METHOD_ID1 IN ({0})
+    AND METHOD_ID2 IN ({0}){2}
+    UNION ALL
+    SELECT METHOD_ID2, METHOD_ID1, EVALUE
+    FROM INTERPRO.METHOD_SCAN_PAIR
+    WHERE METHOD_ID2 IN ({0})
+    AND METHOD_ID1 IN ({0}){2}
+"""
+
+SET_MEMBER_IDS = ("SELECT METHOD_ID FROM INTERPRO.METHOD_SET "
+                  "WHERE SET_AC = :acc")
+
+
+def get_data_version():
+    # Changes when a database is loaded (see `utils.exchange_partitions()`)
+    return get_db().fetchall(
+        """
+        SELECT DBCODE, VERSION
+        FROM INTERPRO.METHOD_SET_VERSION
+        ORDER BY DBCODE
+        """
+    )
+
+
+def get_load_state():
+    # Version of each database, and whether its partitions are being
+    # exchanged (see `utils.exchange_partitions()`)
+    return get_db().fetchall(
+        """
+        SELECT DBCODE, VERSION, LOADING
+        FROM INTERPRO.METHOD_SET_VERSION
+        ORDER BY DBCODE
+        """
+    )
+
 
 def get_db():
     if not hasattr(g, "con"):
-        g.con = cx_Oracle.connect(URI)
+        g.con = db.Connection(URI, timings=profiling.timings())
     return g.con
 
 
+def get_targets(where, params):
+    # Targets of methods (METHOD_SET Q) matching `where`, by accession.
+    # With ?encoded=1, domains are returned as stored (see `alignment`)
+    if request.args.get("encoded") == "1":
+        read_domains = alignment.read_domains
+    else:
+        read_domains = alignment.decode_domains
+
+    con = get_db()
+    rows = con.fetchall(
+        """
+        SELECT Q.METHOD_AC, M.NAME, Q.SET_AC, Q.SEQUENCE
+        FROM INTERPRO.METHOD_SET Q
+        LEFT OUTER JOIN INTERPRO.METHOD M
+          ON Q.METHOD_AC = M.METHOD_AC
+        WHERE {}
+        """.format(where),
+        params
+    )
+
+    entries = {}
+    for method_ac, name, set_ac, sequence in rows:
+        entries[method_ac] = {
+            'accession': method_ac,
+            'name': name,
+            'sequence': sequence,
+            'set': set_ac,
+            'targets': []
+        }
+
+    if not entries:
+        return entries
+
+    rows = con.fetchall(
+        """
+        SELECT Q.METHOD_AC, SE.METHOD_AC, M.NAME, SE.SET_AC, SC.EVALUE,
+          SC.DOMAINS
+        FROM ({}) SC
+        INNER JOIN INTERPRO.METHOD_SET Q
+          ON SC.QUERY_ID = Q.METHOD_ID
+        INNER JOIN INTERPRO.METHOD_SET SE 
+          ON SC.TARGET_ID = SE.METHOD_ID
+        LEFT OUTER JOIN INTERPRO.METHOD M ON SE.METHOD_AC = M.METHOD_AC
+        WHERE {}
+        """.format(SCAN_HITS, where),
+        params
+    )
+
+    with profiling.phase("decode"):
+        for row in rows:
+            entry = entries[row[0]]
+            if row[1] != entry['set']:
+                entry['targets'].append({
+                    'accession': row[1],
+                    'name': row[2],
+                    'set': row[3],
+                    'evalue': row[4],
+                    'domains': read_domains(row[5], entry['sequence'])
+                })
+
+    for entry in entries.values():
+        set_ac = entry['set']
+        entry['targets'].sort(
+            key=lambda x: (0 if x['set'] != set_ac else 1, x['evalue'])
+        )
+
+    return entries
+
+
+def get_set_graph(accession, column):
+    # JSON document built by the pipeline (see `graph`)
+    row = get_db().fetchone(
+        """
+        SELECT {}
+        FROM INTERPRO.METHOD_SET_GRAPH
+        WHERE SET_AC = :1
+        """.format(column),
+        (accession,)
+    )
+    return row[0] if row else None
+
+
+def get_set_hits(accession, max_evalue, top_k):
+    # Hits between members of a set, filtered by the database:
+    # E-value of at most `max_evalue`, and the `top_k` best per query.
+    # Pairs (METHOD_SCAN_PAIR) have the best E-value of both directions,
+    # so both directions of a pair are kept or dropped together
+    params = {"acc": accession}
+    if max_evalue is not None:
+        params["max_evalue"] = max_evalue
+        filters = (" AND EVALUE <= :max_evalue",) * 2
+    else:
+        filters = ("", "")
+
+    if top_k is not None:
+        params["top_k"] = top_k
+        rank = "WHERE H.RN <= :top_k"
+    else:
+        rank = ""
+
+    return get_db().fetchall(
+        """
+        SELECT Q.METHOD_AC, MQ.NAME, T.METHOD_AC, MT.NAME, H.EVALUE
+        FROM (
+          SELECT QUERY_ID, TARGET_ID, EVALUE,
+            ROW_NUMBER() OVER (
+              PARTITION BY QUERY_ID ORDER BY EVALUE, TARGET_ID
+            ) RN
+          FROM ({})
+        ) H
+        INNER JOIN INTERPRO.METHOD_SET Q
+          ON H.QUERY_ID = Q.METHOD_ID
+        INNER JOIN INTERPRO.METHOD_SET T
+          ON H.TARGET_ID = T.METHOD_ID
+        LEFT OUTER JOIN INTERPRO.METHOD MQ
+          ON Q.METHOD_AC = MQ.METHOD_AC
+        LEFT OUTER JOIN INTERPRO.METHOD MT
+          ON T.METHOD_AC = MT.METHOD_AC
+        {}
+        """.format(SET_HITS.format(SET_MEMBER_IDS, *filters), rank),
+        params
+    )
+
+
+def get_hit_filters():
+    # `max_evalue` and `top_k` query parameters (None if not passed),
+    # ValueError if invalid
+    max_evalue = request.args.get("max_evalue")
+    if max_evalue is not None:
+        max_evalue = float(max_evalue)
+        if not max_evalue >= 0:
+            raise ValueError(max_evalue)
+
+    top_k = request.args.get("top_k")
+    if top_k is not None:
+        top_k = int(top_k)
+        if top_k < 1:
+            raise ValueError(top_k)
+
+    return max_evalue, top_k
+
+
+def jsonify(obj):
+    with profiling.phase("serialise"):
+        return json.jsonify(obj)
+
+
+def get_search_members():
+    return get_db().fetchall(
+        """
+        SELECT MS.METHOD_AC, M.NAME, MS.SET_AC, D.DBSHORT
+        FROM INTERPRO.METHOD_SET MS
+        INNER JOIN INTERPRO.CV_DATABASE D
+          ON MS.DBCODE = D.DBCODE
+        LEFT OUTER JOIN INTERPRO.METHOD M
+          ON MS.METHOD_AC = M.METHOD_AC
+        """,
+        arraysize=5000
+    )
+
+
+def stream_entries(entries):
+    # One JSON object, keyed by accession, sent one entry at a time
+    def generate():
+        yield "{"
+        for i, (acc, entry) in enumerate(entries.items()):
+            yield "{}{}:{}".format("," if i else "", json.dumps(acc),
+                                   json.dumps(entry))
+        yield "}"
+
+    return app.response_class(stream_with_context(generate()),
+                              mimetype="application/json")
+
+
+def consistent(view):
+    # Views joining methods and hits by ID. Partitions of a database are
+    # exchanged one table at a time, and IDs change with each load, so
+    # rows read during an exchange may come from two loads: 503, to retry
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        state = get_load_state()
+        if not any(loading for _, _, loading in state):
+            response = view(*args, **kwargs)
+            if get_load_state() == state:
+                return response
+
+        return jsonify({
+            'error': 'A database is being loaded, retry later'
+        }), 503, {'Retry-After': str(LOADING_RETRY_AFTER)}
+
+    return wrapper
+
+
+search_index = search.LazyIndex(get_data_version, get_search_members)
+
+
+@app.template_global()
+def static_url(filename):
+    # Built (hashed) file if static files were built, original file otherwise
+    try:
+        return url_for('built_static', filename=manifest[filename])
+    except KeyError:
+        return url_for('static', filename=filename)
+
+
+@app.before_request
+def serve_snapshot():
+    # Exported document, for requests without parameters
+    root = app.config["SNAPSHOT"]
+    if not root or request.query_string or request.method != "GET":
+        return None
+
+    for status in export.STATUSES:
+        filename = export.filename(request.path, status)
+        if filename is None:
+            return None
+        elif os.path.isfile(os.path.join(root, filename)):
+            break
+    else:
+        return None
+
+    name, encoding = assets.find_built(filename,
+                                       request.headers.get("Accept-Encoding"),
+                                       dest=root)
+    if status == 200:
+        # Range and conditional requests: 206 or 304
+        response = send_from_directory(root, name,
+                                       mimetype="application/json")
+    else:
+        response = send_from_directory(root, name,
+                                       mimetype="application/json",
+                                       conditional=False)
+        response.status_code = status
+    if encoding is not None:
+        response.headers["Content-Encoding"] = encoding
+    response.vary.add("Accept-Encoding")
+    return response
+
+
+@app.after_request
+def compress_response(response):
+    # JSON responses: streamed, or of at least `assets.MIN_SIZE` bytes
+    if (response.mimetype != "application/json"
+            or response.direct_passthrough
+            or "Content-Encoding" in response.headers):
+        return response
+
+    response.vary.add("Accept-Encoding")
+    encoding = assets.negotiate(request.headers.get("Accept-Encoding"))
+    if encoding is None:
+        return response
+    elif response.is_streamed:
+        response.response = assets.compress_stream(response.response,
+                                                   encoding)
+    else:
+        data = response.get_data()
+        if len(data) < assets.MIN_SIZE:
+            return response
+        with profiling.phase("compress"):
+            response.set_data(assets.compress(data, encoding))
+
+    response.headers["Content-Encoding"] = encoding
+    return response
+
+
+@app.after_request
+def count_round_trips(response):
+    if hasattr(g, "con"):
+        response.headers["X-DB-Queries"] = str(g.con.queries)
+        response.headers["X-DB-Estimated-Round-Trips"] = str(
+            g.con.estimated_round_trips
+        )
+    return response
+
+
 @app.teardown_appcontext
 def close_db(error):
     if hasattr(g, "con"):
@@ -30,8 +397,7 @@ def close_db(error):
 
 @app.route('/api/databases/')
 def api_databases():
-    cur = get_db().cursor()
-    cur.execute(
+    rows = get_db().fetchall(
         """
         SELECT DISTINCT DBNAME, DBSHORT
         FROM INTERPRO.CV_DATABASE
@@ -40,16 +406,14 @@ def api_databases():
         """
     )
 
-    databases = [dict(zip(("name", "id"), row)) for row in cur]
-    cur.close()
+    databases = [dict(zip(("name", "id"), row)) for row in rows]
 
-    return json.jsonify(databases), 200
+    return jsonify(databases), 200
 
 
 @app.route('/api/database/<dbshort>/')
 def api_database(dbshort):
-    cur = get_db().cursor()
-    cur.execute(
+    rows = get_db().fetchall(
         """
         SELECT SET_AC, COUNT(*)
         FROM INTERPRO.CV_DATABASE
@@ -62,16 +426,80 @@ def api_database(dbshort):
         (dbshort,)
     )
 
-    sets = [dict(zip(("accession", "count"), row)) for row in cur]
-    cur.close()
+    sets = [dict(zip(("accession", "count"), row)) for row in rows]
+
+    return jsonify(sets), 200
+
+
+@app.route('/api/database/<dbshort>/report/')
+def api_database_report(dbshort):
+    # ?kind=other_set|no_set&limit=INT: best ranked methods of each kind
+    kind = request.args.get("kind")
+    try:
+        limit = int(request.args.get("limit", REPORT_ROWS))
+    except ValueError:
+        limit = 0
+
+    if kind not in (None, "other_set", "no_set") or not (
+            0 < limit <= MAX_REPORT_ROWS):
+        return jsonify({
+            'error': 'Invalid kind, or limit not between 1 and '
+                     '{}'.format(MAX_REPORT_ROWS)
+        }), 400
+
+    params = [dbshort, limit]
+    where = ""
+    if kind is not None:
+        params.append(kind)
+        where = "AND R.KIND = :3"
+
+    rows = get_db().fetchall(
+        """
+        SELECT R.METHOD_AC, M.NAME, R.KIND, R.RANK, R.SCORE, R.SET_AC,
+          R.HITS, R.HITS_OTHER_SET, R.HITS_WITHOUT_SET, R.OWN_EVALUE,
+          R.OTHER_SET_AC, R.OTHER_EVALUE
+        FROM INTERPRO.METHOD_SET_REPORT R
+        INNER JOIN INTERPRO.CV_DATABASE D
+          ON R.DBCODE = D.DBCODE
+        LEFT OUTER JOIN INTERPRO.METHOD M
+          ON R.METHOD_AC = M.METHOD_AC
+        WHERE D.DBSHORT = :1
+        AND R.RANK <= :2
+        {}
+        ORDER BY R.KIND, R.RANK
+        """.format(where),
+        params
+    )
+
+    cols = (
+        "accession",
+        "name",
+        "kind",
+        "rank",
+        "score",
+        "set",
+        # Pairs of methods with hits (see `report.compute()`), not targets
+        "pairs",
+        "pairs_other_set",
+        "pairs_without_set",
+        "set_evalue",
+        "other_set",
+        "other_set_evalue"
+    )
+    methods = [dict(zip(cols, row)) for row in rows]
+    return jsonify(methods), 200
+
 
-    return json.jsonify(sets), 200
+@app.route('/api/search/')
+def api_search():
+    query = request.args.get("q", "")
+    return jsonify(search_index.get().search(query)), 200
 
 
 @app.route('/api/set/<accession>/')
+@consistent
 def api_set_members(accession):
-    cur = get_db().cursor()
-    cur.execute(
+    rows = get_db().fetchall(
         """
         SELECT 
           Q.METHOD_AC,
@@ -100,16 +528,16 @@ def api_set_members(accession):
             AS NUMBER
           )
         FROM INTERPRO.METHOD_SET Q
-        INNER JOIN INTERPRO.METHOD_SCAN SC 
-          ON Q.METHOD_AC = SC.QUERY_AC
+        INNER JOIN ({}) SC 
+          ON Q.METHOD_ID = SC.QUERY_ID
         LEFT OUTER JOIN INTERPRO.METHOD_SET T 
-          ON SC.TARGET_AC = T.METHOD_AC 
+          ON SC.TARGET_ID = T.METHOD_ID 
         LEFT OUTER JOIN INTERPRO.METHOD M 
           ON Q.METHOD_AC = M.METHOD_AC
         WHERE Q.SET_AC = :1
         GROUP BY Q.METHOD_AC
         ORDER BY Q.METHOD_AC
-        """,
+        """.format(SCAN_HITS),
         (accession,)
     )
 
@@ -120,189 +548,153 @@ def api_set_members(accession):
         "targets_without_set",
         "targets_other_set"
     )
-    members = [dict(zip(cols, row)) for row in cur]
-    cur.close()
-    return json.jsonify(members), 200 if members else 404
+    members = [dict(zip(cols, row)) for row in rows]
+    return jsonify(members), 200 if members else 404
 
 
 @app.route('/api/entry/<accession>/targets/')
+@consistent
 def api_entry_targets(accession):
-    cur = get_db().cursor()
-    cur.execute(
-        """
-        SELECT NAME, SET_AC, SEQUENCE
-        FROM INTERPRO.METHOD_SET
-        LEFT OUTER JOIN INTERPRO.METHOD USING (METHOD_AC)
-        WHERE METHOD_AC = :1
-        """,
-        (accession,)
+    entries = get_targets("Q.METHOD_AC = :1", (accession,))
+    try:
+        return jsonify(entries[accession]), 200
+    except KeyError:
+        return jsonify({
+            'accession': accession,
+            'name': None,
+            'sequence': None,
+            'set': None,
+            'targets': []
+        }), 404
+
+
+@app.route('/api/entries/targets/')
+@consistent
+def api_entries_targets():
+    # ?accessions=ACC1,ACC2,...
+    accessions = sorted({
+        acc.strip()
+        for acc in request.args.get("accessions", "").split(",")
+        if acc.strip()
+    })
+    if not accessions or len(accessions) > MAX_ACCESSIONS:
+        return jsonify({
+            'error': 'Between 1 and {} accessions '
+                     'expected'.format(MAX_ACCESSIONS)
+        }), 400
+
+    where = "Q.METHOD_AC IN ({})".format(
+        ", ".join(":{}".format(i + 1) for i in range(len(accessions)))
     )
-    row = cur.fetchone()
+    return stream_entries(get_targets(where, accessions))
 
-    name = set_ac = sequence = None
-    targets = []
-    if row:
-        name, set_ac, sequence = row
-        sequence = sequence.read()
 
-        cur.execute(
-            """
-            SELECT SC.TARGET_AC, M.NAME, SE.SET_AC, SC.EVALUE, SC.DOMAINS
-            FROM INTERPRO.METHOD_SCAN SC
-            INNER JOIN INTERPRO.METHOD_SET SE 
-              ON SC.TARGET_AC = SE.METHOD_AC
-            LEFT OUTER JOIN INTERPRO.METHOD M ON SC.TARGET_AC = M.METHOD_AC
-            WHERE SC.QUERY_AC = :1
-            """,
-            (accession,)
-        )
-
-        for row in cur:
-            if row[0] != set_ac:
-                targets.append({
-                    'accession': row[0],
-                    'name': row[1],
-                    'set': row[2],
-                    'evalue': row[3],
-                    'domains': json.loads(row[4].read())
-                })
-
-    cur.close()
-
-    return json.jsonify({
-        'accession': accession,
-        'name': name,
-        'sequence': sequence,
-        'set': set_ac,
-        'targets': sorted(
-            targets,
-            key=lambda x: (0 if x['set'] != set_ac else 1, x['evalue'])
-        )
-    }), 200 if sequence else 404
+@app.route('/api/set/<accession>/targets/')
+@consistent
+def api_set_targets(accession):
+    entries = get_targets("Q.SET_AC = :1", (accession,))
+    if not entries:
+        return jsonify({}), 404
+    return stream_entries(entries)
 
 
 @app.route('/api/set/<accession>/relationships/')
+@consistent
 def api_relationships(accession):
-    cur = get_db().cursor()
-    cur.execute(
-        """
-        SELECT 
-          SC.QUERY_AC, M1.NAME, SC.TARGET_AC, M2.NAME, SC.EVALUE
-        FROM INTERPRO.METHOD_SCAN SC
-        INNER JOIN INTERPRO.METHOD_SET Q
-          ON SC.QUERY_AC = Q.METHOD_AC
-        INNER JOIN INTERPRO.METHOD_SET T
-          ON SC.TARGET_AC = T.METHOD_AC
-        LEFT OUTER JOIN INTERPRO.METHOD M1
-          ON Q.METHOD_AC = M1.METHOD_AC
-        LEFT OUTER JOIN INTERPRO.METHOD M2
-          ON T.METHOD_AC = M2.METHOD_AC
-        WHERE Q.SET_AC = :1 AND T.SET_AC = :1
-        """,
-        (accession,)
-    )
-
-    nodes = {}
-    edges = {}
-
-    for row in cur:
-        method_ac = row[0]
-        method_name = row[1]
-        target_ac = row[2]
-        target_name = row[3]
-        evalue = row[4]
-
-        if method_ac not in nodes:
-            nodes[method_ac] = {
-                'accession': method_ac,
-                'name': method_name
+    # ?max_evalue=FLOAT&top_k=INT: hits filtered by the database,
+    # otherwise the graph built by the pipeline, with all hits
+    try:
+        max_evalue, top_k = get_hit_filters()
+    except ValueError:
+        return jsonify({
+            'error': 'Invalid max_evalue or top_k'
+        }), 400
+
+    doc = get_set_graph(accession, "RELATIONSHIPS")
+    if doc is not None and (max_evalue is not None or top_k is not None):
+        # Nodes keep the positions of the complete graph
+        with profiling.phase("decode"):
+            positions = {
+                node['accession']: (node['x'], node['y'])
+                for node in json.loads(doc)['data']['nodes']
+                if 'x' in node
             }
 
-        if target_ac not in nodes:
-            nodes[target_ac] = {
-                'accession': target_ac,
-                'name': target_name
+        hits = get_set_hits(accession, max_evalue, top_k)
+        with profiling.phase("build"):
+            doc = graph.relationships(accession, hits, positions=positions)
+        if doc is not None:
+            with profiling.phase("serialise"):
+                doc = graph.dumps(doc)
+
+    if doc is None:
+        return jsonify({
+            'accession': accession,
+            'data': {
+                'nodes': [],
+                'links': []
             }
+        }), 404
 
-        if method_ac > target_ac:
-            method_ac, target_ac = target_ac, method_ac
-
-        if method_ac not in edges:
-            edges[method_ac] = {target_ac: evalue}
-        elif target_ac not in edges[method_ac] or evalue < edges[method_ac][target_ac]:
-            edges[method_ac][target_ac] = evalue
-
-    cur.close()
-
-    return json.jsonify({
-        'accession': accession,
-        'data': {
-            'nodes': list(nodes.values()),
-            'links': [
-                {
-                    'source': acc1,
-                    'target': acc2,
-                    'value': edges[acc1][acc2]
-                }
-                for acc1 in edges
-                for acc2 in edges[acc1]
-            ]
-        }
-    }), 200 if nodes else 404
+    return app.response_class(doc, mimetype="application/json"), 200
 
 
 @app.route('/api/set/<accession>/similarity/')
+@consistent
 def api_set_similarity(accession):
-    cur = get_db().cursor()
-    cur.execute(
-        """
-        SELECT METHOD_AC, NAME
-        FROM INTERPRO.METHOD_SET MS
-        LEFT OUTER JOIN INTERPRO.METHOD USING (METHOD_AC)
-        WHERE SET_AC = :1
-        ORDER BY METHOD_AC
-        """,
-        (accession,)
-    )
-
-    methods = {row[0]: {'accession': row[0], 'name': row[1]} for row in cur}
-    accessions = list(methods.keys())
-    methods = sorted(methods.values(), key=lambda x: x['accession'])
-
-    m = [[None] * len(accessions) for _ in accessions]
-
-    if accessions:
-        cur.execute(
+    # ?max_evalue=FLOAT&top_k=INT: as for relationships
+    try:
+        max_evalue, top_k = get_hit_filters()
+    except ValueError:
+        return jsonify({
+            'error': 'Invalid max_evalue or top_k'
+        }), 400
+
+    if max_evalue is None and top_k is None:
+        doc = get_set_graph(accession, "SIMILARITY")
+    else:
+        methods = get_db().fetchall(
             """
-            SELECT 
-              SC.QUERY_AC, M1.NAME, SC.TARGET_AC, M2.NAME, SC.EVALUE
-            FROM INTERPRO.METHOD_SCAN SC
-            INNER JOIN INTERPRO.METHOD_SET Q
-              ON SC.QUERY_AC = Q.METHOD_AC
-            INNER JOIN INTERPRO.METHOD_SET T
-              ON SC.TARGET_AC = T.METHOD_AC
-            LEFT OUTER JOIN INTERPRO.METHOD M1
-              ON Q.METHOD_AC = M1.METHOD_AC
-            LEFT OUTER JOIN INTERPRO.METHOD M2
-              ON T.METHOD_AC = M2.METHOD_AC
-            WHERE Q.SET_AC = :1 AND T.SET_AC = :1
+            SELECT MS.METHOD_AC, M.NAME
+            FROM INTERPRO.METHOD_SET MS
+            LEFT OUTER JOIN INTERPRO.METHOD M
+              ON MS.METHOD_AC = M.METHOD_AC
+            WHERE MS.SET_AC = :1
             """,
             (accession,)
         )
-
-        for query_ac, _, target_ac, _, evalue in cur:
-            i = accessions.index(query_ac)
-            j = accessions.index(target_ac)
-            if m[i][j] is None or evalue < m[i][j]:
-                m[i][j] = m[j][i] = evalue
-
-    cur.close()
-
-    return json.jsonify({
-        'accession': accession,
-        'methods': methods,
-        'data': m
-    })
+        if methods:
+            hits = get_set_hits(accession, max_evalue, top_k)
+            with profiling.phase("build"):
+                doc = graph.similarity(accession, methods, hits)
+            with profiling.phase("serialise"):
+                doc = graph.dumps(doc)
+        else:
+            doc = None
+
+    if doc is None:
+        return jsonify({
+            'accession': accession,
+            'methods': [],
+            'data': []
+        })
+
+    return app.response_class(doc, mimetype="application/json")
+
+
+@app.route('/assets/<path:filename>')
+def built_static(filename):
+    # Precompressed copy of the file if the client accepts its encoding
+    name, encoding = assets.find_built(filename,
+                                       request.headers.get("Accept-Encoding"))
+    mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+    response = send_from_directory(assets.BUILD_DIR, name, mimetype=mimetype)
+    if encoding is not None:
+        response.headers["Content-Encoding"] = encoding
+    response.vary.add("Accept-Encoding")
+    response.headers["Cache-Control"] = ("public, max-age={}, "
+                                         "immutable".format(ASSETS_MAX_AGE))
+    return response
 
 
 @app.route('/')
@@ -67,11 +67,22 @@ const network = {
         }
 
         const nodes = deepCopy(this.data.nodes);
+        // E-value of at most the threshold, as `max_evalue` on the server
         const links = deepCopy(this.data.links)
-            .filter(x => this.threshold === null || x.value < this.threshold);
+            .filter(x => this.threshold === null || x.value <= this.threshold);
         const radius = 10;
         const size = Math.min(this.width, this.height);
 
+        // Positions computed by the pipeline, from 0 to 1
+        const positioned = nodes.length > 0 && nodes.every(d => d.x !== undefined);
+        if (positioned) {
+            const padding = radius * 2;
+            nodes.forEach(d => {
+                d.x = padding + d.x * (this.width - 2 * padding);
+                d.y = padding + d.y * (this.height - 2 * padding);
+            });
+        }
+
         links.forEach(x => {
             if (x.value < Number.MIN_VALUE)
                 x.value = Number.MIN_VALUE;
@@ -142,6 +153,23 @@ const network = {
         }
 
         const self = this;
+        if (positioned && this.threshold === null) {
+            // Rendered as laid out: no simulation
+            if (this.simulation) {
+                this.simulation.stop();
+                this.simulation = null;
+            }
+
+            const byAccession = {};
+            nodes.forEach(d => byAccession[d.accession] = d);
+            links.forEach(d => {
+                d.source = byAccession[d.source];
+                d.target = byAccession[d.target];
+            });
+            ticked();
+            return;
+        }
+
         if (this.simulation === null) {
             this.simulation = d3.forceSimulation()
                 .force('charge', d3.forceManyBody().strength(-5))
@@ -155,20 +183,29 @@ const network = {
         this.simulation.force('link')
             .links(links)
             .distance(d => scale(d.value));
-        this.simulation.alpha(1).on('tick', ticked).restart();
+        // Starting from computed positions, the layout is mostly done
+        this.simulation.alpha(positioned ? 0.3 : 1).on('tick', ticked).restart();
 
         function dragstarted(d) {
+            if (self.simulation === null) return;
             if (!d3.event.active) self.simulation.alphaTarget(0.3).restart();
             d.fx = d.x;
             d.fy = d.y;
         }
 
         function dragged(d) {
+            if (self.simulation === null) {
+                d.x = d3.event.x;
+                d.y = d3.event.y;
+                ticked();
+                return;
+            }
             d.fx = d3.event.x;
             d.fy = d3.event.y;
         }
 
         function dragended(d) {
+            if (self.simulation === null) return;
             if (!d3.event.active) self.simulation.alphaTarget(0);
             d.fx = null;
             d.fy = null;
@@ -176,7 +213,7 @@ const network = {
     },
     updateRadial: function () {
         const nodes = deepCopy(this.data.nodes);
-        const links = deepCopy(this.data.links).filter(i => this.threshold === null || i.value < this.threshold);
+        const links = deepCopy(this.data.links).filter(i => this.threshold === null || i.value <= this.threshold);
         const radius = 10;
         const radialRadius = Math.min(this.width, this.height)/3;
 
@@ -399,17 +436,54 @@ const network = {
 };
 
 
-function getRelationships(accession) {
-    queryAPI('/api/set/' + accession + '/relationships/')
+function getRelationships(accession, maxEvalue) {
+    // Hits above the E-value cutoff are filtered by the server
+    let url = '/api/set/' + accession + '/relationships/';
+    if (maxEvalue !== undefined && maxEvalue !== null)
+        url += '?max_evalue=' + maxEvalue;
+
+    queryAPI(url)
         .then(response => {
             network.data = response.data;
             network.update();
         });
 }
 
+// Targets of set members, fetched in batches (members following the selected one)
+const targets = {
+    batchSize: 20,
+    members: [],
+    entries: {},
+    get: function (accession) {
+        if (!this.entries.hasOwnProperty(accession)) {
+            const i = Math.max(this.members.indexOf(accession), 0);
+            const batch = [accession].concat(
+                this.members
+                    .slice(i + 1)
+                    .filter(acc => !this.entries.hasOwnProperty(acc))
+                    .slice(0, this.batchSize - 1)
+            );
+
+            const promise = queryAPI('/api/entries/targets/?encoded=1&accessions=' + batch.join(','), accession);
+            batch.forEach(acc => {
+                this.entries[acc] = promise.then(entries => {
+                    if (entries && entries.hasOwnProperty(acc))
+                        return entries[acc];
+                    // Not found: reported by the single-entry endpoint
+                    delete this.entries[acc];
+                    return queryAPI('/api/entry/' + acc + '/targets/?encoded=1', acc);
+                });
+            });
+        }
+
+        return this.entries[accession];
+    }
+};
+
 function getTargets(accession) {
-    queryAPI('/api/entry/' + accession + '/targets/', accession)
+    targets.get(accession)
         .then(entry => {
+            if (!entry) return;
             const div = document.getElementById('hits');
             const domainColors = [
                 // current set
@@ -478,23 +552,24 @@ function getTargets(accession) {
                 svgLabels += '<text x="'+ (svgLeftPadding - 5) +'" y="'+ (20*i + 25) +'">'+ nvl(target.name, target.accession) +'</text>';
                 svgDomains += '<line x1="0" y1="'+(5+20*(i+1))+'" x2="'+svgWidth+'" y2="'+(5+20*(i+1))+'" stroke="#d7d7d7" />';
 
-                target.domains.forEach(domain => {
+                // [start, end, i-Evalue, query row, target row], rows encoded (?encoded=1)
+                target.domains.forEach(([start, end, ievalue, queryOps, targetOps]) => {
                     html += '<div class="row">'
                         + '<div class="col s2 valign-wrapper">'
-                        + '<div class="statistic"><span class="label">i-Evalue</span>'+ domain.ievalue.toExponential() +' </div>'
+                        + '<div class="statistic"><span class="label">i-Evalue</span>'+ (ievalue !== null ? ievalue.toExponential() : 'N/A') +' </div>'
                         + '</div>'
                         + '<div class="col s10 valign-wrapper">'
-                        + '<pre>'+ domain.query + '<br>' + domain.target + '</pre>'
+                        + '<pre>'+ decodeRow(queryOps, entry.sequence, start) + '<br>' + decodeRow(targetOps) + '</pre>'
                         + '</div>'
                         + '</div>';
 
-                    const color = colors[evalueScale(domain.ievalue)];
-                    const x = scale(domain.start-1);
-                    const w = scale(domain.end) - x;
+                    const color = colors[evalueScale(ievalue)];
+                    const x = scale(start-1);
+                    const w = scale(end) - x;
                     svgDomains += '<g class="domain" transform="translate('+x+','+ (20 * i) +')">' +
                         '<rect x="0" y="20" width="'+ w +'" height="10" fill="'+ color +'" />' +
-                        '<text x="0" y="18" text-anchor="end">'+ domain.start +'</text>' +
-                        '<text x="'+ w +'" y="18">'+ domain.end +'</text>' +
+                        '<text x="0" y="18" text-anchor="end">'+ start +'</text>' +
+                        '<text x="'+ w +'" y="18">'+ end +'</text>' +
                         '</g>';
                 });
 
@@ -529,14 +604,14 @@ function getTargets(accession) {
                 svg.setAttribute('height', 50);
 
                 let content = '<line x1="0" y1="25" x2="'+svgWidth+'" y2="25" stroke="#d7d7d7" />';
-                target.domains.forEach((domain, j) => {
-                    const color = colors[evalueScale(domain.ievalue)];
-                    const x = scale(domain.start-1);
-                    const w = scale(domain.end) - x;
+                target.domains.forEach(([start, end, ievalue]) => {
+                    const color = colors[evalueScale(ievalue)];
+                    const x = scale(start-1);
+                    const w = scale(end) - x;
                     content += '<g class="domain" transform="translate('+x+')">' +
                         '<rect x="0" y="20" width="'+ w +'" height="10" fill="'+ color +'" />' +
-                        '<text x="0" y="18" text-anchor="end">'+ domain.start +'</text>' +
-                        '<text x="'+ w +'" y="18">'+ domain.end +'</text>' +
+                        '<text x="0" y="18" text-anchor="end">'+ start +'</text>' +
+                        '<text x="'+ w +'" y="18">'+ end +'</text>' +
                         '</g>';
                 });
 
@@ -554,6 +629,8 @@ function getTargets(accession) {
 function getSetMembers(accession) {
     queryAPI('/api/set/' + accession + '/', accession)
         .then(members => {
+            targets.members = members.map(member => member.accession);
+
             let html = '';
             members.forEach((member, i) => {
                 html += '<a href="#!" data-accession="'+ member.accession +'" class="collection-item '+ (i ? '' : 'active') +'">';
@@ -590,6 +667,33 @@ function nvl(value, fallback) {
     return value || fallback;
 }
 
+// Aligned row from its run-length encoding (see interprosets/alignment.py):
+// residues copied from `reference` (">", "<" in lower case), literal residues, and gaps
+function decodeRow(ops, reference, start) {
+    let row = '';
+    let pos = (start || 1) - 1;
+    const re = /(\d*)([^A-Za-z0-9])|([A-Za-z]+)/g;
+    let m;
+    while ((m = re.exec(ops)) !== null) {
+        if (m[3] !== undefined) {
+            row += m[3];
+            pos += m[3].length;
+            continue;
+        }
+
+        const count = m[1] ? parseInt(m[1], 10) : 1;
+        if (reference && m[2] === '>') {
+            row += reference.substr(pos, count);
+            pos += count;
+        } else if (reference && m[2] === '<') {
+            row += reference.substr(pos, count).toLowerCase();
+            pos += count;
+        } else
+            row += m[2].repeat(count);
+    }
+    return row;
+}
+
 
 const heatmap = {
     g: null,
@@ -736,7 +840,7 @@ window.addEventListener('load', () => {
                 val = null;
 
             network.threshold = val;
-            network.update();
+            getRelationships(accession, val);
         });
     })();
 
@@ -760,7 +864,7 @@ window.addEventListener('load', () => {
         if (tab.id === 'hmmscan')
             getSetMembers(accession);
         else if (tab.id === 'network')
-            getRelationships(accession);
+            getRelationships(accession, network.threshold);
         else if (tab.id === 'heatmap')
             getSimilarities(accession);
         else
@@ -1,11 +1,87 @@
 window.addEventListener('load', () => {
-    document.getElementById('search').addEventListener('keyup', e => {
+    const input = document.getElementById('search');
+    const results = document.createElement('div');
+    results.id = 'search-results';
+    results.className = 'collection';
+    input.parentNode.insertBefore(results, input.nextSibling);
+
+    const getURL = item => {
+        if (item.type === 'set')
+            return '/set/' + encodeURIComponent(item.accession) + '/';
+        else if (item.set)
+            return '/set/' + encodeURIComponent(item.set) + '/';
+        return null;
+    };
+
+    // Values come from member databases: set as text, never as HTML
+    const createItem = item => {
+        const url = getURL(item);
+        const elem = document.createElement(url ? 'a' : 'div');
+        if (url)
+            elem.href = url;
+        elem.className = 'collection-item';
+        elem.appendChild(document.createTextNode(item.accession));
+
+        if (item.name) {
+            const name = document.createElement('span');
+            name.className = 'grey-text';
+            name.textContent = ' ' + item.name;
+            elem.appendChild(name);
+        }
+
+        const badge = document.createElement('span');
+        badge.className = 'badge';
+        badge.textContent = item.type === 'set' ? 'set' : item.set || 'no set';
+        elem.appendChild(badge);
+        return elem;
+    };
+
+    let timeout = null;
+    let last = null;
+    const suggest = () => {
+        const query = input.value.trim();
+        if (query === last)
+            return;
+        last = query;
+
+        if (!query) {
+            results.innerHTML = '';
+            return;
+        }
+
+        fetch('/api/search/?q=' + encodeURIComponent(query))
+            .then(response => response.json())
+            .then(items => {
+                if (query !== last)
+                    return;  // superseded by another query
+
+                const fragment = document.createDocumentFragment();
+                items.forEach(item => fragment.appendChild(createItem(item)));
+                results.innerHTML = '';
+                results.appendChild(fragment);
+            });
+    };
+
+    input.addEventListener('keyup', e => {
         if (e.which === 13) {
             const form = document.createElement('form');
             form.action = '/set/' + e.target.value.trim();
             form.method = 'get';
             document.body.appendChild(form);
             form.submit();
+        } else {
+            clearTimeout(timeout);
+            timeout = setTimeout(suggest, 150);
         }
     });
+
+    input.addEventListener('blur', () => {
+        // Delayed, so a click on a result is not lost
+        setTimeout(() => {
+            results.innerHTML = '';
+            last = null;
+        }, 200);
+    });
+
+    input.addEventListener('focus', suggest);
 });
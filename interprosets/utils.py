@@ -4,41 +4,244 @@
 import gzip
 import os
 import re
+import shutil
 import sys
+import threading
+import time
+from collections import deque
 from datetime import datetime
+from functools import partial
+from itertools import groupby
 from multiprocessing.dummy import Pool
 from subprocess import Popen, PIPE, DEVNULL
+from tempfile import mkstemp, TemporaryFile
 from urllib.request import urlopen
 
 import cx_Oracle
 
+from . import alignment, graph, metrics
+
 INSERT_SIZE = 1000
 
+# Executable of each external tool (see `set_tools()`)
+TOOLS = {
+    name: name for name in (
+        "compass_db1Xdb2",
+        "compass_vs_db",
+        "hmmconvert",
+        "hmmemit",
+        "hmmpress",
+        "hmmscan",
+        "mk_compass_db"
+    )
+}
+
+# Attempts after a failed run of a per-entry tool (search, emit, convert)
+TOOL_RETRIES = 1
+
+# Lines of standard error kept when a tool fails
+STDERR_LINES = 20
+
+# Method IDs reserved per load (see `prepare_tables()`)
+ID_BLOCK = 1000000
+
+# Tables reloaded by exchanging the partition of a database with a staging
+# table, and their keys/indexes: (name, constraint type or None, columns).
+# Indexes are local, so the partition key (DBCODE) ends unique keys.
+_PARTITIONED = (
+    ("METHOD_SET", (
+        ("PK_METHOD_SET", "PRIMARY KEY", "METHOD_AC, DBCODE"),
+        ("UK_METHOD_SET$ID", "UNIQUE", "METHOD_ID, DBCODE"),
+        ("I_METHOD_SET$SET", None, "SET_AC")
+    )),
+    ("METHOD_SCAN", (
+        ("PK_METHOD_SCAN", "PRIMARY KEY", "QUERY_ID, TARGET_ID, DBCODE"),
+        ("I_METHOD_SCAN$EVALUE", None, "QUERY_ID, EVALUE, TARGET_ID")
+    )),
+    ("METHOD_SCAN_PAIR", (
+        ("PK_METHOD_SCAN_PAIR", "PRIMARY KEY",
+         "METHOD_ID1, METHOD_ID2, DBCODE"),
+        ("I_METHOD_SCAN_PAIR$EVALUE1", None,
+         "METHOD_ID1, EVALUE, METHOD_ID2"),
+        ("I_METHOD_SCAN_PAIR$EVALUE2", None,
+         "METHOD_ID2, EVALUE, METHOD_ID1")
+    )),
+    ("METHOD_SET_GRAPH", (
+        ("PK_METHOD_SET_GRAPH", "PRIMARY KEY", "SET_AC, DBCODE"),
+    ))
+)
+
+# Foreign keys of partitioned tables: (name, columns, referenced columns).
+# Staging tables have them too, as a partition can only be exchanged with
+# a table with the same constraints.
+_FOREIGN_KEYS = {
+    "METHOD_SET": (
+        ("FK_METHOD_SET$D", "DBCODE", "INTERPRO.CV_DATABASE (DBCODE)"),
+    )
+}
+
+# Rows waiting to be inserted, in bytes (estimated, see `insert_results()`)
+BUFFER_SIZE = 64 * 1024 ** 2
+
+# Bytes per row, besides sequences and alignments
+_ROW_OVERHEAD = 200
+
+# A query is split over HMM database shards if its estimated cost exceeds
+# this fraction of the average work per thread (see `run_hmmscan()`)
+SPLIT_THRESHOLD = 0.5
+
+
+class ToolError(RuntimeError):
+    def __init__(self, result):
+        self.result = result
+        super().__init__(
+            "{} exited with status {} (attempt {}): {}\n{}".format(
+                result["tool"], result["returncode"], result["attempt"],
+                " ".join(result["args"]), result["stderr"]
+            )
+        )
+
+
+def batch_compass(jobs, processes=1, chunk_size=1, timings_file=None):
+    # Longest first (chunks then group queries of similar lengths)
+    timings = read_timings(timings_file) if timings_file else {}
+    costs = estimate_costs(jobs, timings)
+    jobs = sorted(jobs, key=lambda job: costs[job[0]], reverse=True)
+
+    timings = {}
+    if chunk_size > 1:
+        # Several queries per COMPASS process
+        chunks = []
+        for i in range(0, len(jobs), chunk_size):
+            chunks.append(jobs[i:i+chunk_size])
+
+        for results in _batch(_compass_chunk, chunks, processes, timings):
+            for res in results:
+                yield res
+    else:
+        for res in _batch(_compass, jobs, processes, timings):
+            yield res
 
-def batch_compass(jobs, processes=1):
-    return _batch(_compass, jobs, processes)
+    if timings_file:
+        write_timings(timings_file, timings)
 
 
 def batch_hmmconvert(jobs, processes=1):
     return _batch(_hmmconvert, jobs, processes)
 
 
-def batch_hmmscan(jobs, processes=1):
-    return _batch(_hmmscan, jobs, processes)
+def batch_hmmscan(jobs, processes=1, options=None, timings=None):
+    return _batch(partial(_hmmscan, options=options), jobs, processes,
+                  timings)
+
+
+def build_set_graphs(con, dbcode):
+    # Relationships and similarity of each set, from hits within the set
+    cur = con.cursor()
+    cur.execute(
+        """
+        SELECT S.SET_AC, S.METHOD_ID, S.METHOD_AC, M.NAME
+        FROM INTERPRO.{} S
+        LEFT OUTER JOIN INTERPRO.METHOD M
+          ON S.METHOD_AC = M.METHOD_AC
+        WHERE S.SET_AC IS NOT NULL
+        """.format(_staging("METHOD_SET", dbcode))
+    )
+
+    methods = {}
+    members = {}
+    for set_ac, method_id, method_ac, name in cur:
+        methods[method_id] = (method_ac, name)
+        try:
+            members[set_ac].append((method_ac, name))
+        except KeyError:
+            members[set_ac] = [(method_ac, name)]
+
+    # Hits are stored per direction or per pair (see `_fold_pairs()`)
+    cur.execute(
+        """
+        SELECT Q.SET_AC, SC.QUERY_ID, SC.TARGET_ID, SC.EVALUE
+        FROM (
+          SELECT QUERY_ID, TARGET_ID, EVALUE
+          FROM INTERPRO.{1}
+          UNION ALL
+          SELECT METHOD_ID1, METHOD_ID2, EVALUE
+          FROM INTERPRO.{2}
+        ) SC
+        INNER JOIN INTERPRO.{0} Q
+          ON SC.QUERY_ID = Q.METHOD_ID
+        INNER JOIN INTERPRO.{0} T
+          ON SC.TARGET_ID = T.METHOD_ID
+        WHERE Q.SET_AC = T.SET_AC
+        ORDER BY Q.SET_AC
+        """.format(_staging("METHOD_SET", dbcode),
+                   _staging("METHOD_SCAN", dbcode),
+                   _staging("METHOD_SCAN_PAIR", dbcode))
+    )
+
+    cur2 = con.cursor()
+    cur2.setinputsizes(None, None, cx_Oracle.CLOB, cx_Oracle.CLOB)
+    sql = """
+        INSERT INTO INTERPRO.{}
+        VALUES (:1, :2, :3, :4)
+    """.format(_staging("METHOD_SET_GRAPH", dbcode))
+
+    def _build(set_ac, hits):
+        rel = graph.relationships(set_ac, hits)
+        sim = graph.similarity(set_ac, members.pop(set_ac), hits)
+        return (set_ac, dbcode, graph.dumps(rel) if rel else None,
+                graph.dumps(sim))
+
+    data = []
+    size = 0
+    for set_ac, rows in groupby(cur, key=lambda row: row[0]):
+        hits = []
+        for _, query_id, target_id, evalue in rows:
+            hits.append(methods[query_id] + methods[target_id] + (evalue,))
+
+        row = _build(set_ac, hits)
+        data.append(row)
+        size += len(row[2] or "") + len(row[3])
+        if len(data) == INSERT_SIZE or size >= BUFFER_SIZE:
+            cur2.executemany(sql, data)
+            data = []
+            size = 0
+
+    # Sets without hits within the set
+    for set_ac in list(members):
+        data.append(_build(set_ac, []))
+        if len(data) == INSERT_SIZE:
+            cur2.executemany(sql, data)
+            data = []
+
+    if data:
+        cur2.executemany(sql, data)
+
+    con.commit()
+    cur2.close()
+    cur.close()
 
 
 def compass(fasta_file, profile_db):
     out_file = fasta_file[:-2] + "out"
     cmd = [
-        "compass_vs_db",
         "-i", fasta_file,
         "-d", profile_db,
         "-o", out_file
     ]
-    _exec_shell(" ".join(cmd)).wait()
+    run_tool("compass_vs_db", cmd, retries=TOOL_RETRIES)
     return out_file
 
 
+def compass_db(query_db, profile_db, out_file):
+    cmd = [
+        "-i", query_db,
+        "-j", profile_db,
+        "-o", out_file
+    ]
+    run_tool("compass_db1Xdb2", cmd, retries=TOOL_RETRIES)
+
+
 def download(url, dst):
     with urlopen(url) as res, open(dst, "wb") as fh:
         while True:
@@ -49,26 +252,101 @@ def download(url, dst):
                 break
 
 
+def estimate_costs(jobs, timings=None):
+    """
+    Relative cost of search jobs (accession, FASTA file, database).
+    Search time grows with the length of the query (the model length
+    for consensus sequences), hence with the size of its FASTA file.
+    Durations from a previous run (`timings`) are used when available,
+    and calibrate the estimates of other queries.
+    """
+    sizes = {job[0]: os.path.getsize(job[1]) for job in jobs}
+
+    rate = 1
+    if timings:
+        ratios = sorted(timings[acc] / size
+                        for acc, size in sizes.items()
+                        if acc in timings and size)
+        if ratios:
+            rate = ratios[len(ratios) // 2]
+    else:
+        timings = {}
+
+    costs = {}
+    for acc, size in sizes.items():
+        try:
+            costs[acc] = timings[acc]
+        except KeyError:
+            costs[acc] = size * rate
+
+    return costs
+
+
+def exchange_partitions(con, dbcode):
+    # Index the staging tables, then swap them with the partitions
+    # of `dbcode`: previous rows are replaced at once, without deleting
+    cur = con.cursor()
+    for table, keys in _PARTITIONED:
+        _add_keys(cur, _staging(table, dbcode), keys,
+                  suffix=_staging("", dbcode))
+        _add_foreign_keys(cur, _staging(table, dbcode),
+                          _FOREIGN_KEYS.get(table, ()),
+                          suffix=_staging("", dbcode))
+
+    # Each exchange is DDL, committed on its own: until all tables are
+    # exchanged, the database is flagged as loading (see `server`)
+    cur.execute(
+        """
+        MERGE INTO INTERPRO.METHOD_SET_VERSION V
+        USING (SELECT :1 DBCODE FROM DUAL) N
+        ON (V.DBCODE = N.DBCODE)
+        WHEN MATCHED THEN
+          UPDATE SET V.LOADING = 1
+        WHEN NOT MATCHED THEN
+          INSERT VALUES (N.DBCODE, 0, SYSDATE, 1)
+        """,
+        (dbcode,)
+    )
+    con.commit()
+
+    for table, keys in _PARTITIONED:
+        cur.execute(
+            """
+            ALTER TABLE INTERPRO.{}
+            EXCHANGE PARTITION {} WITH TABLE INTERPRO.{}
+            INCLUDING INDEXES WITHOUT VALIDATION
+            """.format(table, _partition(dbcode), _staging(table, dbcode))
+        )
+
+    cur.execute(
+        """
+        UPDATE INTERPRO.METHOD_SET_VERSION
+        SET VERSION = VERSION + 1, UPDATED = SYSDATE, LOADING = 0
+        WHERE DBCODE = :1
+        """,
+        (dbcode,)
+    )
+    con.commit()
+
+    # Staging tables now hold previous rows
+    _drop_staging_tables(cur, dbcode)
+    cur.close()
+
+
 def extract(src, dst):
-    with open(dst, "wt") as fh:
-        for line in iterlines(src):
-            fh.write(line)
+    fn = gzip.open if src.lower().endswith(".gz") else open
+    with fn(src, "rb") as fh1, open(dst, "wb") as fh2:
+        shutil.copyfileobj(fh1, fh2, 1 << 20)
 
 
 def hmmconvert(hmm_file):
-    cmd = "hmmconvert " + hmm_file
-    p = _exec_shell(cmd, PIPE, DEVNULL)
-    hmm = ""
-    for line in p.stdout:
-        hmm += line.decode("utf-8")
-
-    out, err = p.communicate()
-    return hmm
+    res = run_tool("hmmconvert", [hmm_file], PIPE, retries=TOOL_RETRIES)
+    return res["stdout"].decode("utf-8")
 
 
 def hmmemit(hmm_file, fasta_file):
-    cmd = ["hmmemit", "-c", "-o", fasta_file, hmm_file]
-    return _exec_shell(" ".join(cmd)).wait() == 0
+    cmd = ["-c", "-o", fasta_file, hmm_file]
+    run_tool("hmmemit", cmd, retries=TOOL_RETRIES)
 
 
 def hmmpress(hmm_db):
@@ -80,97 +358,428 @@ def hmmpress(hmm_db):
         except FileNotFoundError:
             pass
 
-    cmd = "hmmpress " + hmm_db
-    p = _exec_shell(cmd, PIPE, PIPE)
-    out, err = p.communicate()
+    run_tool("hmmpress", [hmm_db])
 
-    if p.returncode != 0:
-        raise RuntimeError("{}\n------\n{}".format(out, err))
 
+def hmmscan(fasta_file, hmm_db, options=None, prefix=None):
+    if prefix is None:
+        prefix = fasta_file[:-3]
 
-def hmmscan(fasta_file, hmm_db):
-    tab_file = fasta_file[:-2] + 'tab'
-    out_file = fasta_file[:-2] + 'out'
+    tab_file = prefix + '.tab'
+    out_file = prefix + '.out'
 
-    cmd = ["hmmscan", "--domtblout", tab_file, hmm_db, fasta_file]
+    cmd = ["--domtblout", tab_file]
+    if options:
+        # Reporting thresholds, see `hmmscan_options()`
+        cmd += options
+    cmd += [hmm_db, fasta_file]
 
-    with open(out_file, 'wt') as fh:
-        # (?) option for --cut_ga and -E
-        _exec_shell(" ".join(cmd), fh).wait()
+    # hmmscan ends its output with "[ok]" (a truncated file does not)
+    run_tool("hmmscan", cmd, out_file,
+             retries=TOOL_RETRIES,
+             check=lambda: _ends_with(out_file, b"[ok]\n"))
 
     return out_file, tab_file
 
 
-def init_tables(uri):
+def hmmscan_options(evalue=None, dom_evalue=None, cut_ga=False):
+    options = []
+    if cut_ga:
+        options.append("--cut_ga")
+    if evalue is not None:
+        options += ["-E", str(evalue)]
+    if dom_evalue is not None:
+        options += ["--domE", str(dom_evalue)]
+    return options
+
+
+def index_fasta(filepath, reo):
+    # Yields (match, offset, length) for records whose header matches `reo`
+    # (bytes pattern). `filepath` must be uncompressed (offsets are pread).
+    match = None
+    start = offset = 0
+    with open(filepath, "rb", buffering=1 << 20) as fh:
+        for line in fh:
+            if line[:1] == b">":
+                if match:
+                    yield match, start, offset - start
+
+                match = reo.match(line)
+                start = offset
+
+            offset += len(line)
+
+    if match:
+        yield match, start, offset - start
+
+
+def init_tables(uri, dbcodes):
+    # Tables are partitioned by database (one partition per code)
     con = cx_Oracle.connect(uri)
     cur = con.cursor()
 
-    try:
-        cur.execute("DROP TABLE INTERPRO.METHOD_SET")
-    except:
-        pass
+    for table in ("METHOD_SET", "METHOD_SET_CLUSTER", "METHOD_SET_GRAPH",
+                  "METHOD_SET_REPORT", "METHOD_SET_VERSION"):
+        try:
+            cur.execute("DROP TABLE INTERPRO.{}".format(table))
+        except:
+            pass
+
+    # METHOD_SCAN_STG: staging table of previous releases
+    for table in ("METHOD_SCAN", "METHOD_SCAN_STG", "METHOD_SCAN_PAIR"):
+        try:
+            cur.execute("DROP TABLE INTERPRO.{}".format(table))
+        except:
+            pass
 
     try:
-        cur.execute("DROP TABLE INTERPRO.METHOD_SCAN")
+        cur.execute("DROP SEQUENCE INTERPRO.METHOD_ID_SEQ")
     except:
         pass
 
+    cur.execute(
+        """
+        CREATE SEQUENCE INTERPRO.METHOD_ID_SEQ
+        START WITH 1 INCREMENT BY {}
+        """.format(ID_BLOCK)
+    )
+
+    partitions = ", ".join(
+        "PARTITION {} VALUES ('{}')".format(_partition(dbcode), dbcode)
+        for dbcode in dbcodes
+    )
+
     cur.execute(
         """
         CREATE TABLE INTERPRO.METHOD_SET
         (
             METHOD_AC VARCHAR2(25) NOT NULL,
+            METHOD_ID NUMBER(10) NOT NULL,
             DBCODE CHAR(1) NOT NULL,
             SET_AC VARCHAR2(25),
-            SEQUENCE CLOB NOT NULL,
-            CONSTRAINT PK_METHOD_SET PRIMARY KEY (METHOD_AC),
-            CONSTRAINT FK_METHOD_SET$D
-              FOREIGN KEY (DBCODE)
-              REFERENCES INTERPRO.CV_DATABASE (DBCODE)
+            SEQUENCE CLOB NOT NULL
         )
+        PARTITION BY LIST (DBCODE) ({})
+        """.format(partitions)
+    )
+
+    cur.execute(
         """
+        CREATE TABLE INTERPRO.METHOD_SCAN
+        (
+            QUERY_ID NUMBER(10) NOT NULL,
+            TARGET_ID NUMBER(10) NOT NULL,
+            DBCODE CHAR(1) NOT NULL,
+            EVALUE BINARY_DOUBLE NOT NULL,
+            EVALUE_STR VARCHAR2(10) NOT NULL,
+            DOMAINS CLOB NOT NULL
+        )
+        PARTITION BY LIST (DBCODE) ({})
+        """.format(partitions)
     )
 
     cur.execute(
         """
-        CREATE INDEX INTERPRO.I_METHOD_SET$DBCODE 
-        ON METHOD_SET(DBCODE)
+        CREATE TABLE INTERPRO.METHOD_SCAN_PAIR
+        (
+            METHOD_ID1 NUMBER(10) NOT NULL,
+            METHOD_ID2 NUMBER(10) NOT NULL,
+            DBCODE CHAR(1) NOT NULL,
+            EVALUE BINARY_DOUBLE NOT NULL,
+            EVALUE_STR VARCHAR2(10) NOT NULL,
+            EVALUE1 BINARY_DOUBLE,
+            DOMAINS1 CLOB,
+            EVALUE2 BINARY_DOUBLE,
+            DOMAINS2 CLOB
+        )
+        PARTITION BY LIST (DBCODE) ({})
+        """.format(partitions)
+    )
+
+    # Documents returned by the API (see `build_set_graphs()`)
+    cur.execute(
         """
+        CREATE TABLE INTERPRO.METHOD_SET_GRAPH
+        (
+            SET_AC VARCHAR2(25) NOT NULL,
+            DBCODE CHAR(1) NOT NULL,
+            RELATIONSHIPS CLOB,
+            SIMILARITY CLOB NOT NULL
+        )
+        PARTITION BY LIST (DBCODE) ({})
+        """.format(partitions)
     )
 
+    for table, keys in _PARTITIONED:
+        _add_keys(cur, table, keys, local=True)
+        _add_foreign_keys(cur, table, _FOREIGN_KEYS.get(table, ()))
+
+    # Sets inferred from hits (see `cluster`), not replaced by loads
     cur.execute(
         """
-        CREATE INDEX INTERPRO.I_METHOD_SET$SET 
-        ON METHOD_SET(SET_AC)
+        CREATE TABLE INTERPRO.METHOD_SET_CLUSTER
+        (
+            METHOD_AC VARCHAR2(25) NOT NULL,
+            DBCODE CHAR(1) NOT NULL,
+            ALGORITHM VARCHAR2(10) NOT NULL,
+            EVALUE BINARY_DOUBLE NOT NULL,
+            CLUSTER_ID NUMBER(10) NOT NULL
+        )
+        PARTITION BY LIST (DBCODE) ({})
+        """.format(partitions)
+    )
+    _add_keys(cur, "METHOD_SET_CLUSTER", (
+        ("PK_METHOD_SET_CLUSTER", "PRIMARY KEY",
+         "DBCODE, ALGORITHM, EVALUE, METHOD_AC"),
+    ), local=True)
+
+    # Consistency of sets with hits (see `report`), not replaced by loads
+    cur.execute(
         """
+        CREATE TABLE INTERPRO.METHOD_SET_REPORT
+        (
+            METHOD_AC VARCHAR2(25) NOT NULL,
+            DBCODE CHAR(1) NOT NULL,
+            KIND VARCHAR2(10) NOT NULL,
+            RANK NUMBER(10) NOT NULL,
+            SCORE BINARY_DOUBLE NOT NULL,
+            SET_AC VARCHAR2(25),
+            HITS NUMBER(10) NOT NULL,
+            HITS_OTHER_SET NUMBER(10) NOT NULL,
+            HITS_WITHOUT_SET NUMBER(10) NOT NULL,
+            OWN_EVALUE BINARY_DOUBLE,
+            OTHER_SET_AC VARCHAR2(25) NOT NULL,
+            OTHER_EVALUE BINARY_DOUBLE NOT NULL
+        )
+        PARTITION BY LIST (DBCODE) ({})
+        """.format(partitions)
     )
+    _add_keys(cur, "METHOD_SET_REPORT", (
+        ("PK_METHOD_SET_REPORT", "PRIMARY KEY", "METHOD_AC, DBCODE"),
+        ("I_METHOD_SET_REPORT$RANK", None, "DBCODE, KIND, RANK")
+    ), local=True)
 
+    # Incremented for a database when it is loaded
     cur.execute(
         """
-        CREATE TABLE INTERPRO.METHOD_SCAN
+        CREATE TABLE INTERPRO.METHOD_SET_VERSION
         (
-            QUERY_AC VARCHAR2(25) NOT NULL,
-            TARGET_AC VARCHAR2(25) NOT NULL,
-            EVALUE BINARY_DOUBLE NOT NULL,
-            EVALUE_STR VARCHAR2(10) NOT NULL,
-            DOMAINS CLOB NOT NULL,
-            CONSTRAINT PK_METHOD_SCAN PRIMARY KEY (QUERY_AC, TARGET_AC)
+            DBCODE CHAR(1) NOT NULL,
+            VERSION NUMBER(10) NOT NULL,
+            UPDATED DATE NOT NULL,
+            LOADING NUMBER(1) DEFAULT 0 NOT NULL,
+            CONSTRAINT PK_METHOD_SET_VERSION PRIMARY KEY (DBCODE)
         )
         """
     )
 
+    cur.close()
+    con.close()
+
+
+def insert_results(con, dbcode, results, total, pairs=False,
+                   max_evalue=None, top_k=None, buffer_size=BUFFER_SIZE,
+                   first_id=1):
+    """
+    Insert rows of `results` ((accession, set accession, sequence, targets)
+    for each query). Rows are inserted by a dedicated thread, and wait in
+    a buffer of about `buffer_size` bytes: when it is full, results are
+    not consumed, and no more searches are started.
+
+    Hits are stored with the integer IDs of methods, assigned from
+    `first_id` as accessions are seen (as query or target).
+
+    Rows go to the staging tables of `dbcode` (see `prepare_tables()`).
+    """
+    writer = _RowWriter(con, buffer_size, {
+        "set": (
+            """
+            INSERT INTO INTERPRO.{}
+            VALUES (:1, :2, :3, :4, :5)
+            """.format(_staging("METHOD_SET", dbcode)),
+            None
+        ),
+        "scan": (
+            """
+            INSERT INTO INTERPRO.{}
+            VALUES (:1, :2, :3, :4, :5, :6)
+            """.format(_staging("METHOD_SCAN", dbcode)),
+            (None, None, None, cx_Oracle.NATIVE_FLOAT, None, None)
+        )
+    })
+    writer.start()
+
+    metrics.stage("load results")
+    cnt = 0
+    n_hits = 0
+    n_pruned = 0
+    data1 = []
+    data2 = []
+    size1 = 0
+    size2 = 0
+    ids = {}
+
+    def _id(accession):
+        try:
+            return ids[accession]
+        except KeyError:
+            ids[accession] = i = first_id + len(ids)
+            return i
+
+    logger("load results: {:>10} / {}".format(cnt, total))
+    try:
+        for acc, set_ac, sequence, targets in metrics.timed(results,
+                                                            "results"):
+            query_id = _id(acc)
+            data1.append((acc, query_id, dbcode, set_ac, sequence))
+            size1 += len(sequence) + _ROW_OVERHEAD
+
+            n_hits += len(targets)
+            if max_evalue is not None or top_k:
+                n = len(targets)
+                targets = prune_targets(targets, max_evalue, top_k)
+                n_pruned += n - len(targets)
+
+            if len(data1) == INSERT_SIZE:
+                writer.put("set", data1, size1)
+                data1 = []
+                size1 = 0
+
+            with metrics.timer("encode"):
+                for t in targets:
+                    domains = alignment.encode_domains(t["domains"], sequence)
+                    data2.append((query_id, _id(t["accession"]), dbcode,
+                                  t["evalue"], t["evaluestr"], domains))
+                    size2 += len(domains) + _ROW_OVERHEAD
+
+            if len(data2) >= INSERT_SIZE:
+                writer.put("scan", data2, size2)
+                data2 = []
+                size2 = 0
+
+            cnt += 1
+            if not cnt % 1000:
+                logger("load results: {:>10} / {}".format(cnt, total))
+                metrics.progress(cnt, total)
+
+        if data1:
+            writer.put("set", data1, size1)
+
+        if data2:
+            writer.put("scan", data2, size2)
+    except BaseException:
+        # Stop searches waiting for their results to be consumed
+        if hasattr(results, "close"):
+            results.close()
+        raise
+    finally:
+        # Wait for pending rows (raises if an insert failed)
+        writer.close()
+
+    logger("load results: {:>10} / {}".format(cnt, total))
+    logger("pruned hits: {} / {}".format(n_pruned, n_hits))
+    metrics.count("queries", cnt)
+    metrics.count("pruned", n_pruned)
+    con.commit()
+
+    if pairs:
+        metrics.stage("fold pairs")
+        cur = con.cursor()
+        _fold_pairs(cur, dbcode)
+        cur.close()
+
+
+def iter_compass_results(out_file, top_k=None):
+    # Hits are reported by increasing E-value, so we can stop after `top_k`
+    p = re.compile(r"Evalue\s*=\s*([\d.e\-+]+)")
+
+    n = 0
+    hit = None
+    with _open(out_file) as it:
+        for line in it:
+            c = line[0]
+            if c <= " ":
+                # Blank line, or line before the first block
+                continue
+            elif c == "S" and line.startswith("Subject="):
+                """
+                Format:
+                Subject= cd154/cd15468.fa
+                length=413	filtered_length=413	Neff=1.000
+                Smith-Waterman score = 254	Evalue = 3.36e-16
+
+                (the path after "Subject=" might be truncated)
+                """
+                if hit and hit[0]:
+                    yield _compass_hit(*hit)
+                    n += 1
+                    if n == top_k:
+                        return
+
+                next(it, None)
+                m = p.search(next(it, ""))
+                if m:
+                    # target ID, E-value, start, query/target segments
+                    hit = [None, m.group(1), None, [], []]
+                else:
+                    # Truncated header
+                    hit = None
+            elif c == "P" and line.startswith("Parameters:"):
+                # Footer: end of results
+                break
+            elif hit is not None:
+                """
+                First block:
+                gnl|CDD|271233   1      PSFIPGPT==TPKGCTRIPSFSLSDTHWCYTHNVILSGCQDHSKSNQYLSLGVIKTNSDG
+                CONSENSUS_1      1      PSFIPGPT==TPKGCTRIPSFSLSDTHWCYTHNVILSGCQDHSKSNQYLSLGVIKTNSDG
+                                        P++IP+ T      C+R PSF++S+  + YT+ V  ++CQDH +  +Y+++GVI+ ++ G
+                CONSENSUS_2      1      PNLIPADTGLLSGECVRQPSFAISSGIYAYTYLVRKGSCQDHRSLYRYFEVGVIRDDGLG
+                gnl|CDD|271230   1      PNLIPADTGLLSGECVRQPSFAISSGIYAYTYLVRKGSCQDHRSLYRYFEVGVIRDDGLG
+
+                (following blocks do not have the start position between the ID and the sequence)
+                """
+                next(it, None)
+                next(it, None)
+                next(it, None)
+                query = line.split()
+                target = next(it, "").split()
+
+                if len(target) != len(query):
+                    # Truncated or malformed block: discard the hit
+                    hit = None
+                elif hit[0]:
+                    hit[3].append(query[-1])
+                    hit[4].append(target[-1])
+                elif len(query) == 3:
+                    hit[0] = target[0]
+                    hit[2] = int(query[1])
+                    hit[3].append(query[2])
+                    hit[4].append(target[2])
+                else:
+                    hit = None
+
+    if hit and hit[0] and n != top_k:
+        yield _compass_hit(*hit)
 
-def iterlines(filepath):
-    if filepath.lower().endswith(".gz"):
-        fn = gzip.open
-    else:
-        fn = open
 
-    with fn(filepath, "rt") as fh:
+def iterlines(filepath):
+    with _open(filepath) as fh:
         for line in fh:
             yield line
 
 
+def load(uri, dbcode, results, total, **kwargs):
+    metrics.stage("prepare tables")
+    con = cx_Oracle.connect(uri)
+    first_id = prepare_tables(con, dbcode)
+    insert_results(con, dbcode, results, total, first_id=first_id, **kwargs)
+    metrics.stage("build set graphs")
+    build_set_graphs(con, dbcode)
+    metrics.stage("exchange partitions")
+    exchange_partitions(con, dbcode)
+    con.close()
+
+
 def logger(msg):
     sys.stderr.write(
         "{:%Y-%m-%d %H:%M:%S}: {}\n".format(datetime.now(), msg)
@@ -179,146 +788,85 @@ def logger(msg):
 
 
 def mk_compass_db(files_list, profile_db):
-    cmd = ["mk_compass_db", "-i", files_list, "-o", profile_db]
-    return _exec_shell(" ".join(cmd)).wait() == 0
-
+    cmd = ["-i", files_list, "-o", profile_db]
+    run_tool("mk_compass_db", cmd)
 
-def parse_compass_results(out_file):
-    # p1 = re.compile(r"length\s*=\s*(\d+)")
-    p2 = re.compile(r"Evalue\s*=\s*([\d.e\-]+)")
 
+def parse_compass_results(out_file, top_k=None):
     targets = {}
-    block = 0
-    query_id = None
-    query_seq = ""
-    target_id = None
-    target_seq = ""
-    length = None
-    evalue = None
-    evalue_str = None
-    pos_start = None
-
-    it = iterlines(out_file)
-    for line in it:
-        line = line.rstrip()
-        if line.startswith("Subject="):
-            """
-            Format:
-            Subject= cd154/cd15468.fa
-            length=413	filtered_length=413	Neff=1.000
-            Smith-Waterman score = 254	Evalue = 3.36e-16
+    for t in iter_compass_results(out_file, top_k):
+        # Keep the best hit if a target is reported more than once
+        if t["id"] not in targets:
+            targets[t["id"]] = t
 
-            (the path after "Subject=" might be truncated)
-            """
-            if target_id:
-                targets[target_id] = {
-                    "id": target_id,
-                    "evalue": evalue,
-                    "evaluestr": evalue_str,
-                    "length": length,
-                    "start": pos_start,
-                    "end": pos_start + len(query_seq.replace('=', '')) - 1,
-                    "sequences": {
-                        "query": query_seq,
-                        "target": target_seq
-                    }
-                }
-
-            query_id = None
-            query_seq = None
-            target_id = None
-            target_seq = None
-
-            line = next(it)
-            # length = int(p1.match(line).group(1))
-
-            line = next(it)
-            evalue_str = p2.search(line).group(1)
-            try:
-                evalue= float(evalue_str)
-            except ValueError:
-                evalue = 0
+    return list(targets.values())
 
-            block = 1
-        elif line.startswith("Parameters:"):
-            # Footer: end of results
-            break
-        elif not block:
-            continue
-        elif line:
-            """
-            First block:
-            gnl|CDD|271233   1      PSFIPGPT==TPKGCTRIPSFSLSDTHWCYTHNVILSGCQDHSKSNQYLSLGVIKTNSDG
-            CONSENSUS_1      1      PSFIPGPT==TPKGCTRIPSFSLSDTHWCYTHNVILSGCQDHSKSNQYLSLGVIKTNSDG
-                                    P++IP+ T      C+R PSF++S+  + YT+ V  ++CQDH +  +Y+++GVI+ ++ G
-            CONSENSUS_2      1      PNLIPADTGLLSGECVRQPSFAISSGIYAYTYLVRKGSCQDHRSLYRYFEVGVIRDDGLG
-            gnl|CDD|271230   1      PNLIPADTGLLSGECVRQPSFAISSGIYAYTYLVRKGSCQDHRSLYRYFEVGVIRDDGLG
-
-            (following blocks do not have the start position between the ID and the sequence)
-            """
-            query = line.split()
-            next(it)
-            next(it)
-            next(it)
-            target = next(it).split()
-
-            if block == 1:
-                query_id = query[0]
-                pos_start = int(query[1])
-                query_seq = query[2]
-                target_id = target[0]
-                target_seq = target[2]
-            else:
-                query_seq += query[1]
-                target_seq += target[1]
 
-            block += 1
+def split_compass_results(out_file, queries):
+    # `queries` maps query IDs (first sequence of the query alignment)
+    # to per-query output files. Hits ("Subject=" sections) are streamed
+    # to the file of the query found in their first alignment block.
+    handles = {}
+    try:
+        for out in set(queries.values()):
+            handles[out] = open(out, "wt")
 
-    targets[target_id] = {
-        "id": target_id,
-        "evalue": evalue,
-        "evaluestr": evalue_str,
-        "length": length,
-        "start": pos_start,
-        "end": pos_start + len(query_seq.replace('=', '')) - 1,
-        "sequences": {
-            "query": query_seq,
-            "target": target_seq
-        }
-    }
+        section = []
+        for line in iterlines(out_file):
+            if line.startswith(("Subject=", "Parameters:")):
+                _flush_compass_section(section, queries, handles)
+                section = [line] if line[0] == "S" else []
+            elif section:
+                section.append(line)
 
-    return list(targets.values())
+        _flush_compass_section(section, queries, handles)
+    finally:
+        for fh in handles.values():
+            fh.close()
 
 
-def parse_hmm(filepath, keep_hmm=True):
-    entries = {}
-    duplicates = set()
+def iter_hmm(filepath, keep_hmm=True):
+    # Yields one entry per model, so a library is never held in memory
     p_acc = re.compile(r"^ACC\s+(\w+)", re.MULTILINE)
     p_name = re.compile(r"^NAME\s+([^\n]+)$", re.MULTILINE)
     p_desc = re.compile(r"^DESC\s+([^\n]+)$", re.MULTILINE)
 
-    hmm = ""
+    lines = []
+    header = None
     for line in iterlines(filepath):
-        hmm += line
+        lines.append(line)
+
+        if header is None and line[:4] == "HMM ":
+            # Fields of interest are before the model itself
+            header = "".join(lines)
+        elif line[:2] == "//":
+            if header is None:
+                header = "".join(lines)
+
+            m1 = p_acc.search(header)
+            m2 = p_name.search(header)
+            m3 = p_desc.search(header)
+
+            yield {
+                "accession": m1.group(1) if m1 else m2.group(1),
+                "name": m2.group(1).rstrip() if m2 else None,
+                "description": m3.group(1).rstrip() if m3 else None,
+                "hmm": "".join(lines) if keep_hmm else None
+            }
 
-        if line[:2] == "//":
-            m1 = p_acc.search(hmm)
-            m2 = p_name.search(hmm)
-            m3 = p_desc.search(hmm)
+            lines = []
+            header = None
 
-            acc = m1.group(1) if m1 else m2.group(1)
 
-            if acc in entries:
-                duplicates.add(acc)
-            else:
-                entries[acc] = {
-                    "accession": acc,
-                    "name": m2.group(1).rstrip() if m2 else None,
-                    "description": m3.group(1).rstrip() if m3 else None,
-                    "hmm": hmm if keep_hmm else None
-                }
-
-            hmm = ""
+def parse_hmm(filepath, keep_hmm=True):
+    entries = {}
+    duplicates = set()
+    for e in iter_hmm(filepath, keep_hmm):
+        acc = e["accession"]
+        if acc in entries:
+            duplicates.add(acc)
+        else:
+            entries[acc] = e
 
     if duplicates:
         logger("WARNING: {} duplicated entries".format(len(duplicates)))
@@ -397,6 +945,16 @@ def parse_hmmscan_results(out_file, tab_file):
     return list(targets.values())
 
 
+def prune_targets(targets, max_evalue=None, top_k=None):
+    if max_evalue is not None:
+        targets = [t for t in targets if t["evalue"] <= max_evalue]
+
+    if top_k and len(targets) > top_k:
+        targets = sorted(targets, key=lambda t: t["evalue"])[:top_k]
+
+    return targets
+
+
 def read_fasta(filepath, reo=None):
     it = iterlines(filepath)
     line = next(it)
@@ -412,24 +970,481 @@ def read_fasta(filepath, reo=None):
     return seq, m
 
 
-def _batch(func, jobs, processes):
+def read_timings(filepath):
+    timings = {}
+    try:
+        for line in iterlines(filepath):
+            acc, seconds = line.rstrip().split("\t")
+            timings[acc] = float(seconds)
+    except FileNotFoundError:
+        pass
+
+    return timings
+
+
+def run_hmmscan(jobs, processes=1, options=None, shards=1,
+                timings_file=None):
+    """
+    Search queries longest first. With `shards` > 1, queries expected
+    to take longer than SPLIT_THRESHOLD x the average work per thread
+    are searched against `shards` parts of the HMM database in parallel.
+    Duration of searches are read from/written to `timings_file`.
+    """
+    timings = read_timings(timings_file) if timings_file else {}
+    costs = estimate_costs(jobs, timings)
+
+    split = set()
+    if shards > 1 and processes > 1:
+        limit = sum(costs.values()) / processes * SPLIT_THRESHOLD
+        split = {acc for acc, cost in costs.items() if cost > limit}
+
+    subjobs = []
+    if split:
+        logger("split {} queries over {} shards".format(len(split), shards))
+        shard_dbs, n_models = split_hmm_db(jobs[0][2], shards)
+        for acc, fa_file, hmm_db in jobs:
+            if acc in split:
+                for i, shard_db in enumerate(shard_dbs):
+                    subjobs.append((costs[acc] / shards, (
+                        acc, fa_file, shard_db,
+                        "{}.{}".format(fa_file[:-3], i), n_models
+                    )))
+            else:
+                subjobs.append((costs[acc], (acc, fa_file, hmm_db)))
+    else:
+        subjobs = [(costs[job[0]], job) for job in jobs]
+
+    subjobs.sort(key=lambda x: x[0], reverse=True)
+    jobs = [job for cost, job in subjobs]
+    subjobs = None
+
+    timings = {}
+    parts = {}
+    for acc, fa_file, out_file, tab_file in batch_hmmscan(jobs, processes,
+                                                          options, timings):
+        with metrics.timer("parse"):
+            if acc in split:
+                parts.setdefault(acc, []).append((out_file, tab_file))
+                if len(parts[acc]) < shards:
+                    continue
+
+                hits = _merge_hmmscan_results(parts.pop(acc))
+            else:
+                hits = parse_hmmscan_results(out_file, tab_file)
+
+            targets = []
+            for t in hits:
+                if acc == t["accession"]:
+                    continue
+
+                domains = []
+                for dom in t["domains"]:
+                    domains.append({
+                        "query": dom["sequences"]["query"],
+                        "target": dom["sequences"]["target"],
+                        "ievalue": dom["ievalue"],
+                        "start": dom["coordinates"]["ali"]["start"],
+                        "end": dom["coordinates"]["ali"]["end"],
+                    })
+
+                targets.append({
+                    "accession": t["accession"],
+                    "evalue": t["evalue"],
+                    "evaluestr": t["evaluestr"],
+                    "domains": domains
+                })
+
+        sequence, _ = read_fasta(fa_file)
+        yield acc, sequence, targets
+
+    if timings_file:
+        write_timings(timings_file, timings)
+
+
+def run_tool(name, args, stdout=None, retries=0, check=None):
+    """
+    Run a tool (without shell) until it succeeds, at most `retries` + 1
+    times. `stdout` is None (discarded), PIPE (returned in "stdout"),
+    or the path of a file. If given, `check` is called after a zero exit
+    status, and must return False if outputs are incomplete.
+    Raises ToolError if all attempts failed.
+    """
+    for attempt in range(1, retries + 2):
+        res = _exec_tool(name, args, stdout, attempt)
+        if res["returncode"] == 0 and check is not None and not check():
+            res["returncode"] = None
+            res["stderr"] += "\nincomplete output"
+
+        metrics.record("tool", **{k: v for k, v in res.items()
+                                  if k != "stdout"})
+        if res["returncode"] == 0:
+            return res
+
+        metrics.count("tool_failures")
+        if attempt <= retries:
+            logger("{} failed (status {}), retrying: {}".format(
+                name, res["returncode"], " ".join(args)
+            ))
+
+    raise ToolError(res)
+
+
+def set_tools(path=None, **executables):
+    """
+    Run the external tools found in `path` (e.g. the stand-ins of
+    `benchmarks.tools`) instead of those in PATH.
+    Keyword arguments set the executable of individual tools.
+    """
+    if path:
+        for name in TOOLS:
+            TOOLS[name] = os.path.join(path, name)
+
+    for name, executable in executables.items():
+        if name not in TOOLS:
+            raise ValueError("unknown tool: {}".format(name))
+        TOOLS[name] = executable
+
+
+def split_fasta(filepath, records, processes=1, files_list=None):
+    # records: (dst, offset, length), offsets from `index_fasta`
+    records = list(records)
+
+    for _dir in {os.path.dirname(dst) for dst, _, _ in records}:
+        os.makedirs(_dir, exist_ok=True)
+
+    fd = os.open(filepath, os.O_RDONLY)
+
+    def _write(record):
+        dst, offset, length = record
+        with open(dst, "wb") as fh:
+            fh.write(os.pread(fd, length, offset))
+
+    try:
+        for _ in _batch(_write, records, processes):
+            pass
+    finally:
+        os.close(fd)
+
+    if files_list:
+        # Input of mk_compass_db, generated from the index
+        with open(files_list, "wt") as fh:
+            for dst, _, _ in records:
+                fh.write("{}\n".format(dst))
+
+
+def split_hmm_db(hmm_db, n_shards):
+    # Distribute models over `n_shards` pressed databases
+    shard_dbs = ["{}.shard{}".format(hmm_db, i) for i in range(n_shards)]
+    handles = [open(shard_db, "wt") for shard_db in shard_dbs]
+    n_models = 0
+    try:
+        hmm = []
+        for line in iterlines(hmm_db):
+            hmm.append(line)
+            if line[:2] == "//":
+                handles[n_models % n_shards].write("".join(hmm))
+                hmm = []
+                n_models += 1
+    finally:
+        for fh in handles:
+            fh.close()
+
+    for shard_db in shard_dbs:
+        hmmpress(shard_db)
+
+    return shard_dbs, n_models
+
+
+def write_timings(filepath, timings):
+    with open(filepath, "wt") as fh:
+        for acc in sorted(timings):
+            fh.write("{}\t{:.3f}\n".format(acc, timings[acc]))
+
+
+def _add_keys(cur, table, keys, suffix="", local=False):
+    for name, constraint, columns in keys:
+        if constraint:
+            cur.execute(
+                """
+                ALTER TABLE INTERPRO.{} ADD CONSTRAINT {} {} ({})
+                {}
+                """.format(table, name + suffix, constraint, columns,
+                           "USING INDEX LOCAL" if local else "")
+            )
+        else:
+            cur.execute(
+                """
+                CREATE INDEX INTERPRO.{} ON INTERPRO.{}({}) {}
+                """.format(name + suffix, table, columns,
+                           "LOCAL" if local else "")
+            )
+
+
+def _add_foreign_keys(cur, table, keys, suffix=""):
+    for name, columns, references in keys:
+        cur.execute(
+            """
+            ALTER TABLE INTERPRO.{} ADD CONSTRAINT {}
+            FOREIGN KEY ({}) REFERENCES {}
+            """.format(table, name + suffix, columns, references)
+        )
+
+
+def _batch(func, jobs, processes, timings=None):
+    # `timings`: if a dict, receives the duration of jobs, by accession,
+    # and the utilisation of workers is reported
+    lock = threading.Lock()
+    spans = []
+
+    # Jobs started but whose results are not consumed yet: when the
+    # consumer lags behind (e.g. inserts), workers stop taking new jobs
+    slots = threading.Semaphore(processes * 2)
+    stopped = threading.Event()
+
+    def _feed():
+        for job in jobs:
+            while not slots.acquire(timeout=1):
+                if stopped.is_set():
+                    return
+
+            if stopped.is_set():
+                return
+
+            yield job
+
+    def _func(args):
+        t1 = time.perf_counter()
+        res = func(args)
+        t2 = time.perf_counter()
+        spans.append((t1, t2))
+
+        if timings is not None:
+            # A job is either one query, or a chunk of queries
+            if isinstance(args, list):
+                keys = [job[0] for job in args]
+            else:
+                keys = [args[0]]
+
+            with lock:
+                for key in keys:
+                    seconds = (t2 - t1) / len(keys)
+                    timings[key] = timings.get(key, 0) + seconds
+
+        return res
+
+    start = time.perf_counter()
     if processes > 1:
         with Pool(processes) as pool:
-            for res in pool.imap_unordered(func, jobs):
-                yield res
+            try:
+                for i, res in enumerate(pool.imap_unordered(_func, _feed())):
+                    # Results completed by workers, but not consumed yet
+                    metrics.gauge("queue", len(spans) - i - 1)
+                    yield res
+                    slots.release()
+            finally:
+                # Unblock the feeder so the pool can be terminated
+                stopped.set()
     else:
-        for res in map(func, jobs):
+        for res in map(_func, jobs):
             yield res
 
+    if timings is not None and spans:
+        # Busy time of workers over their available time. The tail starts
+        # when a worker becomes idle for good: the last `processes` jobs
+        # to end are the last job of each worker.
+        wall = time.perf_counter() - start
+        busy = sum(t2 - t1 for t1, t2 in spans)
+        ends = sorted(t2 for t1, t2 in spans)[-processes:]
+        tail = ends[-1] - ends[0]
+        utilisation = busy / (wall * processes) if wall else 0
+        logger("{} jobs, utilisation: {:.1%}, tail: {:.1f}s / {:.1f}s".format(
+            len(spans), utilisation, tail, wall
+        ))
+        metrics.record("utilisation",
+                       jobs=len(spans),
+                       processes=processes,
+                       wall=wall,
+                       busy=busy,
+                       tail=tail,
+                       utilisation=utilisation)
+
 
 def _compass(args):
     acc, fasta_file, profile_db = args
-    out_file = compass(fasta_file, profile_db)
+    with metrics.timer("compass"):
+        out_file = compass(fasta_file, profile_db)
     return acc, fasta_file, out_file
 
 
-def _exec_shell(cmd, stdout=DEVNULL, stderr=DEVNULL):
-    return Popen(cmd, shell=True, stdout=stdout, stderr=stderr)
+def _compass_hit(target_id, evalue_str, start, query, target):
+    query_seq = "".join(query)
+    try:
+        evalue = float(evalue_str)
+    except ValueError:
+        evalue = 0
+
+    return {
+        "id": target_id,
+        "evalue": evalue,
+        "evaluestr": evalue_str,
+        "length": None,
+        "start": start,
+        "end": start + len(query_seq) - query_seq.count("=") - 1,
+        "sequences": {
+            "query": query_seq,
+            "target": "".join(target)
+        }
+    }
+
+
+def _compass_chunk(args):
+    queries = {}
+    results = []
+    for acc, fasta_file, profile_db in args:
+        with open(fasta_file, "rt") as fh:
+            seq_id = fh.readline()[1:].split()[0]
+
+        out_file = fasta_file[:-2] + "out"
+        queries[seq_id] = out_file
+        results.append((acc, fasta_file, out_file))
+
+    fd, query_db = mkstemp(dir=os.path.dirname(profile_db))
+    os.close(fd)
+    files_list = query_db + ".list"
+    combined = query_db + ".out"
+
+    try:
+        with open(files_list, "wt") as fh:
+            for acc, fasta_file, profile_db in args:
+                fh.write("{}\n".format(fasta_file))
+
+        with metrics.timer("compass"):
+            mk_compass_db(files_list, query_db)
+            compass_db(query_db, profile_db, combined)
+        split_compass_results(combined, queries)
+    finally:
+        _dir, prefix = os.path.split(query_db)
+        for f in os.listdir(_dir):
+            if f.startswith(prefix):
+                os.remove(os.path.join(_dir, f))
+
+    return results
+
+
+def _drop_staging_tables(cur, dbcode):
+    for table, keys in _PARTITIONED:
+        try:
+            cur.execute(
+                "DROP TABLE INTERPRO.{} PURGE".format(_staging(table, dbcode))
+            )
+        except cx_Oracle.DatabaseError:
+            # Does not exist
+            pass
+
+
+def _ends_with(filepath, suffix):
+    with open(filepath, "rb") as fh:
+        fh.seek(0, os.SEEK_END)
+        fh.seek(max(0, fh.tell() - len(suffix)))
+        return fh.read() == suffix
+
+
+def _exec_tool(name, args, stdout=None, attempt=1):
+    # `stdout`: None (discarded), PIPE (captured), or a file path
+    cmd = [TOOLS[name]] + args
+    out = None
+    t = time.perf_counter()
+    with TemporaryFile() as err:
+        if stdout is None:
+            p = Popen(cmd, stdout=DEVNULL, stderr=err)
+        elif stdout == PIPE:
+            p = Popen(cmd, stdout=PIPE, stderr=err)
+            out = p.stdout.read()
+            p.stdout.close()
+        else:
+            with open(stdout, "wb") as fh:
+                p = Popen(cmd, stdout=fh, stderr=err)
+
+        # Reap the process ourselves to get its resource usage
+        _, status, rusage = os.wait4(p.pid, 0)
+        if os.WIFSIGNALED(status):
+            p.returncode = -os.WTERMSIG(status)
+        else:
+            p.returncode = os.WEXITSTATUS(status)
+
+        err.seek(0, os.SEEK_END)
+        err.seek(max(0, err.tell() - 4096))
+        lines = err.read().decode("utf-8", "replace").splitlines()
+
+    return {
+        "tool": name,
+        "args": args,
+        "attempt": attempt,
+        "returncode": p.returncode,
+        "wall": time.perf_counter() - t,
+        "cpu_user": rusage.ru_utime,
+        "cpu_sys": rusage.ru_stime,
+        "max_rss": rusage.ru_maxrss,
+        "stderr": "\n".join(lines[-STDERR_LINES:]),
+        "stdout": out
+    }
+
+
+def _flush_compass_section(section, queries, handles):
+    for i, line in enumerate(section):
+        if i >= 3 and line.strip():
+            # First line of the first alignment block: the query
+            seq_id = line.split()[0]
+            break
+    else:
+        return
+
+    try:
+        out = queries[seq_id]
+    except KeyError:
+        return
+
+    handles[out].write("".join(section))
+
+
+def _fold_pairs(cur, dbcode):
+    # One row per unordered pair (METHOD_ID1 < METHOD_ID2), with the best
+    # E-value, and the alignments of both directions (1: ID1 -> ID2).
+    # Directional hits are then removed (not stored with pairs).
+    cur.execute(
+        """
+        INSERT /*+ APPEND */ INTO INTERPRO.{0}
+        SELECT
+          NVL(A.QUERY_ID, B.TARGET_ID),
+          NVL(A.TARGET_ID, B.QUERY_ID),
+          :1,
+          CASE WHEN B.EVALUE IS NULL OR A.EVALUE <= B.EVALUE
+            THEN A.EVALUE ELSE B.EVALUE END,
+          CASE WHEN B.EVALUE IS NULL OR A.EVALUE <= B.EVALUE
+            THEN A.EVALUE_STR ELSE B.EVALUE_STR END,
+          A.EVALUE,
+          A.DOMAINS,
+          B.EVALUE,
+          B.DOMAINS
+        FROM (
+          SELECT *
+          FROM INTERPRO.{1}
+          WHERE QUERY_ID < TARGET_ID
+        ) A
+        FULL OUTER JOIN (
+          SELECT *
+          FROM INTERPRO.{1}
+          WHERE QUERY_ID > TARGET_ID
+        ) B
+          ON A.QUERY_ID = B.TARGET_ID AND A.TARGET_ID = B.QUERY_ID
+        """.format(_staging("METHOD_SCAN_PAIR", dbcode),
+                   _staging("METHOD_SCAN", dbcode)),
+        (dbcode,)
+    )
+    cur.connection.commit()
+    cur.execute(
+        "TRUNCATE TABLE INTERPRO.{}".format(_staging("METHOD_SCAN", dbcode))
+    )
 
 
 def _hmmconvert(args):
@@ -437,12 +1452,58 @@ def _hmmconvert(args):
     return acc, hmmconvert(hmm_file)
 
 
-def _hmmscan(args):
-    acc, fasta_file, hmm_db = args
-    out_file, tab_file = hmmscan(fasta_file, hmm_db)
+def _hmmscan(args, options=None):
+    # (acc, fasta, HMM db) or (acc, fasta, shard, output prefix, models)
+    acc, fasta_file, hmm_db = args[:3]
+    prefix = None
+    if len(args) > 3:
+        prefix = args[3]
+        # Same number of models as the full database: same E-values
+        options = (options or []) + ["-Z", str(args[4])]
+
+    with metrics.timer("hmmscan"):
+        out_file, tab_file = hmmscan(fasta_file, hmm_db, options, prefix)
     return acc, fasta_file, out_file, tab_file
 
 
+def _merge_hmmscan_results(parts):
+    # Results of one query against shards of the HMM database. Sequence
+    # E-values are those of a full search (-Z), but domain E-values depend
+    # on the number of targets reported by each shard (domZ): they are
+    # rescaled to the number of targets reported by all shards.
+    shards = []
+    for out_file, tab_file in parts:
+        z = _parse_domz(out_file)
+        hits = parse_hmmscan_results(out_file, tab_file)
+        if hits and not z:
+            raise ValueError("{}: {} targets, but no domain search space "
+                             "(domZ)".format(out_file, len(hits)))
+
+        # Shards without hits do not count (domZ is 0)
+        shards.append((z or 0, hits))
+
+    domz = sum(z for z, hits in shards)
+
+    targets = []
+    for z, hits in shards:
+        for t in hits:
+            for dom in t["domains"]:
+                dom["cevalue"] *= domz / z
+                dom["ievalue"] *= domz / z
+
+            targets.append(t)
+
+    targets.sort(key=lambda t: t["evalue"])
+    return targets
+
+
+def _open(filepath, mode="rt"):
+    if filepath.lower().endswith(".gz"):
+        return gzip.open(filepath, mode)
+    else:
+        return open(filepath, mode)
+
+
 def _parse_block(fh, line):
     block = []
     while line or len(block) < 4:
@@ -460,6 +1521,16 @@ def _parse_block(fh, line):
     return target, query
 
 
+def _parse_domz(filepath):
+    p = re.compile(r"^Domain search space\s+\(domZ\):\s+(\d+)")
+    for line in iterlines(filepath):
+        m = p.match(line)
+        if m:
+            return int(m.group(1))
+
+    return None
+
+
 def _parse_hmmscan_alignments(filepath):
     domains = []
     target = ""
@@ -507,26 +1578,107 @@ def _parse_hmmscan_alignments(filepath):
 
 
 def prepare_tables(con, dbcode):
+    # Empty staging tables, with the columns of partitioned tables
+    # (keys and foreign keys are added by `exchange_partitions()`)
     cur = con.cursor()
-
-    cur.execute(
-        """
-        DELETE FROM INTERPRO.METHOD_SCAN
-        WHERE QUERY_AC IN (
-          SELECT METHOD_AC FROM INTERPRO.METHOD_SET
-          WHERE DBCODE = :1
+    _drop_staging_tables(cur, dbcode)
+    for table, keys in _PARTITIONED:
+        cur.execute(
+            """
+            CREATE TABLE INTERPRO.{} NOLOGGING
+            AS SELECT * FROM INTERPRO.{} WHERE 1 = 0
+            """.format(_staging(table, dbcode), table)
         )
-        """,
-        (dbcode,)
-    )
 
-    cur.execute(
-        """
-        DELETE FROM INTERPRO.METHOD_SET
-        WHERE DBCODE = :1
-        """,
-        (dbcode,)
-    )
-
-    con.commit()
+    # Each load has its own block of IDs, even if run concurrently
+    cur.execute("SELECT INTERPRO.METHOD_ID_SEQ.NEXTVAL FROM DUAL")
+    first_id, = cur.fetchone()
     cur.close()
+    return first_id
+
+
+def _partition(dbcode):
+    return "P_" + dbcode
+
+
+def _staging(table, dbcode):
+    # Table loaded, then exchanged with the partition of `dbcode`
+    return "{}$X{}".format(table, dbcode)
+
+
+class _RowWriter(threading.Thread):
+    # Executes batches of inserts, in the order they are put
+    def __init__(self, con, max_bytes, statements):
+        super().__init__(daemon=True)
+        self.max_bytes = max_bytes
+        self.statements = {}
+        for key, (sql, inputsizes) in statements.items():
+            cur = con.cursor()
+            if inputsizes:
+                cur.setinputsizes(*inputsizes)
+            self.statements[key] = (cur, sql)
+
+        self.batches = deque()
+        self.size = 0
+        self.closed = False
+        self.error = None
+        self.cond = threading.Condition()
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+        self.join()
+        for cur, sql in self.statements.values():
+            cur.close()
+
+        if self.error is not None:
+            raise self.error
+
+    def put(self, key, rows, size):
+        with metrics.timer("backpressure"), self.cond:
+            # Wait for room, unless the buffer is empty (oversized batch)
+            while (self.size and self.size + size > self.max_bytes
+                   and self.error is None):
+                self.cond.wait()
+
+            if self.error is not None:
+                raise self.error
+
+            self.batches.append((key, rows, size))
+            self.size += size
+            metrics.gauge("buffer", self.size)
+            self.cond.notify_all()
+
+    def run(self):
+        while True:
+            with self.cond:
+                while not self.batches and not self.closed:
+                    self.cond.wait()
+
+                if not self.batches:
+                    return
+
+                # Stays in the buffer (and counts) until inserted
+                key, rows, size = self.batches[0]
+
+            cur, sql = self.statements[key]
+            try:
+                with metrics.timer("insert"):
+                    cur.executemany(sql, rows)
+            except Exception as exc:
+                with self.cond:
+                    self.error = exc
+                    self.batches.clear()
+                    self.size = 0
+                    self.cond.notify_all()
+                return
+
+            if key == "scan":
+                metrics.count("rows", len(rows))
+
+            with self.cond:
+                self.batches.popleft()
+                self.size -= size
+                self.cond.notify_all()
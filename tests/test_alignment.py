@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import json
+
+from interprosets import alignment
+
+SEQUENCE = "MKVLAAGIVGLLLAQPSFIPGPTTPKGCTRIPSFSLSDTHWCYTHNVILSGCQDHSKS"
+
+DOMAINS = [
+    {
+        # hmmscan: lower-cased residues, insertions, substitutions
+        "start": 3,
+        "end": 30,
+        "ievalue": 3.3612345678901234e-16,
+        "query": "VLAagiVG..LLLAQPSFIPGPTTPKGCT",
+        "target": "VLSAGIWGkkLLMAE-SFIPGPST-KGCT"
+    },
+    {
+        # COMPASS: no i-Evalue, '=' gaps, reference exhausted
+        "start": 50,
+        "end": 58,
+        "ievalue": None,
+        "query": "GCQD==HSKSXY",
+        "target": "GCQDLLHSKS--"
+    },
+    {
+        "start": 1,
+        "end": 4,
+        "ievalue": 0.0,
+        "query": "MKVL",
+        "target": "MRVL"
+    }
+]
+
+
+def _rebuild(domains, sequence):
+    return [{
+        "start": start,
+        "end": end,
+        "ievalue": ievalue,
+        "query": alignment.decode_row(query, sequence, start),
+        "target": alignment.decode_row(target)
+    } for start, end, ievalue, query, target in domains]
+
+
+def test_round_trip():
+    value = alignment.encode_domains(DOMAINS, SEQUENCE)
+    assert alignment.decode_domains(value, SEQUENCE) == DOMAINS
+
+
+def test_read_encoded():
+    value = alignment.encode_domains(DOMAINS, SEQUENCE)
+    domains = alignment.read_domains(value, SEQUENCE)
+    assert _rebuild(domains, SEQUENCE) == DOMAINS
+
+
+def test_ievalue_is_exact():
+    value = alignment.encode_domains(DOMAINS, SEQUENCE)
+    domains = alignment.decode_domains(value, SEQUENCE)
+    assert [d["ievalue"] for d in domains] == [d["ievalue"] for d in DOMAINS]
+
+
+def test_compact():
+    value = alignment.encode_domains(DOMAINS, SEQUENCE)
+    assert len(value) < len(json.dumps(DOMAINS))
+
+
+def test_no_domains():
+    value = alignment.encode_domains([], SEQUENCE)
+    assert alignment.decode_domains(value, SEQUENCE) == []
+    assert alignment.read_domains(value, SEQUENCE) == []
+
+
+def test_verbose_json():
+    value = json.dumps(DOMAINS)
+    assert alignment.decode_domains(value, SEQUENCE) == DOMAINS
+    domains = alignment.read_domains(value, SEQUENCE)
+    assert _rebuild(domains, SEQUENCE) == DOMAINS
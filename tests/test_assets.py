@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from interprosets import assets
+
+ENCODINGS = ("br", "gzip")
+
+
+def test_negotiate():
+    assert assets.negotiate("gzip, deflate, br", ENCODINGS) == "br"
+    assert assets.negotiate("gzip", ENCODINGS) == "gzip"
+    assert assets.negotiate("deflate", ENCODINGS) is None
+    assert assets.negotiate("", ENCODINGS) is None
+    assert assets.negotiate(None, ENCODINGS) is None
+
+
+def test_negotiate_qvalues():
+    assert assets.negotiate("br;q=0.5, gzip;q=0.8", ENCODINGS) == "gzip"
+    assert assets.negotiate("br; q=1.0, gzip; q=1.0", ENCODINGS) == "br"
+    assert assets.negotiate("GZIP;Q=0.1", ENCODINGS) == "gzip"
+    assert assets.negotiate("br;Q=0, gzip;q=0.1", ENCODINGS) == "gzip"
+
+    # Refused encodings
+    assert assets.negotiate("br;q=0, gzip", ENCODINGS) == "gzip"
+    assert assets.negotiate("br;q=0, gzip;q=0", ENCODINGS) is None
+    assert assets.negotiate("br;q=abc, gzip;q=0.1", ENCODINGS) == "gzip"
+
+
+def test_negotiate_wildcard():
+    assert assets.negotiate("*", ENCODINGS) == "br"
+    assert assets.negotiate("*;q=0.5, br;q=0.1", ENCODINGS) == "gzip"
+    assert assets.negotiate("*;q=0, gzip", ENCODINGS) == "gzip"
+
+
+def test_find_built(tmp_path):
+    (tmp_path / "app.0123456789ab.js").write_text("app")
+    (tmp_path / "app.0123456789ab.js.gz").write_text("gzip")
+    (tmp_path / "style.0123456789ab.css").write_text("style")
+    dest = str(tmp_path)
+
+    assert assets.find_built("app.0123456789ab.js", "gzip, br", dest) == (
+        "app.0123456789ab.js.gz", "gzip"
+    )
+    # No Brotli copy
+    assert assets.find_built("app.0123456789ab.js", "br", dest) == (
+        "app.0123456789ab.js", None
+    )
+    assert assets.find_built("app.0123456789ab.js", "gzip;q=0", dest) == (
+        "app.0123456789ab.js", None
+    )
+    # No compressed copy
+    assert assets.find_built("style.0123456789ab.css", "gzip", dest) == (
+        "style.0123456789ab.css", None
+    )
+
+    (tmp_path / "app.0123456789ab.js.br").write_text("br")
+    assert assets.find_built("app.0123456789ab.js", "gzip;q=0.5, br",
+                             dest) == ("app.0123456789ab.js.br", "br")
+    assert assets.find_built("app.0123456789ab.js", "gzip, br;q=0.5",
+                             dest) == ("app.0123456789ab.js.gz", "gzip")
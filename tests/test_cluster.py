@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import numpy as np
+from scipy.sparse.csgraph import connected_components
+
+from interprosets import cluster, hits
+
+# Two triangles of strong hits (0-1-2, 3-4-5), joined by a weak hit
+# (2-3, E = 1e-5), and a node without hits (6). 1-0 is the reverse of
+# 0-1, with a better E-value.
+SRC = [0, 1, 0, 3, 4, 3, 2, 1]
+DST = [1, 2, 2, 4, 5, 5, 3, 0]
+EVALUES = [1e-50, 1e-50, 1e-50, 1e-50, 1e-50, 1e-50, 1e-5, 1e-60]
+
+
+def _matrix(cutoff):
+    scores = hits.score(np.array(EVALUES)).astype(np.float32)
+    return cluster.to_matrix(7, np.array(SRC, dtype=np.int32),
+                             np.array(DST, dtype=np.int32), scores,
+                             hits.score(cutoff))
+
+
+def _clusters(labels):
+    return [c.tolist() for c in cluster.to_clusters(labels)]
+
+
+def test_to_matrix():
+    matrix = _matrix(1e-3).toarray()
+    assert (matrix == matrix.T).all()
+    # Best score of both directions
+    assert matrix[0, 1] == 60
+    assert matrix[2, 3] == 5
+
+    # Weak hit below the cutoff
+    assert _matrix(1e-10).toarray()[2, 3] == 0
+
+
+def test_components():
+    _, labels = connected_components(_matrix(1e-10), directed=False)
+    assert _clusters(labels) == [[0, 1, 2], [3, 4, 5]]
+
+    _, labels = connected_components(_matrix(1e-3), directed=False)
+    assert _clusters(labels) == [[0, 1, 2, 3, 4, 5]]
+
+
+def test_mcl():
+    # The weak hit does not merge the triangles
+    assert _clusters(cluster.mcl(_matrix(1e-10))) == [[0, 1, 2], [3, 4, 5]]
+    assert _clusters(cluster.mcl(_matrix(1e-3))) == [[0, 1, 2], [3, 4, 5]]
+
+
+def test_to_clusters():
+    # Largest first, then by first node; single nodes are not clusters
+    labels = np.array([2, 0, 1, 0, 2, 3, 2])
+    assert _clusters(labels) == [[0, 4, 6], [1, 3]]
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+from interprosets import hits
+
+# METHOD_ID, METHOD_AC, SET_AC (no method with ID 1000003)
+METHODS = [
+    (1000001, "PF00001", "CL0001"),
+    (1000002, "PF00002", "CL0001"),
+    (1000004, "PF00004", None)
+]
+
+# QUERY_ID, TARGET_ID, EVALUE
+HITS = [
+    (1000001, 1000002, 1e-5),
+    (1000004, 1000001, 1e-3),
+    (1000003, 1000001, 1e-10),  # in range, but not a method
+    (999999, 1000001, 1e-10),   # below the range
+    (2000000, 1000002, 1e-10),  # above the range
+    (1000002, 1000004, 0.0)
+]
+
+
+class _Connection(object):
+    def cursor(self):
+        return _Cursor()
+
+
+class _Cursor(object):
+    # Methods, then hits, as returned by the two queries of `hits.load()`
+    def __init__(self):
+        self.arraysize = 100
+        self.results = [METHODS, HITS]
+        self.rows = []
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def close(self):
+        pass
+
+    def execute(self, sql, params=()):
+        self.rows = list(self.results.pop(0))
+
+    def fetchmany(self):
+        rows = self.rows[:self.arraysize]
+        self.rows = self.rows[self.arraysize:]
+        return rows
+
+
+def test_load(monkeypatch):
+    # Several chunks of hits
+    monkeypatch.setattr(hits, "FETCH_SIZE", 4)
+    accessions, sets, src, dst, evalues = hits.load(_Connection(), "H")
+
+    assert accessions == ["PF00001", "PF00002", "PF00004"]
+    assert sets == ["CL0001", "CL0001", None]
+    assert src.tolist() == [0, 2, 1]
+    assert dst.tolist() == [1, 0, 2]
+    assert evalues.tolist() == [1e-5, 1e-3, 0.0]
+
+
+def test_nodes():
+    index = np.array([0, 1, -1, 2], dtype=np.int32)
+    ids = np.array([1000001, 1000004, 1000003, 999999, 1000005, 0],
+                   dtype=np.float64)
+    assert hits._nodes(index, 1000001, ids).tolist() == [0, 2, -1, -1, -1,
+                                                          -1]
+
+
+def test_pairs():
+    # 0-1 in both directions, and twice from 1; self-hit 2-2
+    src = np.array([0, 1, 1, 2, 3], dtype=np.int32)
+    dst = np.array([1, 0, 0, 2, 1], dtype=np.int32)
+    evalues = np.array([1e-5, 1e-10, 1e-3, 1e-50, 0.0])
+
+    lo, hi, best = hits.pairs(src, dst, evalues)
+    assert sorted(zip(lo.tolist(), hi.tolist(), best.tolist())) == [
+        (0, 1, 1e-10),
+        (1, 3, 0.0)
+    ]
+
+    lo, hi, best = hits.pairs(src[:0], dst[:0], evalues[:0])
+    assert len(lo) == len(hi) == len(best) == 0
+
+
+def test_score():
+    scores = hits.score(np.array([1e-10, 1.0, 10.0, 0.0]))
+    assert scores.tolist() == [10.0, -0.0, -1.0, hits.MAX_SCORE]
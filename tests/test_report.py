@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pytest
+
+from interprosets import report
+
+ACCESSIONS = ["PF00001", "PF00002", "PF00003", "PF00004", "PF00005"]
+SETS = ["CL0001", "CL0001", "CL0002", None, "CL0003"]
+
+# Node pairs:
+#   0-1  1e-20 (reported in both directions: counted once, best E-value)
+#   0-2  1e-30 (PF00001: better hit to another set than within its set)
+#   1-2  1e-5  (PF00002: best hit within its set)
+#   0-3  1e-40 (PF00004, without set: best hit to a set)
+#   2-3  1e-8
+#   0-4  1e-15 (PF00005: no hit within its set)
+#   0-0        (self-hit: ignored)
+SRC = [0, 1, 0, 1, 3, 2, 4, 0]
+DST = [1, 0, 2, 2, 0, 3, 0, 0]
+EVALUES = [1e-10, 1e-20, 1e-30, 1e-5, 1e-40, 1e-8, 1e-15, 1e-50]
+
+
+def _compute():
+    return report.compute(ACCESSIONS, SETS, np.array(SRC, dtype=np.int32),
+                          np.array(DST, dtype=np.int32), np.array(EVALUES))
+
+
+def test_ranking():
+    ranked = [(acc, kind, rank) for acc, kind, rank, *_ in _compute()]
+    assert ranked == [
+        ("PF00003", "other_set", 1),
+        ("PF00005", "other_set", 2),
+        ("PF00001", "other_set", 3),
+        ("PF00004", "no_set", 1)
+    ]
+
+
+def test_rows():
+    rows = {row[0]: row[3:] for row in _compute()}
+
+    # Score: best to another set (30) - best within the set (20)
+    assert rows["PF00001"] == (pytest.approx(10), "CL0001", 4, 2, 1,
+                               1e-20, "CL0002", 1e-30)
+
+    # No hit within its set: best hit to another set (inf: score 0)
+    assert rows["PF00003"] == (pytest.approx(30), "CL0002", 3, 2, 1,
+                               None, "CL0001", 1e-30)
+    assert rows["PF00005"] == (pytest.approx(15), "CL0003", 1, 1, 0,
+                               None, "CL0001", 1e-15)
+
+    # Without set: best hit to a set
+    assert rows["PF00004"] == (pytest.approx(40), None, 2, 2, 0,
+                               None, "CL0001", 1e-40)
+
+    # Best hit within its set
+    assert "PF00002" not in rows
+
+
+def test_no_hits():
+    empty = np.empty(0, dtype=np.int32)
+    assert report.compute(ACCESSIONS, SETS, empty, empty,
+                          np.empty(0)) == []
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from interprosets import search
+
+MEMBERS = [
+    ("PF00001", "7tm_1", "CL0192", "Pfam"),
+    ("PF00002", "7tm_2", "CL0192", "Pfam"),
+    ("PF00012", "HSP70", "CL0108", "Pfam"),
+    ("PTHR10000", None, None, "PANTHER")
+]
+
+
+def _accessions(results):
+    return [(r["accession"], r["type"]) for r in results]
+
+
+def test_prefix():
+    index = search.Index(MEMBERS)
+    assert len(index) == 6
+    assert _accessions(index.search("PF0000")) == [
+        ("PF00001", "entry"),
+        ("PF00002", "entry")
+    ]
+    assert _accessions(index.search("PF")) == [
+        ("PF00001", "entry"),
+        ("PF00002", "entry"),
+        ("PF00012", "entry")
+    ]
+    assert _accessions(index.search("PF000011")) == []
+    assert _accessions(index.search("PTHR")) == [("PTHR10000", "entry")]
+
+    # Past the last key
+    assert index.search("zzz") == []
+
+
+def test_case_folding():
+    index = search.Index(MEMBERS)
+    assert _accessions(index.search("  hsp")) == [("PF00012", "entry")]
+    assert _accessions(index.search("cl01")) == [
+        ("CL0108", "set"),
+        ("CL0192", "set")
+    ]
+    assert index.search("  ") == []
+
+
+def test_documents():
+    index = search.Index(MEMBERS)
+
+    # Matched by accession and name: returned once
+    assert index.search("7tm_1") == index.search("pf00001")
+    assert index.search("7tm_1") == [{
+        "accession": "PF00001",
+        "name": "7tm_1",
+        "type": "entry",
+        "set": "CL0192",
+        "database": "Pfam"
+    }]
+
+    # Shared keys, then `limit`
+    assert _accessions(index.search("7tm")) == [
+        ("PF00001", "entry"),
+        ("PF00002", "entry")
+    ]
+    assert len(index.search("p", limit=2)) == 2
+
+
+def test_reload():
+    state = {"version": 1, "builds": 0}
+
+    def get_members():
+        state["builds"] += 1
+        return MEMBERS[:state["version"]]
+
+    # Version checked on each call
+    lazy = search.LazyIndex(lambda: state["version"], get_members,
+                            interval=0)
+    assert len(lazy.get()) == 2
+    assert len(lazy.get()) == 2
+    assert state["builds"] == 1
+
+    state["version"] = 3
+    assert len(lazy.get()) == 5
+    assert state["builds"] == 2
+
+
+def test_reload_interval():
+    state = {"version": 1, "checks": 0}
+
+    def get_version():
+        state["checks"] += 1
+        return state["version"]
+
+    lazy = search.LazyIndex(get_version, lambda: MEMBERS, interval=3600)
+    index = lazy.get()
+    state["version"] = 2
+    assert lazy.get() is index
+    assert state["checks"] == 1
+
+    # Interval elapsed
+    lazy.checked -= 3600
+    assert lazy.get() is not index
+    assert state["checks"] == 2
@@ -0,0 +1,247 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import contextlib
+
+import pytest
+
+from interprosets import utils
+
+
+def _hmmscan_target(acc, evalue, ievalues):
+    return {
+        "accession": acc,
+        "evalue": evalue,
+        "domains": [{
+            "cevalue": ievalue,
+            "ievalue": ievalue
+        } for ievalue in ievalues]
+    }
+
+
+def _mock_hmmscan(monkeypatch, results):
+    # `results` maps output files to (domZ, targets)
+    monkeypatch.setattr(utils, "_parse_domz",
+                        lambda out_file: results[out_file][0])
+    monkeypatch.setattr(utils, "parse_hmmscan_results",
+                        lambda out_file, tab_file: results[out_file][1])
+
+
+def test_merge_hmmscan_results(monkeypatch):
+    # Full search: three targets reported, domZ = 3, so each domain
+    # E-value is 3x its per-domain P-value. Shards report two targets
+    # (domZ = 2) and one target (domZ = 1).
+    pvalues = {"PF1": [1e-10, 4e-9], "PF2": [2e-8], "PF3": [3e-5]}
+    single = [
+        _hmmscan_target(acc, evalue, [p * 3 for p in pvalues[acc]])
+        for acc, evalue in (("PF1", 1e-12), ("PF2", 1e-9), ("PF3", 1e-6))
+    ]
+    _mock_hmmscan(monkeypatch, {
+        "shard1.out": (2, [
+            _hmmscan_target("PF1", 1e-12, [p * 2 for p in pvalues["PF1"]]),
+            _hmmscan_target("PF3", 1e-6, [p * 2 for p in pvalues["PF3"]])
+        ]),
+        "shard2.out": (1, [
+            _hmmscan_target("PF2", 1e-9, [p * 1 for p in pvalues["PF2"]])
+        ]),
+        "shard3.out": (None, [])
+    })
+
+    merged = utils._merge_hmmscan_results([
+        ("shard1.out", "shard1.tab"),
+        ("shard2.out", "shard2.tab"),
+        ("shard3.out", "shard3.tab")
+    ])
+
+    assert [t["accession"] for t in merged] == ["PF1", "PF2", "PF3"]
+    for t, expected in zip(merged, single):
+        assert t["evalue"] == expected["evalue"]
+        for dom, exp in zip(t["domains"], expected["domains"]):
+            assert dom["ievalue"] == pytest.approx(exp["ievalue"])
+            assert dom["cevalue"] == pytest.approx(exp["cevalue"])
+
+
+def test_merge_hmmscan_results_without_domz(monkeypatch):
+    _mock_hmmscan(monkeypatch, {
+        "shard1.out": (None, [_hmmscan_target("PF1", 1e-12, [1e-10])])
+    })
+
+    with pytest.raises(ValueError):
+        utils._merge_hmmscan_results([("shard1.out", "shard1.tab")])
+
+
+def test_estimate_costs(tmp_path):
+    jobs = []
+    for acc, size in (("PF1", 100), ("PF2", 200), ("PF3", 400)):
+        fasta_file = tmp_path / "{}.fa".format(acc)
+        fasta_file.write_text("A" * size)
+        jobs.append((acc, str(fasta_file), "db"))
+
+    # No durations: cost is the size of the FASTA file
+    assert utils.estimate_costs(jobs) == {"PF1": 100, "PF2": 200,
+                                          "PF3": 400}
+
+    # Known durations are kept, and calibrate the others (median rate)
+    costs = utils.estimate_costs(jobs, {"PF1": 50, "PF2": 60})
+    assert costs == {"PF1": 50, "PF2": 60, "PF3": pytest.approx(400 * 0.5)}
+
+
+COMPASS_HEADER = """\
+COMPASS 3.1
+
+Query: cd00001.fa
+"""
+
+COMPASS_HIT = """\
+Subject= cd154/gnl|CDD|{id}.fa
+length=60	filtered_length=60	Neff=1.000
+Smith-Waterman score = 254	Evalue = {evalue}
+
+gnl|CDD|1        3      PSFIPGPT==TPKG
+CONSENSUS_1      3      PSFIPGPT==TPKG
+                        P++IP+ T
+CONSENSUS_2      1      PNLIPADTGLLSGE
+gnl|CDD|{id}        1      PNLIPADTGLLSGE
+
+gnl|CDD|1               WCYTH
+CONSENSUS_1             WCYTH
+                        WCYT+
+CONSENSUS_2             WCYTN
+gnl|CDD|{id}               WCYTN
+
+"""
+
+COMPASS_FOOTER = """\
+Parameters:
+  Gap open = 10
+"""
+
+
+def _compass_output(tmp_path, hits, footer=True):
+    out_file = tmp_path / "compass.out"
+    out_file.write_text(
+        COMPASS_HEADER
+        + "".join(COMPASS_HIT.format(id=i, evalue=e) for i, e in hits)
+        + (COMPASS_FOOTER if footer else "")
+    )
+    return str(out_file)
+
+
+def test_compass_results(tmp_path):
+    out_file = _compass_output(tmp_path, [(2, "1e-20"), (3, "4.5e-7")])
+    hits = utils.parse_compass_results(out_file)
+    assert [(h["id"], h["evalue"]) for h in hits] == [
+        ("gnl|CDD|2", 1e-20),
+        ("gnl|CDD|3", 4.5e-7)
+    ]
+
+    hit = hits[0]
+    assert hit["start"] == 3
+    assert hit["end"] == 3 + len("PSFIPGPTTPKGWCYTH") - 1
+    assert hit["sequences"] == {
+        "query": "PSFIPGPT==TPKGWCYTH",
+        "target": "PNLIPADTGLLSGEWCYTN"
+    }
+
+
+def test_compass_results_keep_best_hit(tmp_path):
+    out_file = _compass_output(tmp_path, [(2, "1e-20"), (2, "1e-3")])
+    hits = utils.parse_compass_results(out_file)
+    assert [(h["id"], h["evalue"]) for h in hits] == [("gnl|CDD|2", 1e-20)]
+
+
+def test_compass_results_empty(tmp_path):
+    assert utils.parse_compass_results(_compass_output(tmp_path, [])) == []
+
+    out_file = tmp_path / "empty.out"
+    out_file.write_text("")
+    assert utils.parse_compass_results(str(out_file)) == []
+
+
+def test_compass_results_truncated(tmp_path):
+    # Process killed while writing the last block of the second hit
+    out_file = _compass_output(tmp_path, [(2, "1e-20"), (3, "4.5e-7")],
+                               footer=False)
+    with open(out_file, "rt") as fh:
+        text = fh.read()
+    with open(out_file, "wt") as fh:
+        fh.write(text[:text.rindex("CONSENSUS_2")])
+
+    hits = utils.parse_compass_results(out_file)
+    assert [h["id"] for h in hits] == ["gnl|CDD|2"]
+
+    # Truncated in the header of a hit
+    with open(out_file, "wt") as fh:
+        fh.write(text[:text.rindex("Smith-Waterman")])
+
+    hits = utils.parse_compass_results(out_file)
+    assert [h["id"] for h in hits] == ["gnl|CDD|2"]
+
+
+def test_compass_results_top_k(tmp_path, monkeypatch):
+    out_file = _compass_output(tmp_path, [(i, "1e-{}".format(30 - i))
+                                          for i in range(2, 7)])
+    with open(out_file, "rt") as fh:
+        text = fh.read()
+
+    # Lines read by the parser
+    lines = []
+
+    @contextlib.contextmanager
+    def _open(filepath, mode="rt"):
+        def it():
+            for line in text.splitlines(True):
+                lines.append(line)
+                yield line
+
+        yield it()
+
+    monkeypatch.setattr(utils, "_open", _open)
+    hits = utils.parse_compass_results(out_file, top_k=2)
+    assert [h["id"] for h in hits] == ["gnl|CDD|2", "gnl|CDD|3"]
+
+    # Stopped at the header of the third hit
+    assert lines[-1].startswith("Subject=")
+    assert "".join(lines) == text[:text.index("Subject= cd154/gnl|CDD|4")
+                                  + len(lines[-1])]
+
+
+def _targets(*evalues):
+    return [{"id": i, "evalue": evalue} for i, evalue in enumerate(evalues)]
+
+
+def test_prune_targets_max_evalue():
+    targets = _targets(1e-10, 1e-5, 1e-5 * 1.0000001, 1)
+
+    # Inclusive bound
+    pruned = utils.prune_targets(targets, max_evalue=1e-5)
+    assert [t["id"] for t in pruned] == [0, 1]
+
+    assert utils.prune_targets(targets) == targets
+    assert utils.prune_targets(targets, max_evalue=0) == []
+
+
+def test_prune_targets_top_k():
+    targets = _targets(1e-3, 1e-10, 1e-5, 1e-10, 1e-5)
+
+    pruned = utils.prune_targets(targets, top_k=3)
+    assert [t["id"] for t in pruned] == [1, 3, 2]
+
+    # Ties at the cutoff: first reported target kept (stable sort)
+    pruned = utils.prune_targets(targets, top_k=1)
+    assert [t["id"] for t in pruned] == [1]
+
+    # Fewer targets than `top_k`: order unchanged
+    assert utils.prune_targets(targets, top_k=5) == targets
+    assert utils.prune_targets(targets, top_k=0) == targets
+
+
+def test_prune_targets_both():
+    targets = _targets(1e-3, 1e-10, 1e-5, 1e-10, 1e-5, 1e-8)
+
+    # E-value cutoff first, then the best of the remaining targets
+    pruned = utils.prune_targets(targets, max_evalue=1e-5, top_k=3)
+    assert [t["id"] for t in pruned] == [1, 3, 5]
+
+    pruned = utils.prune_targets(targets, max_evalue=1e-9, top_k=3)
+    assert [t["id"] for t in pruned] == [1, 3]